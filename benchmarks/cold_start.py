@@ -0,0 +1,79 @@
+"""Cold-start benchmark of Typpete
+
+Every measurement runs in a fresh interpreter, because the start-up (the imports, the loading of
+libz3 and the creation of the Z3 context) is paid again by every invocation on a file:
+
+- `import z3`: the Z3 bindings,
+- `import typpete`: the inference runner and all the modules it imports,
+- `infer`: the whole inference of a small program with the command line runner.
+
+The first run of every measurement is discarded, so that the compiled modules are cached as they are
+in an installed Typpete.
+
+Usage:
+    python benchmarks/cold_start.py [--runs N] [program.py]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROGRAM = """class Point:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def add(self, other):
+        return Point(self.x + other.x, self.y + other.y)
+
+
+p = Point(1, 2).add(Point(3, 4))
+"""
+
+
+def time_command(args, cwd):
+    """Return the wall time in seconds of running the command to completion"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    start = time.perf_counter()
+    subprocess.run(args, cwd=cwd, env=env, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="number of runs of every measurement")
+    parser.add_argument("program", nargs="?", help="program to infer (default: a small class)")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        if args.program:
+            shutil.copy(args.program, os.path.join(work_dir, "program.py"))
+        else:
+            with open(os.path.join(work_dir, "program.py"), "w") as program:
+                program.write(PROGRAM)
+
+        cases = [
+            ("import z3", [sys.executable, "-c", "import z3"]),
+            ("import typpete", [sys.executable, "-c", "import typpete.inference_runner"]),
+            ("infer", [sys.executable, "-m", "typpete.inference_runner", "program"]),
+        ]
+        print("{:<16}{:>12}{:>12}".format("", "min (s)", "median (s)"))
+        for name, command in cases:
+            time_command(command, work_dir)
+            times = [time_command(command, work_dir) for _ in range(args.runs)]
+            print("{:<16}{:>12.3f}{:>12.3f}".format(name, min(times), statistics.median(times)))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
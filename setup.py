@@ -17,7 +17,10 @@ config = {
     'scripts': [],
     'name': 'Typpete',
     'entry_points': {
-        'console_scripts': ['typpete=typpete.inference_runner:run_inference'],
+        'console_scripts': ['typpete=typpete.inference_runner:run_inference',
+                            'typpete-daemon=typpete.daemon:run_daemon',
+                            'typpete-client=typpete.daemon:run_client',
+                            'typpete-lsp=typpete.lsp_server:run_lsp_server'],
     }
 }
 
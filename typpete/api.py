@@ -0,0 +1,136 @@
+"""In-memory API of the type inference, for tools embedding Typpete
+
+    >>> result = infer_source({"shapes": "class Square: ...", "main": "from shapes import Square\\n..."}, "main")
+    >>> result.sat
+    True
+    >>> print(result.typed_sources["main"])
+
+Unlike the command line, nothing is written to disk unless an `output_folder` is given.
+"""
+import os
+import threading
+import time
+
+from typpete import inference_runner
+from typpete.src import z3_types
+from typpete.src.config import config
+from typpete.src.import_handler import ImportHandler, parse_source, write_if_changed
+
+# The inference runs on the global configuration and module caches of the process, so only one runs at a time
+_inference_lock = threading.Lock()
+
+
+class InferenceResult:
+    """The result of the type inference of a program
+
+    :ivar check: The result of the constraints check: 'sat', 'unsat' or 'unknown'. With soft constraints,
+                 'unknown' is reported when the optimization was not proven optimal, and still comes with types.
+    :ivar typed_sources: The annotated sources of the inferred user modules, by module name
+    :ivar unsat_errors: The errors of the violated constraints if the program is not well-typed.
+                        The typed sources then hold the types of the best relaxed model.
+    :ivar type_indexes: The TypeIndex of the inferred types by source position, by module name
+    :ivar timings: The seconds taken by the constraints collection and solving
+    """
+
+    def __init__(self, check, typed_sources, type_indexes, unsat_errors, timings):
+        self.check = check
+        self.typed_sources = typed_sources
+        self.type_indexes = type_indexes
+        self.unsat_errors = unsat_errors
+        self.timings = timings
+
+    def type_at(self, module, line, column):
+        """Return the inferred type of the innermost annotated element at the given position, or None"""
+        entry = self.type_indexes[module].at(line, column)
+        return entry.type if entry is not None else None
+
+    @property
+    def sat(self):
+        return self.check != 'unsat'
+
+    def __repr__(self):
+        return "InferenceResult(check={!r}, modules={!r})".format(self.check, sorted(self.typed_sources))
+
+
+def get_source_path(module_name, module_names):
+    """Return the relative path which the module with the given name would have in a project folder"""
+    path = module_name.replace('.', '/')
+    if any(name.startswith(module_name + '.') for name in module_names):
+        return path + '/__init__.py'
+    return path + '.py'
+
+
+def infer_source(sources, entry, base_folder='', output_folder=None, class_type_params=None, type_params=None,
+                 **flags):
+    """Infer the types of a program given by its sources
+
+    :param sources: The sources of the user modules, by (dotted) module name
+    :param entry: The name of the module to infer, whose imports are inferred along with it
+    :param base_folder: The folder where the user modules missing from `sources` are looked up
+    :param output_folder: If given, the annotated sources are also written to this folder
+    :param class_type_params: The type parameters of generic classes, e.g., {'Box': ['Box0']}
+    :param type_params: The type parameters of generic functions, e.g., {'make': ['make0']}
+    :param flags: Configuration flags overriding the ones in `config.py` for this inference
+    :return: The InferenceResult
+
+    The inference overrides the global configuration and resets the module caches of the process, so it is
+    not reentrant: concurrent calls from several threads wait for each other, and the `config` dictionary
+    must not be changed while an inference runs. The solver and the contexts of the inference are released
+    once the result is built; the result only holds the annotated sources and the type indexes.
+    """
+    if entry not in sources:
+        raise ValueError("The entry module {} is not in the sources".format(entry))
+    for flag in flags:
+        if flag not in config:
+            raise TypeError("Unknown configuration flag {}".format(flag))
+
+    with _inference_lock:
+        return _infer_source(sources, entry, base_folder, output_folder, class_type_params, type_params, flags)
+
+
+def _infer_source(sources, entry, base_folder, output_folder, class_type_params, type_params, flags):
+    previous_config = dict(config)
+    config.update(flags)
+    # The inference annotates the cached ASTs, so every inference starts from freshly parsed modules
+    ImportHandler.reset()
+    try:
+        for module_name, source in sources.items():
+            tree, source_hash, _ = parse_source(source)
+            ImportHandler.add_parsed_module(module_name.replace('.', '/'), get_source_path(module_name, sources),
+                                            tree, source_hash)
+            ImportHandler.module_sources[module_name.replace('.', '/')] = source
+        t = ImportHandler.get_module_ast(entry, base_folder)
+
+        start_time = time.time()
+        solver, context = inference_runner.collect_constraints(t, base_folder, class_type_params, type_params)
+        collection_time = time.time() - start_time
+
+        start_time = time.time()
+        check = inference_runner.solve_constraints(solver)
+        unsat_errors = []
+        if check == z3_types.unsat:
+            model, unsat_errors = inference_runner.solve_relaxed(solver)
+        else:
+            model = inference_runner.get_model(solver)
+        solving_time = time.time() - start_time
+
+        context.generate_typed_ast(model, solver)
+        typed_sources = {entry: ImportHandler.get_typed_source(entry.replace('.', '/'), t, context)}
+        type_indexes = {entry: context.type_index}
+        paths = {entry: ImportHandler.module_to_path[entry.replace('.', '/')]}
+        for module, path, module_ast, module_context in ImportHandler.generate_typed_modules(model, solver):
+            typed_sources[module.replace('/', '.')] = ImportHandler.get_typed_source(module, module_ast,
+                                                                                     module_context)
+            type_indexes[module.replace('/', '.')] = module_context.type_index
+            paths[module.replace('/', '.')] = path
+        if output_folder is not None:
+            for module, source in typed_sources.items():
+                write_if_changed(os.path.join(output_folder, paths[module]), source)
+    finally:
+        config.clear()
+        config.update(previous_config)
+        # Release the annotated modules and their contexts, which hold the Z3 declarations of the program
+        ImportHandler.reset()
+
+    return InferenceResult(str(check), typed_sources, type_indexes, unsat_errors,
+                           {"collection": collection_time, "solving": solving_time})
@@ -0,0 +1,155 @@
+"""Typpete daemon, serving inference requests over a Unix-domain socket
+
+The daemon keeps the Python modules, libz3 and the in-memory module cache loaded between the
+requests, while every request gets a new Z3 context. Each request is a JSON-RPC 2.0 message on
+a single line, and so is each response:
+
+    {"jsonrpc": "2.0", "id": 1, "method": "infer", "params": {"cwd": "...", "args": ["file.py", "--flag=True"]}}
+    {"jsonrpc": "2.0", "id": 1, "result": {"output": "..."}}
+
+The `args` of an `infer` request are the command line arguments of `typpete`. The `shutdown`
+method stops the daemon. The client is kept thin: it does not import the type inference.
+"""
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import traceback
+from contextlib import redirect_stdout
+
+
+def get_default_socket_path():
+    return os.path.join(tempfile.gettempdir(), "typpete-{}.sock".format(os.getuid()))
+
+
+class InferenceRequestHandler(socketserver.StreamRequestHandler):
+    """Handles the requests sent through one connection to the daemon"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode())
+                request_id = request.get("id")
+                method = request["method"]
+                params = request.get("params", {})
+            except (ValueError, KeyError, AttributeError):
+                self.respond(None, error={"code": -32700, "message": "Invalid request"})
+                continue
+
+            if method == "infer":
+                try:
+                    output = self.server.infer(params.get("cwd", os.getcwd()), params.get("args", []))
+                    self.respond(request_id, result={"output": output})
+                except Exception:
+                    self.respond(request_id, error={"code": 1, "message": traceback.format_exc()})
+            elif method == "shutdown":
+                self.respond(request_id, result={})
+                self.server.shutdown_requested = True
+                return
+            else:
+                self.respond(request_id, error={"code": -32601, "message": "Unknown method {}".format(method)})
+
+    def respond(self, request_id, result=None, error=None):
+        response = {"jsonrpc": "2.0", "id": request_id}
+        if error is not None:
+            response["error"] = error
+        else:
+            response["result"] = result
+        self.wfile.write((json.dumps(response) + "\n").encode())
+        self.wfile.flush()
+
+
+class InferenceServer(socketserver.UnixStreamServer):
+    """Serves the inference requests one at a time, each one in an isolated session"""
+
+    def __init__(self, socket_path):
+        # Import the type inference once, loading libz3 and the stubs' dependencies
+        from typpete import inference_runner
+        from typpete.src import config, module_cache
+        self.inference_runner = inference_runner
+        self.config = config.config
+        self.default_config = dict(config.config)
+        module_cache.memory = module_cache.MemoryCache()
+
+        self.shutdown_requested = False
+        super().__init__(socket_path, InferenceRequestHandler)
+
+    def infer(self, cwd, args):
+        """Run the inference with the given command line arguments, returning its output"""
+        from typpete.src import z3_types
+        from typpete.src.import_handler import ImportHandler
+
+        # Start every session from the default configuration, without the ASTs and the Z3 declarations
+        # of the previous one
+        self.config.clear()
+        self.config.update(self.default_config)
+        ImportHandler.reset()
+        z3_types.reset_main_context()
+
+        output = io.StringIO()
+        previous_cwd, previous_argv = os.getcwd(), sys.argv
+        try:
+            os.chdir(cwd)
+            sys.argv = ["typpete"] + list(args)
+            with redirect_stdout(output):
+                self.inference_runner.run_inference()
+        finally:
+            os.chdir(previous_cwd)
+            sys.argv = previous_argv
+        return output.getvalue()
+
+    def serve_until_shutdown(self):
+        while not self.shutdown_requested:
+            self.handle_request()
+
+
+def run_daemon():
+    """Start the daemon, listening on the socket given as argument or on the default socket"""
+    socket_path = sys.argv[1] if len(sys.argv) >= 2 else get_default_socket_path()
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = InferenceServer(socket_path)
+    print("Typpete daemon listening on {}".format(socket_path))
+    try:
+        server.serve_until_shutdown()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+def send_request(method, params=None, socket_path=None):
+    """Send a request to the daemon, returning its response"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path or get_default_socket_path())
+    try:
+        request = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params or {}}
+        client.sendall((json.dumps(request) + "\n").encode())
+        return json.loads(client.makefile().readline())
+    finally:
+        client.close()
+
+
+def run_client():
+    """Send the command line arguments as an inference request to the daemon, and print the result"""
+    socket_path = os.environ.get("TYPPETE_SOCKET")
+    if len(sys.argv) >= 2 and sys.argv[1] == "--shutdown":
+        send_request("shutdown", socket_path=socket_path)
+        return
+    try:
+        response = send_request("infer", {"cwd": os.getcwd(), "args": sys.argv[1:]}, socket_path)
+    except OSError:
+        print("The Typpete daemon is not running. Start it with `typpete-daemon`.")
+        sys.exit(1)
+    if "error" in response:
+        print(response["error"]["message"])
+        sys.exit(1)
+    print(response["result"]["output"], end="")
+
+
+if __name__ == "__main__":
+    run_daemon()
@@ -1,11 +1,11 @@
 from typpete.src.stmt_inferrer import *
-from typpete.src.import_handler import ImportHandler
+from typpete.src.import_handler import ImportHandler, write_if_changed, write_type_index
+from typpete.src import constraints_log, result_cache, result_writer, smt2_problem
 import typpete.src.config as config
 from z3 import Optimize
 
 import os
 import time
-import astunparse
 import sys
 
 
@@ -38,8 +38,12 @@ def configure_inference(flags):
                 count = int(flag_value[i + 1])
                 type_vars = ['{}{}'.format(cls_name, i) for i in range(count)]
                 class_type_params[cls_name] = type_vars
-        elif flag_name in config.config:
+        elif flag_name in config.config and isinstance(config.config[flag_name], bool):
             config.config[flag_name] = flag_value == 'True'
+        elif flag_name in config.config and isinstance(config.config[flag_name], int):
+            config.config[flag_name] = int(flag_value)
+        elif flag_name in config.config:
+            config.config[flag_name] = flag_value
         else:
             print("Invalid flag {}. Ignoring.".format(flag_name))
     return class_type_params, func_type_params
@@ -51,6 +55,18 @@ def print_help():
                "allow_attributes_outside_init",
                "none_subtype_of_all",
                "enable_soft_constraints",
+               "parallel_parsing",
+               "cache_modules",
+               "cache_results",
+               "result_cache_size",
+               "cache_folder",
+               "output_type_index",
+               "result_format",
+               "preserve_formatting",
+               "output_diffs",
+               "constraints_log",
+               "compress_constraints_log",
+               "emit_smt2",
                "func_type_params",
                "class_type_params"]
     descriptions = ["Whether to ignore the body of fully annotated functions"
@@ -59,20 +75,100 @@ def print_help():
                     "Whether to allow to de- fine instance attribute outside __init__.",
                     "Whether to make None a sub-type of all types.",
                     "Whether to use soft con- straints to infer more precise types for local variables.",
+                    "Whether to parse the imported modules in parallel.",
+                    "Whether to cache the parsed and pre-analyzed modules on disk.",
+                    "Whether to reuse the stored result for unchanged sources and configuration.",
+                    "The maximum size of the stored inference results in megabytes.",
+                    "The folder holding the on-disk caches.",
+                    "Whether to write the inferred types by source position next to the annotated modules.",
+                    "The format (json or binary) of a file summarizing the inferred types, if any.",
+                    "Whether to insert the annotations into the original sources, keeping their formatting.",
+                    "Whether to write unified diffs against the original sources instead of annotated modules.",
+                    "The format (text or smt2) of a log of the collected constraints, if any.",
+                    "Whether to compress the constraints log with gzip.",
+                    "Whether to export the inference problem to a self-contained SMT-LIB file.",
                     "Type parameters required by generic functions.",
                     "Type parameters required by generic classes."]
 
     print("Typpete: Static type inference for Python 3")
     print("Usage:")
     print("\ttyppete file_path [working_directory] [options]")
+    print("\ttyppete --replay problem_path [options]")
     print()
     print("Options:")
     for i, option in enumerate(options):
         print("\t--{}:\t{}".format(option, descriptions[i]))
 
 
+def collect_constraints(t, base_folder='', class_type_params=None, func_type_params=None, deadline=None):
+    """Create a solver for the module AST `t` and collect the type constraints of the module
+
+    If a deadline (a time as returned by `time.time()`) is given, the collection is given up with a
+    `TimeoutError` once the deadline passed. It is checked between the top-level statements of the module.
+    :return: The solver and the context of the module
+    """
+    solver = z3_types.TypesSolver(t, base_folder=base_folder, type_params=func_type_params,
+                                  class_type_params=class_type_params)
+
+    context = Context(t, t.body, solver)
+    context.type_params = solver.config.type_params
+    context.class_type_params = solver.config.class_type_params
+    solver.infer_stubs(context, infer)
+
+    for stmt in t.body:
+        if deadline is not None and time.time() >= deadline:
+            raise TimeoutError("The constraints collection exceeded its deadline")
+        infer(stmt, context, solver)
+
+    solver.push()
+    return solver, context
+
+
+def solve_constraints(solver, timeout=None):
+    """Check the collected constraints, giving up (with result `unknown`) after `timeout` milliseconds if given"""
+    if config.config['enable_soft_constraints']:
+        if timeout is not None:
+            solver.optimize.set(timeout=timeout)
+        return solver.optimize.check()
+    if timeout is not None:
+        solver.set(timeout=timeout)
+    return solver.check(solver.assertions_vars)
+
+
+def get_model(solver):
+    """Return the model of the satisfiable constraints"""
+    if config.config['enable_soft_constraints']:
+        return solver.optimize.model()
+    return solver.model()
+
+
+def solve_relaxed(solver):
+    """Find a model satisfying as many of the (unsatisfiable) type constraints as possible
+
+    :return: The model, and the error messages of the constraints it violates
+    """
+    opt = Optimize(solver.ctx)
+    for av in solver.assertions_vars:
+        opt.add_soft(av)
+    for a in solver.all_assertions:
+        opt.add(a)
+    for a in solver.z3_types.subtyping:
+        opt.add(a)
+    for a in solver.z3_types.subst_axioms:
+        opt.add(a)
+    for a in solver.forced:
+        opt.add(a)
+    opt.check()
+    model = opt.model()
+    return model, [solver.assertions_errors[av] for av in solver.assertions_vars if not model[av]]
+
+
 def run_inference(file_name=None, base_folder=None):
     if not file_name:
+        if len(sys.argv) >= 3 and sys.argv[1] == '--replay':
+            configure_inference([flag for flag in sys.argv[3:] if flag.startswith("--")])
+            replay_inference(sys.argv[2])
+            return
         if len(sys.argv) >= 2 and sys.argv[1] != '--help':
             file_name = sys.argv[1]
             if len(sys.argv) >= 3:
@@ -89,30 +185,33 @@ def run_inference(file_name=None, base_folder=None):
     if file_name.endswith('.py'):
         file_name = file_name[:-3]
 
+    if config.config['parallel_parsing']:
+        ImportHandler.prefetch_module_asts(file_name, base_folder)
     t = ImportHandler.get_module_ast(file_name, base_folder)
 
-    solver = z3_types.TypesSolver(t, base_folder=base_folder, type_params=func_type_params,
-                                  class_type_params=class_type_params)
-
-    context = Context(t, t.body, solver)
-    context.type_params = solver.config.type_params
-    context.class_type_params = solver.config.class_type_params
-    solver.infer_stubs(context, infer)
+    if config.config['cache_results']:
+        module_hashes = ImportHandler.get_import_closure(file_name, base_folder)
+        result_key = result_cache.get_result_key(file_name, base_folder, module_hashes,
+                                                 class_type_params, func_type_params)
+        cached_messages = result_cache.load_result(result_key)
+        if cached_messages is not None:
+            print("Using the cached inference result")
+            for message in cached_messages:
+                print(message)
+            return
 
-    for stmt in t.body:
-        infer(stmt, context, solver)
+    # The reported messages and the written files, to be stored in the result cache
+    messages = []
+    written_files = []
 
-    solver.push()
-    end_time = time.time()
-    print("Constraints collection took  {}s".format(end_time - start_time))
+    def report(message):
+        print(message)
+        messages.append(message)
 
-    start_time = time.time()
-    if config.config['enable_soft_constraints']:
-        check = solver.optimize.check()
-    else:
-        check = solver.check(solver.assertions_vars)
+    solver, context = collect_constraints(t, base_folder, class_type_params, func_type_params)
     end_time = time.time()
-    print("Constraints solving took  {}s".format(end_time - start_time))
+    report("Constraints collection took  {}s".format(end_time - start_time))
+    timings = {"collection": end_time - start_time}
 
     write_path = "inference_output/" + base_folder
     if not os.path.exists(write_path):
@@ -121,14 +220,32 @@ def run_inference(file_name=None, base_folder=None):
     if write_path.endswith('/'):
         write_path = write_path[:-1]
 
-    file = open(write_path + '/{}_constraints_log.txt'.format(file_name.replace('/', '.')), 'w')
-    file.write(print_solver(solver))
-    file.close()
+    if config.config['emit_smt2']:
+        # Exported before solving, to reproduce the problems which the solver does not finish
+        problem_path = write_path + '/{}_problem.smt2'.format(file_name.replace('/', '.'))
+        report("Writing the inference problem to {}".format(problem_path))
+        modules = [(file_name.replace('/', '.'), ImportHandler.get_source(file_name),
+                    (write_path + '/' + file_name + '.py')[len("inference_output/"):], context)]
+        modules += [(module.replace('/', '.'), ImportHandler.get_source(module), module_path, module_context)
+                    for module, module_path, _, module_context in ImportHandler.get_inferred_modules()]
+        written_files.append(smt2_problem.write_problem(solver, modules, problem_path))
+
+    start_time = time.time()
+    check = solve_constraints(solver)
+    end_time = time.time()
+    report("Constraints solving took  {}s".format(end_time - start_time))
+    timings["solving"] = end_time - start_time
+
+    if config.config['constraints_log']:
+        log_path = constraints_log.write_constraints_log(
+            solver, write_path + '/{}_constraints_log'.format(file_name.replace('/', '.')),
+            config.config['constraints_log'], config.config['compress_constraints_log'])
+        written_files.append(log_path)
 
     if check == z3_types.unsat:
-        print("Check: unsat")
+        report("Check: unsat")
         if config.config["print_unsat_core"]:
-            print("Writing unsat core to {}".format(write_path))
+            report("Writing unsat core to {}".format(write_path))
             if config.config['enable_soft_constraints']:
                 solver.check(solver.assertions_vars)
                 core = solver.unsat_core()
@@ -138,78 +255,85 @@ def run_inference(file_name=None, base_folder=None):
             file = open(write_path + '/{}_unsat_core.txt'.format(file_name), 'w')
             file.write(core_string)
             file.close()
-            model = None
-            
-            opt = Optimize(solver.ctx)
-            for av in solver.assertions_vars:
-                opt.add_soft(av)
-            for a in solver.all_assertions:
-                opt.add(a)
-            for a in solver.z3_types.subtyping:
-                opt.add(a)
-            for a in solver.z3_types.subst_axioms:
-                opt.add(a)
-            for a in solver.forced:
-                opt.add(a)
-            start_time = time.time()
-            opt.check()
-            model = opt.model()
-            end_time = time.time()
-            print("Solving relaxed model took  {}s".format(end_time - start_time))
-            for av in solver.assertions_vars:
-                if not model[av]:
-                    print("Unsat:")
-                    print(solver.assertions_errors[av])
-        else:
-            opt = Optimize(solver.ctx)
-            for av in solver.assertions_vars:
-                opt.add_soft(av)
-            for a in solver.all_assertions:
-                opt.add(a)
-            for a in solver.z3_types.subtyping:
-                opt.add(a)
-            for a in solver.z3_types.subst_axioms:
-                opt.add(a)
-            for a in solver.forced:
-                opt.add(a)
-            start_time = time.time()
-            opt.check()
-            model = opt.model()
-            end_time = time.time()
-            print("Solving relaxed model took  {}s".format(end_time - start_time))
-            for av in solver.assertions_vars:
-                if not model[av]:
-                    print("Unsat:")
-                    print(solver.assertions_errors[av])
+            written_files.append(write_path + '/{}_unsat_core.txt'.format(file_name))
+
+        start_time = time.time()
+        model, unsat_errors = solve_relaxed(solver)
+        end_time = time.time()
+        report("Solving relaxed model took  {}s".format(end_time - start_time))
+        timings["relaxed_solving"] = end_time - start_time
+        for error in unsat_errors:
+            report("Unsat:")
+            report(error)
     else:
-        if config.config['enable_soft_constraints']:
-            model = solver.optimize.model()
-        else:
-            model = solver.model()
+        model = get_model(solver)
+
+    writer = None
+    result_format = config.config['result_format']
+    if result_format:
+        result_path = write_path + '/{}_result.{}'.format(file_name.replace('/', '.'),
+                                                          result_writer.FILE_EXTENSIONS[result_format])
+        writer = result_writer.ResultWriter(result_path, result_format, {"file": file_name, "check": str(check)})
+        written_files.append(result_path)
 
     if model is not None:
-        print("Writing output to {}".format(write_path))
+        report("Writing output to {}".format(write_path))
+        start_time = time.time()
         context.generate_typed_ast(model, solver)
-        ImportHandler.add_required_imports(file_name, t, context)
 
         write_path += '/' + file_name + '.py'
 
-        if not os.path.exists(os.path.dirname(write_path)):
-            os.makedirs(os.path.dirname(write_path))
-        file = open(write_path, 'w')
-        file.write(astunparse.unparse(t))
-        file.close()
+        written_files.append(ImportHandler.write_typed_module(file_name, write_path, t, context))
+        if config.config['output_type_index']:
+            written_files.append(write_type_index(write_path, context.type_index))
+        if writer is not None:
+            writer.write_module(file_name.replace('/', '.'), context.type_index)
+
+        written_files += ImportHandler.write_to_files(model, solver, result_writer=writer)
+        timings["output"] = time.time() - start_time
+
+    if writer is not None:
+        writer.close(timings)
+
+    if config.config['cache_results']:
+        result_cache.store_result(result_key, written_files, messages)
+
+
+def replay_inference(problem_path, output_folder="inference_output"):
+    """Solve a problem exported with `emit_smt2` and annotate the sources it holds with the inferred types"""
+    start_time = time.time()
+    metadata = smt2_problem.read_metadata(problem_path)
+    check, model, unsat_errors = smt2_problem.solve_problem(problem_path, metadata)
+    end_time = time.time()
+    print("Constraints solving took  {}s".format(end_time - start_time))
+    timings = {"solving": end_time - start_time}
+    if check == z3_types.unsat:
+        print("Check: unsat")
+        for error in unsat_errors:
+            print("Unsat:")
+            print(error)
+
+    writer = None
+    result_format = config.config['result_format']
+    if result_format:
+        result_path = os.path.splitext(problem_path)[0] + '_result.' + result_writer.FILE_EXTENSIONS[result_format]
+        writer = result_writer.ResultWriter(result_path, result_format, {"file": problem_path, "check": str(check)})
 
-        ImportHandler.write_to_files(model, solver)
+    print("Writing output to {}".format(output_folder))
+    start_time = time.time()
+    decoder = smt2_problem.ProblemDecoder(metadata, model)
+    for module_metadata in metadata["modules"]:
+        module = decoder.decode_module(module_metadata)
+        write_path = output_folder + '/' + module_metadata["output"]
+        write_if_changed(write_path, decoder.get_typed_source(module_metadata, module))
+        if config.config['output_type_index']:
+            write_type_index(write_path, module.type_index)
+        if writer is not None:
+            writer.write_module(module_metadata["module"], module.type_index)
+    timings["output"] = time.time() - start_time
 
-def print_solver(z3solver):
-    printer = z3_types.z3printer
-    printer.set_pp_option('max_lines', 4000)
-    printer.set_pp_option('max_width', 1000)
-    printer.set_pp_option('max_visited', 10000000)
-    printer.set_pp_option('max_depth', 1000000)
-    printer.set_pp_option('max_args', 512)
-    return str(z3solver)
+    if writer is not None:
+        writer.close(timings)
 
 
 def print_context(ctx, model, ind=""):
@@ -235,9 +359,4 @@ def print_context(ctx, model, ind=""):
         print("---------------------------")
 
 if __name__ == '__main__':
-    if len(sys.argv) > 1:
-        file_path = sys.argv[1]
-        base_folder = sys.argv[2] if len(sys.argv) >= 3 else None
-        run_inference(file_path, base_folder)
-    else:
-        print_help()
+    run_inference()
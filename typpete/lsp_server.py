@@ -0,0 +1,466 @@
+"""Language server for Typpete, speaking the Language Server Protocol over stdin/stdout
+
+The server provides hovers with the inferred types of the variables, arguments and attributes, looked
+up in the type index of the last result, and with the inferred signature of the enclosing function or
+method elsewhere. The inference runs in a background thread, so hovers are always answered right away
+from the last result.
+
+When a document is opened or saved, the whole file is inferred. When it is edited, the whole file is
+inferred again with a new solver, including the pre-analysis, the stubs and the module-level statements,
+but only the bodies of the functions and methods which changed generate constraints: every other
+function is replaced by its last inferred (fully annotated) definition, whose signature is then taken
+as fixed, like with `ignore_fully_annotated_function`. This problem is solved within the latency budget
+`lsp_latency_budget` (in milliseconds), which covers both the collection of the constraints and
+their solving. If the budget is exceeded, the last whole-file result is kept, and the whole file is
+inferred again without a budget.
+"""
+import ast
+import copy
+import difflib
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from urllib.parse import unquote, urlparse
+
+import astunparse
+from typpete import inference_runner
+from typpete.src import module_cache, z3_types
+from typpete.src.config import config
+from typpete.src.import_handler import ImportHandler
+from typpete.src.type_index import TypeIndex
+
+
+def get_units(tree):
+    """Return the functions and methods defined at the top level of a module, and the rest of the module
+
+    :return: A mapping from the qualified names of the functions and methods to their AST nodes,
+             and a list describing the remaining statements, to detect changes outside the functions.
+    """
+    units = OrderedDict()
+    skeleton = []
+    for stmt in tree.body:
+        if isinstance(stmt, ast.FunctionDef):
+            units[stmt.name] = stmt
+            skeleton.append(stmt.name)
+        elif isinstance(stmt, ast.ClassDef):
+            header = ast.ClassDef(name=stmt.name, bases=stmt.bases, keywords=stmt.keywords, body=[],
+                                  decorator_list=stmt.decorator_list)
+            skeleton.append(ast.dump(header))
+            for cls_stmt in stmt.body:
+                if isinstance(cls_stmt, ast.FunctionDef):
+                    name = "{}.{}".format(stmt.name, cls_stmt.name)
+                    units[name] = cls_stmt
+                    skeleton.append(name)
+                else:
+                    skeleton.append(ast.dump(cls_stmt))
+        else:
+            skeleton.append(ast.dump(stmt))
+    return units, skeleton
+
+
+def replace_units(tree, replacements):
+    """Replace the functions and methods of the module with the given nodes, by qualified name"""
+    for i, stmt in enumerate(tree.body):
+        if isinstance(stmt, ast.FunctionDef) and stmt.name in replacements:
+            tree.body[i] = replacements[stmt.name]
+        elif isinstance(stmt, ast.ClassDef):
+            for j, cls_stmt in enumerate(stmt.body):
+                name = "{}.{}".format(stmt.name, getattr(cls_stmt, 'name', None))
+                if isinstance(cls_stmt, ast.FunctionDef) and name in replacements:
+                    stmt.body[j] = replacements[name]
+
+
+def get_signature(func):
+    """Return the source of the function definition without its body"""
+    header = copy.copy(func)
+    header.body = [ast.Expr(ast.Ellipsis())]
+    lines = astunparse.unparse(header).strip().splitlines()
+    return '\n'.join(lines[:-1])
+
+
+def get_line_range(node):
+    """Return the first and the last line of the given statement"""
+    lines = [n.lineno for n in ast.walk(node) if hasattr(n, 'lineno')]
+    return min(lines), max(lines)
+
+
+def get_line_map(old_text, new_text):
+    """Map the numbers of the lines of `old_text` which are left unchanged in `new_text` to their new numbers"""
+    matcher = difflib.SequenceMatcher(None, old_text.splitlines(), new_text.splitlines(), autojunk=False)
+    line_map = {}
+    for tag, old_start, old_end, new_start, _ in matcher.get_opcodes():
+        if tag == 'equal':
+            for i in range(old_end - old_start):
+                line_map[old_start + i + 1] = new_start + i + 1
+    return line_map
+
+
+def in_unit(entry, name):
+    """Check if the type index entry is in the function or method with the given qualified name"""
+    scope = entry.scope
+    if entry.kind == 'return':
+        scope = scope + '.' + entry.name if scope else entry.name
+    return scope == name or scope.startswith(name + '.')
+
+
+def shift_entry(entry, lines):
+    return entry._replace(start=(entry.start[0] + lines, entry.start[1]), end=(entry.end[0] + lines, entry.end[1]))
+
+
+def get_node_at(tree, source_line, line, column):
+    """Return the name, or the attribute of a name, at the given position of the module, or None
+
+    :param source_line: The source of the line, encoded in UTF-8 like the columns of the AST
+    """
+    for node in ast.walk(tree):
+        if getattr(node, 'lineno', None) != line or column < node.col_offset:
+            continue
+        if isinstance(node, ast.Name) and column < node.col_offset + len(node.id.encode('utf-8')):
+            return node
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+            # The position of the attribute name itself is not in the AST
+            value = node.value.id.encode('utf-8')
+            text = value + b'.' + node.attr.encode('utf-8')
+            if (source_line[node.col_offset:node.col_offset + len(text)] == text
+                    and node.col_offset + len(value) < column < node.col_offset + len(text)):
+                return node
+    return None
+
+
+def hover_contents(source):
+    return {"contents": {"kind": "markdown", "value": "```python\n{}\n```".format(source)}}
+
+
+class Document:
+    """A document opened in the editor, together with its last inference result"""
+
+    def __init__(self, uri, text):
+        self.uri = uri
+        self.path = unquote(urlparse(uri).path)
+        self.text = text
+
+        # The annotated sources and the signatures of the functions and methods, by qualified name
+        self.annotated_units = {}
+        self.signatures = {}
+
+        # The functions and the remaining statements of the source which was inferred last
+        self.unit_dumps = {}
+        self.skeleton = None
+
+        # The TypeIndex of the inferred types, by position in `indexed_text`
+        self.type_index = None
+        self.indexed_text = None
+
+    @property
+    def base_folder(self):
+        return os.path.dirname(self.path)
+
+    def set_result(self, typed_tree, names):
+        """Take the types of the given functions and methods from the typed AST"""
+        units, _ = get_units(typed_tree)
+        for name in names:
+            if name in units:
+                self.annotated_units[name] = astunparse.unparse(units[name]).strip()
+                self.signatures[name] = get_signature(units[name])
+
+    def get_type_at(self, line, column):
+        """Return the source of the inferred type of the variable, argument or attribute at the given position
+        of the current text, or None
+
+        :param column: The column in UTF-8 bytes, as in the AST
+        """
+        if self.type_index is None:
+            return None
+        if self.indexed_text != self.text:
+            # Edited since, or not inferred again yet. Only the unchanged lines are looked up
+            line = get_line_map(self.text, self.indexed_text).get(line)
+            if line is None:
+                return None
+        entry = self.type_index.at(line, column)
+        if entry is not None and entry.kind != 'return':
+            return "{}: {}".format(entry.name, entry.type)
+
+        source_line = self.indexed_text.splitlines()[line - 1].encode('utf-8')
+        node = get_node_at(ast.parse(self.indexed_text), source_line, line, column)
+        if node is None:
+            return None
+        if isinstance(node, ast.Name):
+            # An argument or a variable of the enclosing function, or a global variable
+            scopes = ['']
+            if entry is not None:
+                scopes.insert(0, entry.scope + '.' + entry.name if entry.scope else entry.name)
+            kinds, name = ('argument', 'variable'), node.id
+        elif entry is not None:
+            # An attribute of the class of the enclosing method
+            scopes, kinds, name = [entry.scope], ('attribute',), node.attr
+        else:
+            return None
+        for scope in scopes:
+            definitions = [e for e in self.type_index.entries if e.name == name and e.kind in kinds and e.scope == scope]
+            if definitions:
+                # The closest definition before the position, if any
+                before = [e for e in definitions if e.start <= (line, column)]
+                definition = max(before, key=lambda e: e.start) if before else definitions[0]
+                return "{}: {}".format(definition.name, definition.type)
+        return None
+
+
+class LanguageServer:
+    """Language server handling the messages from the editor in the main thread,
+    and inferring the types of the documents in a background thread"""
+
+    def __init__(self, input_stream, output_stream):
+        self.input = input_stream
+        self.output = output_stream
+        self.output_lock = threading.Lock()
+        self.documents = {}
+
+        # The documents to be inferred, mapped to the kind of inference ('file' or 'functions')
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.stopped = False
+
+    def read_message(self):
+        headers = {}
+        while True:
+            line = self.input.readline()
+            if not line:
+                return None
+            line = line.decode('ascii').strip()
+            if not line:
+                break
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        return json.loads(self.input.read(int(headers['content-length'])).decode('utf-8'))
+
+    def send(self, message):
+        body = json.dumps(message).encode('utf-8')
+        with self.output_lock:
+            self.output.write('Content-Length: {}\r\n\r\n'.format(len(body)).encode('ascii') + body)
+            self.output.flush()
+
+    def respond(self, request_id, result=None, error=None):
+        message = {"jsonrpc": "2.0", "id": request_id}
+        if error is not None:
+            message["error"] = error
+        else:
+            message["result"] = result
+        self.send(message)
+
+    def log(self, message):
+        self.send({"jsonrpc": "2.0", "method": "window/logMessage", "params": {"type": 3, "message": message}})
+
+    def serve(self):
+        worker = threading.Thread(target=self.infer_pending_documents, daemon=True)
+        worker.start()
+        while True:
+            message = self.read_message()
+            if message is None or message.get("method") == "exit":
+                break
+            self.handle(message)
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def handle(self, message):
+        method = message.get("method")
+        params = message.get("params", {})
+        if method == "initialize":
+            self.respond(message["id"], {"capabilities": {"textDocumentSync": 1, "hoverProvider": True},
+                                         "serverInfo": {"name": "typpete"}})
+        elif method == "shutdown":
+            self.respond(message["id"], None)
+        elif method == "textDocument/didOpen":
+            document = Document(params["textDocument"]["uri"], params["textDocument"]["text"])
+            self.documents[document.uri] = document
+            self.schedule(document.uri, 'file')
+        elif method == "textDocument/didChange":
+            document = self.documents.get(params["textDocument"]["uri"])
+            if document is not None and params["contentChanges"]:
+                # The whole text is sent with every change (full document synchronization)
+                document.text = params["contentChanges"][-1]["text"]
+                self.schedule(document.uri, 'functions')
+        elif method == "textDocument/didSave":
+            if params["textDocument"]["uri"] in self.documents:
+                self.schedule(params["textDocument"]["uri"], 'file')
+        elif method == "textDocument/didClose":
+            self.documents.pop(params["textDocument"]["uri"], None)
+        elif method == "textDocument/hover":
+            self.respond(message["id"], self.hover(params))
+        elif "id" in message:
+            self.respond(message["id"], error={"code": -32601, "message": "Unsupported method {}".format(method)})
+
+    def hover(self, params):
+        """Return the inferred type of the variable, argument or attribute at the position, or else the signature
+        of the innermost function or method containing the position"""
+        document = self.documents.get(params["textDocument"]["uri"])
+        if document is None:
+            return None
+        try:
+            units, _ = get_units(ast.parse(document.text))
+        except SyntaxError:
+            return None
+        line = params["position"]["line"] + 1
+        lines = document.text.splitlines()
+        if line <= len(lines):
+            # The columns of the AST count UTF-8 bytes
+            column = len(lines[line - 1][:params["position"]["character"]].encode('utf-8'))
+            type_source = document.get_type_at(line, column)
+            if type_source is not None:
+                return hover_contents(type_source)
+        containing = []
+        for name, unit in units.items():
+            first, last = get_line_range(unit)
+            if first <= line <= last and name in document.signatures:
+                containing.append((last - first, name))
+        if not containing:
+            return None
+        name = min(containing)[1]
+        return hover_contents(document.signatures[name])
+
+    def schedule(self, uri, kind):
+        with self.condition:
+            # An inference of the whole file covers any inference of its functions
+            if self.pending.get(uri) != 'file':
+                self.pending[uri] = kind
+            self.condition.notify()
+
+    def infer_pending_documents(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                uri, kind = self.pending.popitem(last=False)
+                document = self.documents.get(uri)
+            if document is None:
+                continue
+            try:
+                self.infer_document(document, kind)
+            except Exception:
+                self.log("Inference of {} failed:\n{}".format(document.path, traceback.format_exc()))
+
+    def infer_document(self, document, kind):
+        # The text may be changed by the main thread in the meantime
+        text = document.text
+        try:
+            tree = ast.parse(text)
+        except SyntaxError:
+            return
+        units, skeleton = get_units(tree)
+        unit_dumps = {name: ast.dump(unit) for name, unit in units.items()}
+
+        if kind == 'functions' and skeleton == document.skeleton and unit_dumps.keys() == document.unit_dumps.keys():
+            changed = [name for name in unit_dumps if unit_dumps[name] != document.unit_dumps[name]]
+            if not changed:
+                return
+            if self.infer_functions(document, text, tree, units, changed):
+                for name in changed:
+                    document.unit_dumps[name] = unit_dumps[name]
+                return
+            self.log("Re-inference of {} exceeded the latency budget, "
+                     "using the last result of the whole file".format(', '.join(changed)))
+            # The functions of the tree were replaced by their last inferred definitions
+            tree = ast.parse(text)
+
+        # Infer the whole file
+        type_index = self.infer_tree(tree, document.base_folder)
+        if type_index is not None:
+            document.annotated_units = {}
+            document.signatures = {}
+            document.set_result(tree, units.keys())
+            document.unit_dumps = unit_dumps
+            document.skeleton = skeleton
+            document.type_index = type_index
+            document.indexed_text = text
+        else:
+            self.log("The types of {} could not be inferred".format(document.path))
+
+    def infer_functions(self, document, text, tree, units, changed):
+        """Infer the types of the changed functions, keeping the last inferred signatures of the others
+
+        :return: Whether the types were inferred
+        """
+        start_time = time.time()
+        replacements = {}
+        for name in units:
+            if name not in changed and name in document.annotated_units:
+                replacements[name] = ast.parse(document.annotated_units[name]).body[0]
+        replace_units(tree, replacements)
+
+        ignore_annotated = config["ignore_fully_annotated_function"]
+        config["ignore_fully_annotated_function"] = True
+        try:
+            budget = config["lsp_latency_budget"]
+            type_index = self.infer_tree(tree, document.base_folder, start_time, budget)
+        finally:
+            config["ignore_fully_annotated_function"] = ignore_annotated
+        if type_index is None:
+            return False
+        document.set_result(tree, changed)
+
+        # The positions of the replaced functions are the ones of their last inferred definitions,
+        # so their entries are taken from the last index instead, moved to their current lines
+        entries = [entry for entry in type_index.entries if not any(in_unit(entry, name) for name in replacements)]
+        if document.type_index is not None:
+            last_units, _ = get_units(ast.parse(document.indexed_text))
+            line_map = get_line_map(document.indexed_text, text)
+            for name in replacements:
+                if name not in last_units:
+                    continue
+                first, last = get_line_range(last_units[name])
+                if first not in line_map:
+                    continue
+                entries += [shift_entry(entry, line_map[first] - first) for entry in document.type_index.entries
+                            if first <= entry.start[0] <= last]
+        document.type_index = TypeIndex(entries)
+        document.indexed_text = text
+        return True
+
+    def infer_tree(self, tree, base_folder, start_time=None, budget=None):
+        """Infer the types of the module AST, annotating it in place.
+
+        If a budget is given, give up once `budget` milliseconds passed since `start_time`, whether
+        the constraints are still being collected or already being solved.
+        :return: The TypeIndex of the inferred types, or None if the types were not inferred
+        """
+        ImportHandler.reset()
+        z3_types.reset_main_context()
+        deadline = None
+        if budget is not None:
+            deadline = start_time + budget / 1000
+        try:
+            solver, context = inference_runner.collect_constraints(tree, base_folder, deadline=deadline)
+        except TimeoutError:
+            return None
+        timeout = None
+        if budget is not None:
+            timeout = int(budget - (time.time() - start_time) * 1000)
+            if timeout <= 0:
+                return None
+        check = inference_runner.solve_constraints(solver, timeout)
+        if check == z3_types.unsat:
+            return None
+        if check == z3_types.unknown and budget is not None and (time.time() - start_time) * 1000 >= budget:
+            # The solver gave up because the budget was exceeded
+            return None
+        context.generate_typed_ast(inference_runner.get_model(solver), solver)
+        return context.type_index
+
+
+def run_lsp_server():
+    """Start the language server on the standard input and output"""
+    output = sys.stdout.buffer
+    # Anything printed during the inference must not end up in the protocol stream
+    sys.stdout = sys.stderr
+    module_cache.memory = module_cache.MemoryCache()
+    LanguageServer(sys.stdin.buffer, output).serve()
+
+
+if __name__ == '__main__':
+    run_lsp_server()
@@ -1,8 +1,24 @@
-from z3 import Or, And, simplify
+from collections import OrderedDict
+from z3 import Or, And, simplify, substitute
 import ast
 import re
 
 
+class AnnotationTemplate:
+    """A resolved type annotation
+
+    The type may contain placeholder constants for generic type variables and for unions, which are
+    substituted by fresh constants whenever the annotation is used.
+    """
+    def __init__(self):
+        self.type = None
+        self.type_vars = OrderedDict()  # type variable name -> (placeholder, line number)
+        self.unions = []  # (placeholder, union axiom, line number)
+
+    def is_ground(self):
+        return not self.type_vars and not self.unions
+
+
 class AnnotationResolver:
     """Resolver for type annotations in functions"""
     def __init__(self, z3_types):
@@ -35,6 +51,7 @@ class AnnotationResolver:
 
         self.type_var_poss = {}
         self.type_var_super = {}
+        self.resolved_annotations = {}
 
     def resolve(self, annotation, solver, module, generics_map=None, annotated=False):
         """Resolve the type annotation with the following grammar:
@@ -50,6 +67,60 @@ class AnnotationResolver:
             | Type[t]
             | Tuple[t*]
             | Callable[[t*], t]
+
+        The resolved annotations are cached per annotation node and module. Ground annotations
+        return the cached Z3 type directly, whereas annotations containing generic type variables
+        or unions are instantiated with fresh Z3 constants on every call.
+        """
+        key = (annotation, module, generics_map is not None, annotated)
+        if key in self.resolved_annotations:
+            template = self.resolved_annotations[key]
+        else:
+            template = AnnotationTemplate()
+            template.type = self._resolve_template(annotation, solver, module, template,
+                                                   generics_map is not None, annotated)
+            self.resolved_annotations[key] = template
+
+        if template.is_ground():
+            return template.type
+        return self._instantiate(template, solver, module, generics_map)
+
+    def _instantiate(self, template, solver, module, generics_map):
+        """Instantiate a resolved annotation template with fresh type variables and unions"""
+        substitutions = []
+        for type_var, (placeholder, lineno) in template.type_vars.items():
+            type_var_type = self._instantiate_type_var(type_var, lineno, solver, module, generics_map)
+            substitutions.append((placeholder, type_var_type))
+        for placeholder, _, _ in template.unions:
+            substitutions.append((placeholder, solver.new_z3_const("union")))
+
+        for _, union_axiom, lineno in template.unions:
+            solver.add(substitute(union_axiom, *substitutions),
+                       fail_message="Union in type annotation in line {}".format(lineno))
+        return substitute(template.type, *substitutions)
+
+    def _instantiate_type_var(self, type_var, lineno, solver, module, generics_map):
+        """Get the type of a generic type variable in a specific function call"""
+        if type_var in generics_map:
+            return generics_map[type_var]
+        if type_var not in self.type_var_poss:
+            raise ValueError("Invalid type annotation {} in line {}".format(type_var, lineno))
+
+        result_type = solver.new_z3_const("generic")
+        generics_map[type_var] = result_type
+        possible_types = [self.resolve(x, solver, module, generics_map) for x in
+                          self.type_var_poss[type_var]]
+
+        if possible_types:
+            solver.add(Or([result_type == x for x in possible_types]),
+                       fail_message = "Generic type in line {}".format(lineno))
+        return result_type
+
+    def _resolve_template(self, annotation, solver, module, template, generic, annotated):
+        """Resolve the type annotation into a template
+
+        Generic type variables (if `generic` is True) and unions are resolved into placeholder
+        constants which are recorded in the template, to be replaced by fresh constants on every use.
         """
         if isinstance(annotation, ast.NameConstant) and annotation.value is None:
             return solver.z3_types.none
@@ -66,22 +137,12 @@ class AnnotationResolver:
                 return getattr(self.z3_types.type_sort, "class_{}".format(id))
 
             key = (module, id)
-            if generics_map is not None and (annotated or key not in self.z3_types.config.type_vars):
-                if id in generics_map:
-                    return generics_map[id]
-                if id not in self.type_var_poss:
-                    raise ValueError("Invalid type annotation {} in line {}".format(id, annotation.lineno))
-
-                result_type = solver.new_z3_const("generic")
-                generics_map[id] = result_type
-                possible_types = [self.resolve(x, solver, module, generics_map) for x in
-                                  self.type_var_poss[id]]
-
-                if possible_types:
-                    solver.add(Or([result_type == x for x in possible_types]),
-                               fail_message = "Generic type in line {}".format(annotation.lineno))
-                return result_type
-            
+            if generic and (annotated or key not in self.z3_types.config.type_vars):
+                # The type of the generic type variable is given on instantiation
+                if id not in template.type_vars:
+                    template.type_vars[id] = (solver.new_z3_const("generic_placeholder"), annotation.lineno)
+                return template.type_vars[id][0]
+
             # Check if it's a generic type var
             if key in self.z3_types.config.type_vars:
                 return self.z3_types.config.type_vars[key]
@@ -97,7 +158,7 @@ class AnnotationResolver:
             annotation_val = annotation.value.id
             if annotation_val == "List":
                 # Parse List type
-                return self.z3_types.list(self.resolve(annotation.slice.value, solver, module, generics_map=generics_map, annotated=annotated))
+                return self.z3_types.list(self._resolve_template(annotation.slice.value, solver, module, template, generic, annotated))
             
             if annotation_val == "Dict":
                 # Parse Dict type
@@ -106,20 +167,20 @@ class AnnotationResolver:
                                     .format(annotation.lineno))
 
                 # Get the types of the dict args
-                keys_type = self.resolve(annotation.slice.value.elts[0], solver, module, generics_map=generics_map, annotated=annotated)
-                vals_type = self.resolve(annotation.slice.value.elts[1], solver, module, generics_map=generics_map, annotated=annotated)
+                keys_type = self._resolve_template(annotation.slice.value.elts[0], solver, module, template, generic, annotated)
+                vals_type = self._resolve_template(annotation.slice.value.elts[1], solver, module, template, generic, annotated)
                 return self.z3_types.dict(keys_type, vals_type)
             
             if annotation_val == "Set":
                 # Parse Set type
-                return self.z3_types.set(self.resolve(annotation.slice.value, solver, module, generics_map=generics_map, annotated=annotated))
+                return self.z3_types.set(self._resolve_template(annotation.slice.value, solver, module, template, generic, annotated))
 
             if annotation_val == 'Optional':
-                return self.resolve(annotation.slice.value, solver, module, generics_map=generics_map, annotated=annotated)
+                return self._resolve_template(annotation.slice.value, solver, module, template, generic, annotated)
             
             if annotation_val == "Type":
                 # Parse Type type
-                return self.z3_types.type(self.resolve(annotation.slice.value, solver, module, generics_map=generics_map, annotated=annotated))
+                return self.z3_types.type(self._resolve_template(annotation.slice.value, solver, module, template, generic, annotated))
             
             if annotation_val == "Tuple":
                 # Parse Tuple type
@@ -128,9 +189,9 @@ class AnnotationResolver:
 
                 # Get the types of the tuple args
                 if isinstance(annotation.slice.value, ast.Name):
-                    tuple_args_types = [self.resolve(annotation.slice.value, solver, module, generics_map=generics_map, annotated=annotated)]
+                    tuple_args_types = [self._resolve_template(annotation.slice.value, solver, module, template, generic, annotated)]
                 else:
-                    tuple_args_types = [self.resolve(x, solver, module, generics_map=generics_map, annotated=annotated) for x in annotation.slice.value.elts]
+                    tuple_args_types = [self._resolve_template(x, solver, module, template, generic, annotated) for x in annotation.slice.value.elts]
 
                 if len(tuple_args_types) == 0:
                     return self.z3_types.tuples[0]
@@ -148,8 +209,8 @@ class AnnotationResolver:
 
                 # Get the args and return types
                 args_annotations = annotation.slice.value.elts[0].elts
-                args_types = [self.resolve(x, solver, module, generics_map=generics_map, annotated=annotated) for x in args_annotations]
-                return_type = self.resolve(annotation.slice.value.elts[1], solver, module, generics_map=generics_map, annotated=annotated)
+                args_types = [self._resolve_template(x, solver, module, template, generic, annotated) for x in args_annotations]
+                return_type = self._resolve_template(annotation.slice.value.elts[1], solver, module, template, generic, annotated)
 
                 return self.z3_types.funcs[len(args_types)](*([0] + args_types + [return_type]))
 
@@ -160,9 +221,9 @@ class AnnotationResolver:
 
                 # Get the types of the union args
                 if isinstance(annotation.slice.value, ast.Name):
-                    union_args_types = [self.resolve(annotation.slice.value, solver, module, generics_map=generics_map, annotated=annotated)]
+                    union_args_types = [self._resolve_template(annotation.slice.value, solver, module, template, generic, annotated)]
                 else:
-                    union_args_types = [self.resolve(x, solver, module, generics_map=generics_map, annotated=annotated) for x in annotation.slice.value.elts]
+                    union_args_types = [self._resolve_template(x, solver, module, template, generic, annotated) for x in annotation.slice.value.elts]
 
                 # The result of the union type is only one of args, Z3 picks the appropriate one
                 # according to the added constraints.
@@ -172,18 +233,18 @@ class AnnotationResolver:
                 # f(1)
                 # f("str")
                 # TODO add support for above example using union
-                result_type = solver.new_z3_const("union")
-                solver.add(Or([result_type == arg for arg in union_args_types]),
-                           fail_message="Union in type annotation in line {}".format(annotation.lineno))
+                result_type = solver.new_z3_const("union_placeholder")
+                template.unions.append((result_type, Or([result_type == arg for arg in union_args_types]),
+                                        annotation.lineno))
 
                 return result_type
 
             if annotation_val in self.z3_types.all_types:
                 func = getattr(self.z3_types.type_sort, "class_{}".format(annotation_val))
                 if isinstance(annotation.slice.value, ast.Name):
-                    args = self.resolve(annotation.slice.value, solver, module, generics_map=generics_map, annotated=annotated)
+                    args = self._resolve_template(annotation.slice.value, solver, module, template, generic, annotated)
                 else:
-                    args = [self.resolve(x, solver, module, generics_map=generics_map, annotated=annotated) for x in annotation.slice.value.elts]
+                    args = [self._resolve_template(x, solver, module, template, generic, annotated) for x in annotation.slice.value.elts]
                 return func(args)
         raise ValueError("Invalid type annotation in line {}".format(annotation.lineno))
 
@@ -0,0 +1,202 @@
+"""Insertion of the inferred annotations into the original source of a module
+
+Instead of regenerating the whole module from its typed AST, the annotations are computed as
+insertions at offsets in the original source, which keeps its formatting and comments, and are
+applied in a single pass over the text. The positions of the annotated elements are taken from the
+type index of the module, and located in the tokens of the source:
+
+- an argument annotation is inserted after the argument name,
+- a return annotation after the closing parenthesis of the arguments,
+- a variable annotation after the target of the assignment. Targets which cannot be annotated in
+  place (in tuple assignments) are declared on a line of their own before the assignment,
+- the required imports and the type variable declarations before the first statement after the
+  module docstring.
+
+Elements which are already annotated in the source are left unchanged.
+"""
+import io
+import tokenize
+
+# Tokens which do not start a logical line
+NON_CODE_TOKENS = {tokenize.NEWLINE, tokenize.NL, tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT,
+                   tokenize.ENCODING, tokenize.ENDMARKER}
+
+
+class SourceTokens:
+    """The tokens of a source, indexed by their start position"""
+
+    def __init__(self, source):
+        self.source = source
+        self.lines = source.splitlines(True)
+        self.line_offsets = [0, 0]
+        for line in self.lines:
+            self.line_offsets.append(self.line_offsets[-1] + len(line))
+
+        self.tokens = []
+        # The index of the first token of the logical line of every token
+        self.logical_starts = []
+        self.token_at = {}
+        logical_start = None
+        for token in tokenize.generate_tokens(io.StringIO(source).readline):
+            if token.type in NON_CODE_TOKENS:
+                if token.type == tokenize.NEWLINE:
+                    logical_start = None
+                continue
+            if logical_start is None:
+                logical_start = len(self.tokens)
+            self.token_at[token.start] = len(self.tokens)
+            self.tokens.append(token)
+            self.logical_starts.append(logical_start)
+
+    def offset(self, position):
+        """Return the offset in the source of a (line, column) position of the tokenizer"""
+        line, column = position
+        if line >= len(self.line_offsets):
+            return len(self.source)
+        return self.line_offsets[line] + column
+
+    def find(self, line, col_offset):
+        """Return the index of the token at the given AST position, or None
+
+        The AST column offsets count UTF-8 bytes, while the tokenizer counts characters.
+        """
+        if 0 < line <= len(self.lines) and len(self.lines[line - 1].encode()) != len(self.lines[line - 1]):
+            col_offset = len(self.lines[line - 1].encode()[:col_offset].decode(errors='ignore'))
+        return self.token_at.get((line, col_offset))
+
+    def is_op(self, i, op):
+        return i < len(self.tokens) and self.tokens[i].type == tokenize.OP and self.tokens[i].string == op
+
+    def is_name(self, i, name=None):
+        return (i < len(self.tokens) and self.tokens[i].type == tokenize.NAME
+                and (name is None or self.tokens[i].string == name))
+
+    def end_offset(self, i):
+        return self.offset(self.tokens[i].end)
+
+    def start_offset(self, i):
+        return self.offset(self.tokens[i].start)
+
+    def matching_paren(self, i):
+        """Return the index of the parenthesis closing the one at index `i`"""
+        depth = 0
+        while i < len(self.tokens):
+            if self.tokens[i].type == tokenize.OP:
+                if self.tokens[i].string in '([{':
+                    depth += 1
+                elif self.tokens[i].string in ')]}':
+                    depth -= 1
+                    if depth == 0:
+                        return i
+            i += 1
+        return None
+
+    def definition_name(self, i, keyword):
+        """Return the index of the name of the definition (after decorators) starting at index `i`"""
+        while i < len(self.tokens) and not (self.is_name(i, keyword) and self.is_name(i + 1)):
+            i += 1
+        return i + 1 if i < len(self.tokens) else None
+
+
+def get_annotation_edits(tokens, type_index):
+    """Return the insertions of the annotations of the type index, as (offset, text) pairs"""
+    edits = []
+    for entry in type_index.entries:
+        i = tokens.find(*entry.start)
+        if i is None:
+            continue
+        if entry.kind == 'argument':
+            if tokens.is_name(i, entry.name) and not tokens.is_op(i + 1, ':'):
+                edits.append((tokens.end_offset(i), ': ' + entry.type))
+        elif entry.kind == 'return':
+            name = tokens.definition_name(i, 'def')
+            if name is None or not tokens.is_name(name, entry.name) or not tokens.is_op(name + 1, '('):
+                continue
+            close = tokens.matching_paren(name + 1)
+            if close is not None and not tokens.is_op(close + 1, '->'):
+                edits.append((tokens.end_offset(close), ' -> ' + entry.type))
+        else:
+            # The target is a name or an attribute reference (`obj.attr`)
+            last = i
+            while tokens.is_op(last + 1, '.') and tokens.is_name(last + 2):
+                last += 2
+            if tokens.is_op(last + 1, ':'):
+                continue
+            if tokens.logical_starts[i] == i and tokens.is_op(last + 1, '='):
+                edits.append((tokens.end_offset(last), ': ' + entry.type))
+            else:
+                # Declare the target before the statement
+                start = tokens.logical_starts[i]
+                start_offset = tokens.start_offset(start)
+                indent = tokens.lines[tokens.tokens[start].start[0] - 1][:tokens.tokens[start].start[1]]
+                target = tokens.source[tokens.start_offset(i):tokens.end_offset(last)]
+                edits.append((start_offset, '{}: {}\n{}'.format(target, entry.type, indent)))
+    return edits
+
+
+def get_generic_base_edits(tokens, generic_bases):
+    """Return the insertions of the `Generic` bases of the generic classes"""
+    edits = []
+    for cls, base in generic_bases:
+        i = tokens.find(cls.lineno, cls.col_offset)
+        name = tokens.definition_name(i, 'class') if i is not None else None
+        if name is None or not tokens.is_name(name, cls.name):
+            continue
+        if tokens.is_op(name + 1, '('):
+            close = tokens.matching_paren(name + 1)
+            if close is None:
+                continue
+            separator = '' if close == name + 2 else ', '
+            edits.append((tokens.start_offset(close), separator + base))
+        else:
+            edits.append((tokens.end_offset(name), '({})'.format(base)))
+    return edits
+
+
+def get_header_offset(tokens):
+    """Return the offset of the first statement after the module docstring"""
+    i = 0
+    if i < len(tokens.tokens) and tokens.tokens[i].type == tokenize.STRING:
+        # Skip the docstring
+        while i < len(tokens.tokens) and tokens.logical_starts[i] == 0:
+            i += 1
+    if i < len(tokens.tokens):
+        return tokens.start_offset(i), ''
+    return len(tokens.source), '' if not tokens.source or tokens.source.endswith('\n') else '\n'
+
+
+def format_import(import_node):
+    names = ', '.join(alias.name for alias in import_node.names)
+    return 'from {}{} import {}'.format('.' * import_node.level, import_node.module or '', names)
+
+
+def annotate_source(source, module_context, import_nodes):
+    """Return the source of a module annotated with the types inferred for it
+
+    :param module_context: The context of the module, after the typed AST was generated
+    :param import_nodes: The import statements required by the annotations
+    """
+    tokens = SourceTokens(source)
+    edits = get_annotation_edits(tokens, module_context.type_index)
+    edits += get_generic_base_edits(tokens, module_context.generic_bases)
+
+    header = [format_import(node) for node in import_nodes]
+    for tv, upper in module_context.used_type_vars.items():
+        tv_name = tv[2:]
+        if tv_name[0].isdigit():
+            tv_name = 'T' + tv_name
+        header.append("{0} = TypeVar('{0}', bound={1})".format(tv_name, upper))
+    if header:
+        offset, prefix = get_header_offset(tokens)
+        # The header goes before any other insertion at the same offset
+        edits.insert(0, (offset, prefix + '\n'.join(header) + '\n'))
+
+    edits.sort(key=lambda edit: edit[0])
+    parts = []
+    last = 0
+    for offset, text in edits:
+        parts.append(source[last:offset])
+        parts.append(text)
+        last = offset
+    parts.append(source[last:])
+    return ''.join(parts)
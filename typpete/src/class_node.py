@@ -13,39 +13,33 @@ class ClassNode:
         self.children = []
         self.type_sort = type_sort
         self._qf = None
-
-    def find(self, name):
-        """
-        Looks a class with the given name in the tree starting at this node. If there is
-        no such class, returns None.
-        """
-        if name == self.name:
-            return self
-        for c in self.children:
-            res = c.find(name)
-            if res:
-                return res
+        self._all_children = None
+        self._all_parents = None
 
     def __str__(self):
         return str(self.name)
 
     def all_children(self):
         """
-        Returns all transitive child nodes.
+        Returns all transitive child nodes, as a frozenset since it is memoized.
         """
-        result = {self}
-        for c in self.children:
-            result.update(c.all_children())
-        return result
+        if self._all_children is None:
+            result = {self}
+            for c in self.children:
+                result.update(c.all_children())
+            self._all_children = frozenset(result)
+        return self._all_children
 
     def all_parents(self):
         """
-        Returns all transitive parent nodes.
+        Returns all transitive parent nodes, as a frozenset since it is memoized.
         """
-        result = {self}
-        for parent in self.parents:
-            result.update(parent.all_parents())
-        return result
+        if self._all_parents is None:
+            result = {self}
+            for parent in self.parents:
+                result.update(parent.all_parents())
+            self._all_parents = frozenset(result)
+        return self._all_parents
 
     def get_literal(self, transformer = None):
         """
@@ -24,6 +24,50 @@ config = {
     # Whether to use soft constraints to infer more precise types for local variables
     "enable_soft_constraints": True,
 
+    # Whether to parse the modules imported by the program in parallel, before the pre-analysis.
+    # Sending the parsed trees back from the worker processes can cost more than parsing them
+    "parallel_parsing": False,
+
+    # Whether to cache the parsed and pre-analyzed modules on disk, to be reused by later runs
+    "cache_modules": False,
+
+    # Whether to reuse the stored result when inferring unchanged sources with the same configuration
+    "cache_results": False,
+
+    # The maximum size of the stored inference results in megabytes
+    "result_cache_size": 500,
+
+    # The time in milliseconds within which the language server re-infers an edited function,
+    # before falling back to the last result of the whole file
+    "lsp_latency_budget": 200,
+
+    # Whether to write the index of the inferred types by source position next to every annotated module
+    "output_type_index": False,
+
+    # Whether to insert the annotations into the original sources, keeping their formatting and comments,
+    # instead of regenerating the sources from the typed ASTs
+    "preserve_formatting": False,
+
+    # Whether to write unified diffs against the original sources (`<module>.py.diff`) instead of the annotated modules
+    "output_diffs": False,
+
+    # The format of a file summarizing the inferred types of every module and the timings of the run:
+    # "json", "binary" (length-prefixed records), or "" to not write it
+    "result_format": "",
+
+    # The format of the log of the collected constraints, with the provenance of every constraint:
+    # "text" (z3 pretty printer), "smt2" (SMT-LIB declarations and assertions), or "" to not write it
+    "constraints_log": "",
+
+    # Whether to compress the constraints log with gzip
+    "compress_constraints_log": False,
+
+    # Whether to export the inference problem (`<file>_problem.smt2`) to be solved again with `typpete --replay`
+    "emit_smt2": False,
+
+    # The folder holding the on-disk caches
+    "cache_folder": ".typpete_cache",
+
     # Whether to print the unsat core when a problem is unsatisfiable instead of
     # generating the best possible solution and printing a minimal set of
     # unsatisfiable constraints
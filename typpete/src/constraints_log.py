@@ -0,0 +1,108 @@
+"""Log of the type constraints collected for a program
+
+The constraints are written one at a time, each one preceded by a comment holding its provenance
+(the error reported if it is violated), so the whole log is never built in memory. The log is
+either in the `text` form of the z3 pretty printer, or in the compact `smt2` form: an SMT-LIB script
+starting with the declarations of the datatypes, constants and functions used by the constraints,
+followed by one `assert` command per constraint. The axioms of the type system are not part of the
+log, see `smt2_problem` for a self-contained problem. The log can be compressed with gzip.
+"""
+import gzip
+import io
+from z3 import Solver, get_param, is_app, is_quantifier, set_param, z3printer
+
+from typpete.src.smt2_problem import get_recognizer_fixer
+
+FILE_EXTENSIONS = {"text": "txt", "smt2": "smt2"}
+
+# Limits of the pretty printer of the text form, high enough to never truncate a constraint
+PRETTY_PRINTER_OPTIONS = {"max_lines": 4000, "max_width": 1000, "max_visited": 10000000, "max_depth": 1000000,
+                          "max_args": 512}
+
+
+def get_constraints(solver):
+    """Return a generator of the constraints of the solver with their provenance, in the order they were added"""
+    for assertion_var, assertion in zip(solver.assertions_vars, solver.all_assertions):
+        yield solver.assertions_errors[assertion_var], assertion
+
+
+def get_text_printer():
+    """Return a function printing a constraint in the text form
+
+    The printer has its own options, the global ones of the z3 pretty printer are left unchanged.
+    """
+    printer = z3printer.PP()
+    formatter = z3printer.Formatter()
+    for option, value in PRETTY_PRINTER_OPTIONS.items():
+        setattr(printer if hasattr(printer, option) else formatter, option, value)
+
+    def to_text(assertion):
+        out = io.StringIO()
+        printer(out, formatter(assertion))
+        return out.getvalue()
+    return to_text
+
+
+def get_declarations(solver):
+    """Return the SMT-LIB declarations of the sorts, constants and functions used by the constraints of the solver
+
+    The constraints are walked once to find an application of every function or constant, and z3 prints the
+    declarations which these terms need. `pp.single_line` must be set.
+    """
+    visited = set()
+    # An application of every function, by the id of its declaration
+    terms = {}
+    to_visit = list(solver.all_assertions)
+    while to_visit:
+        expr = to_visit.pop()
+        if expr.get_id() in visited:
+            continue
+        visited.add(expr.get_id())
+        if is_quantifier(expr):
+            to_visit.append(expr.body())
+        elif is_app(expr):
+            terms.setdefault(expr.decl().get_id(), expr)
+            to_visit.extend(expr.children())
+
+    declarations = Solver(ctx=solver.ctx)
+    declarations.add([term == term for term in terms.values()])
+    # Every declaration is printed on a single line, before the first assertion using it
+    return [line for line in declarations.sexpr().splitlines() if not line.startswith("(assert")]
+
+
+def write_constraints_log(solver, path, log_format, compress=False):
+    """Write the constraints collected by the solver to the given path (without extension)
+
+    :return: The path of the written log
+    """
+    if log_format not in FILE_EXTENSIONS:
+        raise ValueError("Unknown constraints log format {}".format(log_format))
+    path = "{}.{}".format(path, FILE_EXTENSIONS[log_format])
+    if compress:
+        path += ".gz"
+        log = gzip.open(path, "wt")
+    else:
+        log = open(path, "w")
+
+    if log_format == "text":
+        to_text = get_text_printer()
+    else:
+        single_line = get_param("pp.single_line")
+        # Every SMT-LIB constraint on a single line
+        set_param("pp.single_line", True)
+        fix_recognizers = get_recognizer_fixer(solver)
+    try:
+        with log:
+            if log_format == "smt2":
+                for line in get_declarations(solver):
+                    log.write(fix_recognizers(line) + "\n")
+            for provenance, assertion in get_constraints(solver):
+                log.write("; {}\n".format(provenance.replace("\n", " ")))
+                if log_format == "smt2":
+                    log.write("(assert {})\n".format(fix_recognizers(assertion.sexpr())))
+                else:
+                    log.write(to_text(assertion) + "\n")
+    finally:
+        if log_format == "smt2":
+            set_param("pp.single_line", single_line == "true")
+    return path
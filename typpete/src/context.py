@@ -1,8 +1,10 @@
 import ast
+import astunparse
 
 import sys
 
 from collections import OrderedDict
+from typpete.src.type_index import TypeIndex
 from z3 import simplify
 from z3.z3types import Z3Exception
 
@@ -39,6 +41,7 @@ class Context:
         self.add_nodes(context_nodes, solver)
 
         self.builtin_methods = {}
+        self.stub_contexts = []
         self.parent_context = parent_context
         self.children_contexts = []
         self.func_to_ast = {}
@@ -46,6 +49,11 @@ class Context:
         self.imports = set()
 
         self.used_type_vars = OrderedDict()
+        # The `Generic` bases added to the generic classes, with their class nodes
+        self.generic_bases = []
+
+        # The inferred types by source position, shared by all the contexts of a module
+        self.type_index = parent_context.type_index if parent_context else TypeIndex()
 
         if parent_context:
             parent_context.children_contexts.append(self)
@@ -89,9 +97,21 @@ class Context:
         if var_name in self.types_map and not (self.is_class and passed_func):
             return self.types_map[var_name]
         if self.parent_context is None:
+            # Fall back to the stubs, inferring the stub definition on first use
+            stub_type = self.get_stub_type(var_name)
+            if stub_type is not None:
+                return stub_type
             raise NameError("Name {} is not defined.".format(var_name))
         return self.parent_context.get_type(var_name, passed_func)
 
+    def get_stub_type(self, var_name):
+        """Return the type of `var_name` defined in the stubs of this global context, or None if it's not defined"""
+        for stub_context in self.stub_contexts:
+            stub_type = stub_context.get_stub_type(var_name)
+            if stub_type is not None:
+                return stub_type
+        return None
+
     def get_isinstance_type(self, dump):
         if dump in self.isinstance_nodes:
             return self.isinstance_nodes[dump]
@@ -117,7 +137,8 @@ class Context:
         if var_name in self.types_map and not self.is_class:
             return True
         if self.parent_context is None:
-            return False
+            # The names defined in the stubs are global variables as well
+            return self.get_stub_type(var_name) is not None
         return self.parent_context.has_variable(var_name)
 
     def has_var_in_children(self, var_name):
@@ -148,11 +169,14 @@ class Context:
         return False
 
     def remove_extra_nodes(self):
-        to_remove = [x for x in self.context_nodes if self.should_remove(x)]
-        for node in to_remove:
-            self.context_nodes.remove(node)
-            if isinstance(node, ast.FunctionDef) and node.name in self.func_to_ast:
+        # Filter the nodes in a single pass, keeping the list object which is the body of the AST node
+        kept = []
+        for node in self.context_nodes:
+            if not self.should_remove(node):
+                kept.append(node)
+            elif isinstance(node, ast.FunctionDef) and node.name in self.func_to_ast:
                 del self.func_to_ast[node.name]
+        self.context_nodes[:] = kept
 
         for child in self.children_contexts:
             child.remove_extra_nodes()
@@ -191,19 +215,20 @@ class Context:
                     else:
                         slice = ast.Index(ast.Tuple(elts=args))
                     cls.bases.append(ast.Subscript(value=ast.Name(id='Generic'), slice=slice))
+                    self.generic_bases.append((cls, "Generic[{}]".format(", ".join(arg.id for arg in args))))
 
     def add_type_var_assigns(self, model, solver):
         if isinstance(self.node, ast.Module):
             after_imports = 0
             while after_imports < len(self.node.body) and isinstance(self.node.body[after_imports], (ast.Import, ast.ImportFrom)):
                 after_imports += 1
+            tv_decls = []
             for tv, upper in self.used_type_vars.items():
                 tv_name = tv[2:]
                 if tv_name[0].isdigit():
                     tv_name = 'T' + tv_name
-                tv_decl = self._create_type_var_assign(tv_name, upper)
-                self.node.body.insert(after_imports, tv_decl)
-                after_imports += 1
+                tv_decls.append(self._create_type_var_assign(tv_name, upper))
+            self.node.body[after_imports:after_imports] = tv_decls
 
     def _create_type_var_assign(self, name, upper):
         target = ast.Name(id=name)
@@ -223,6 +248,8 @@ class Context:
             inferred_type = model[z3_t]
             inferred_type_name = str(inferred_type)
             func_len = len(node.args.args)
+            # The function definition ranges until the line after its last statement
+            last_line = max(getattr(n, 'lineno', 0) for n in ast.walk(node))
             if inferred_type_name.startswith("generic"):
                 nargs = int(inferred_type_name[7:8])
                 arg_accessor_func = lambda i, n: lambda x: getattr(type_sort, "func_{}_arg_{}".format(n, i))(getattr(type_sort, 'generic{}_func'.format(nargs))(x))
@@ -248,6 +275,8 @@ class Context:
                                                                                    node.lineno, self.definition_linenos)
                 # Add the type annotation as an AST node
                 arg.annotation = ast.parse(arg_annotation_str).body[0].value
+                self.type_index.add_node(arg, len(arg.arg), 'argument', self.qualify(func), arg.arg,
+                                         arg_annotation_str)
 
                 names = {name.id for name in list(ast.walk(arg.annotation)) if isinstance(name, ast.Name)}
                 self.imports |= names
@@ -257,6 +286,9 @@ class Context:
             return_annotation_str = solver.annotation_resolver.unparse_annotation(return_type, self.name,
                                                                                   node.lineno, self.definition_linenos)
             node.returns = ast.parse(return_annotation_str).body[0].value
+            if hasattr(node, 'lineno'):
+                self.type_index.add((node.lineno, node.col_offset), (last_line + 1, 0), 'return',
+                                    self.qualified_name, func, return_annotation_str)
 
             names = {name.id for name in list(ast.walk(node.returns)) if isinstance(name, ast.Name)}
             self.imports |= names
@@ -275,7 +307,13 @@ class Context:
 
     def add_annotation_to_assignments(self, model, solver):
         """Add a type comment for every assignment statement in the context"""
+        # The unfolded tuple assignments replacing the original ones, spliced into the nodes at the end
+        unfolded = {}
+        context_node_ids = None
         for node, z3_t in self.assignments:
+            if self.should_remove(node):
+                # An inherited class attribute, annotated in the class defining it
+                continue
             if (len(node.targets) == 1
                and sys.version_info[0] >= 3 and sys.version_info[1] >= 6):
                 # Replace the normal assignment node with annotated assignment
@@ -288,12 +326,11 @@ class Context:
                         # Unfold tuple assignment
                         assigns = self.get_unfolded_assignments(node.targets[0], node.value, z3_t, model, solver,
                                                                 self.definition_linenos)
-                        if not assigns or node not in self.context_nodes:
+                        if context_node_ids is None:
+                            context_node_ids = {id(n) for n in self.context_nodes}
+                        if not assigns or id(node) not in context_node_ids:
                             continue
-                        idx = self.context_nodes.index(node)
-                        self.context_nodes.remove(node)
-                        for assign in reversed(assigns):
-                            self.context_nodes.insert(idx, assign)
+                        unfolded.setdefault(id(node), assigns)
                     except:
                         pass
                     continue
@@ -307,19 +344,76 @@ class Context:
                 annotation_str = solver.annotation_resolver.unparse_annotation(z3_t, self.name,
                                                                                node.lineno, self.definition_linenos)
                 node.annotation = ast.parse(annotation_str).body[0].value
+                self.add_target_to_index(node.target, annotation_str)
 
                 names = {name.id for name in list(ast.walk(node.annotation)) if isinstance(name, ast.Name)}
                 self.imports |= names
 
+        if unfolded:
+            nodes = []
+            for node in self.context_nodes:
+                if id(node) in unfolded:
+                    nodes += unfolded.pop(id(node))
+                else:
+                    nodes.append(node)
+            self.context_nodes[:] = nodes
+
         # Add the type comment for assignments in children contexts
         for child in self.children_contexts:
             child.add_annotation_to_assignments(model, solver)
 
+    def add_target_to_index(self, target, annotation_str):
+        """Add the inferred type of an assignment target to the type index"""
+        entry = self.get_target_entry(target)
+        if entry is not None:
+            self.type_index.add_node(target, *entry, annotation_str)
+
+    def get_target_entry(self, target):
+        """Return the length in the source, the kind, the scope and the name of the type index entry of a target
+
+        Names assigned in a class body and attributes of `self` assigned in a method are class attributes.
+        """
+        scope = self
+        while not scope.name and scope.parent_context is not None:
+            # Blocks of statements have no name of their own
+            scope = scope.parent_context
+        if isinstance(target, ast.Name):
+            kind = 'attribute' if scope.is_class else 'variable'
+            return len(target.id), kind, scope.qualified_name, target.id
+        if isinstance(target, ast.Attribute):
+            name = astunparse.unparse(target).strip()
+            parent = scope.parent_context
+            if (scope.is_func and parent is not None and parent.is_class and isinstance(target.value, ast.Name)
+                    and scope.node.args.args and target.value.id == scope.node.args.args[0].arg):
+                return len(name), 'attribute', parent.qualified_name, target.attr
+            return len(name), 'variable', scope.qualified_name, name
+        return None
+
+    @property
+    def qualified_name(self):
+        """The qualified name of the function or class of this context, empty at the module level"""
+        names = []
+        context = self
+        while context is not None:
+            if context.name:
+                names.append(context.name)
+            context = context.parent_context
+        return '.'.join(reversed(names))
+
+    def qualify(self, name):
+        """Return the qualified name of something named `name` in this context"""
+        scope = self.qualified_name
+        return scope + '.' + name if scope else name
+
     def get_imports(self):
+        """Return the names used in the annotations of this context and its children contexts"""
         result = set()
-        for child in self.children_contexts:
-            result |= child.get_imports()
-        return result | self.imports
+        to_visit = [self]
+        while to_visit:
+            context = to_visit.pop()
+            result |= context.imports
+            to_visit += context.children_contexts
+        return result
 
     def get_matching_methods(self, method_name):
         """Return the built-in methods in this context (or a parent context) which match the given method name"""
@@ -328,6 +422,8 @@ class Context:
             if method_name in self.builtin_methods[t]:
                 methods.append(self.builtin_methods[t][method_name])
         if self.parent_context is None:
+            for stub_context in self.stub_contexts:
+                methods += stub_context.get_stub_methods(method_name)
             return methods
         return methods + self.parent_context.get_matching_methods(method_name)
 
@@ -387,6 +483,8 @@ class Context:
             annotation_str = solver.annotation_resolver.unparse_annotation(z3_t, self.name,
                                                                            node.lineno, self.definition_linenos)
             annotation = ast.parse(annotation_str).body[0].value
+            self.add_target_to_index(node, annotation_str)
+            self.imports |= {name.id for name in ast.walk(annotation) if isinstance(name, ast.Name)}
             node = ast.AnnAssign(
                 target=node,
                 value=value,
@@ -402,6 +500,78 @@ class Context:
             )]
 
 
+class StubContext(Context):
+    """The global context of a stub file.
+
+    Function definitions and variable assignments in the stub are registered as pending,
+    and are only inferred the first time their name is looked up. This way, only the stubs
+    which are actually used by the program add constraints to the solver.
+    """
+
+    def __init__(self, tree, solver, infer_func, method_type=None):
+        super().__init__(tree, tree.body, solver)
+        self.solver = solver
+        self.infer_func = infer_func
+        self.method_type = method_type
+        self.pending = {}
+
+    def add_pending(self, name, node):
+        """Defer the inference of `node`, which defines `name`, until `name` is looked up"""
+        if name not in self.pending:
+            self.pending[name] = []
+        self.pending[name].append(node)
+
+    def infer_pending(self, name):
+        """Infer the pending definitions of `name` (if any)
+
+        The definitions are inferred outside of any method, even if they are looked up while inferring one,
+        so that their subtyping constraints hold in every method.
+        """
+        nodes = self.pending.pop(name, [])
+        if not nodes:
+            return
+        z3_types = self.solver.z3_types
+        current_method = z3_types.current_method
+        z3_types.current_method = z3_types.method_sort.m__none
+        try:
+            for node in nodes:
+                # An assignment with multiple targets is pending under each of its targets
+                if getattr(node, 'stub_inferred', False):
+                    continue
+                node.stub_inferred = True
+                self.infer_func(node, self, self.solver)
+        finally:
+            z3_types.current_method = current_method
+
+    def infer_all_pending(self):
+        """Infer all the pending definitions in the stub"""
+        for name in list(self.pending):
+            self.infer_pending(name)
+
+    def get_type(self, var_name, passed_func=False):
+        self.infer_pending(var_name)
+        return super().get_type(var_name, passed_func)
+
+    def get_matching_methods(self, method_name):
+        if self.method_type:
+            self.infer_pending(method_name)
+        return super().get_matching_methods(method_name)
+
+    def get_stub_type(self, var_name):
+        """Return the type of `var_name` defined in this stub, or None if it's not defined here"""
+        if self.method_type:
+            # Methods stubs are only accessible through `get_stub_methods`
+            return None
+        self.infer_pending(var_name)
+        return self.types_map.get(var_name)
+
+    def get_stub_methods(self, method_name):
+        """Return the built-in methods defined in this stub which match the given method name"""
+        if not self.method_type:
+            return []
+        return self.get_matching_methods(method_name)
+
+
 class AnnotatedFunction:
     def __init__(self, args_annotations, return_annotation, defaults_count, module):
         self.args_annotations = args_annotations
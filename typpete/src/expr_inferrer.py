@@ -558,8 +558,9 @@ def _get_builtin_attr_access_axioms(instance_type, attr, result_type, context, s
         # (i.e. the built-in type whose attributes we are trying to access)
         first_arg = method.args_annotations[0]
 
-        # Resolve the annotation into a Z3 type
-        resolved_type = solver.annotation_resolver.resolve(first_arg, solver, {})
+        # Resolve the annotation into a Z3 type, with fresh type variables for this access
+        resolved_type = solver.annotation_resolver.resolve(first_arg, solver, method.module,
+                                                           generics_map={}, annotated=True)
 
         # Making result type to be none to prevent it from satisfying user-defined call axioms
         # in function call inference. Because built-ins are not handled with Z3.
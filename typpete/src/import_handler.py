@@ -1,6 +1,12 @@
 import ast
 import astunparse
+import difflib
+import hashlib
 import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typpete.src import annotation_writer, module_cache
+from typpete.src.config import config
 from typpete.src.context import Context
 from typpete.src.stubs.stubs_paths import libraries
 from typpete.src.stubs.stubs_handler import STUB_ASTS
@@ -9,9 +15,12 @@ from typpete.src.stubs.stubs_handler import STUB_ASTS
 class ImportHandler:
     """Handler for importing other modules during the type inference"""
     cached_asts = {}
+    cached_paths = {}
     cached_modules = {}
+    module_indexes = {}
     module_to_path = {}
-    class_to_module = {
+    module_sources = {}
+    typing_classes = {
         'List': ('typing', 0),
         'Tuple': ('typing', 0),
         'Callable': ('typing', 0),
@@ -26,6 +35,22 @@ class ImportHandler:
         'Sequence': ('typing', 0),
         'Iterator': ('typing', 0),
     }
+    class_to_module = dict(typing_classes)
+
+    @staticmethod
+    def reset():
+        """Discard the cached modules before another inference in the same process
+
+        The cached ASTs are annotated by the type inference, so they cannot be reused by another inference.
+        The daemon, the language server and the in-memory API start every inference from freshly parsed modules.
+        """
+        ImportHandler.cached_asts = {}
+        ImportHandler.cached_paths = {}
+        ImportHandler.cached_modules = {}
+        ImportHandler.module_indexes = {}
+        ImportHandler.module_to_path = {}
+        ImportHandler.module_sources = {}
+        ImportHandler.class_to_module = dict(ImportHandler.typing_classes)
 
     @staticmethod
     def get_ast(path, module_name):
@@ -39,19 +64,93 @@ class ImportHandler:
         if path in STUB_ASTS:
             return STUB_ASTS[path]
         try:
-            if os.path.isdir(path[:-3]):
-                path = path[:-3]
-                path += '/__init__.py'
             r = open(path)
         except FileNotFoundError:
             raise ImportError("No module named {}.".format(module_name))
 
-        ImportHandler.module_to_path[module_name] = path
-        tree = ast.parse(r.read())
+        resolved_path = os.path.abspath(path)
+        if resolved_path in ImportHandler.cached_paths:
+            # The same file imported under a different name
+            r.close()
+            tree = ImportHandler.cached_paths[resolved_path]
+            ImportHandler.cached_asts[module_name] = tree
+            return tree
+
+        source = r.read()
         r.close()
+        tree, source_hash, _ = parse_source(source, path)
+        return ImportHandler.add_parsed_module(module_name, path, tree, source_hash)
+
+    @staticmethod
+    def add_parsed_module(module_name, path, tree, source_hash):
+        """Cache the AST of a python module which is parsed from the given path"""
+        tree._source_hash = source_hash
+        tree._source_path = path
+        ImportHandler.module_to_path[module_name] = path
         ImportHandler.cached_asts[module_name] = tree
+        ImportHandler.cached_paths[os.path.abspath(path)] = tree
         return tree
 
+    @staticmethod
+    def get_import_closure(module_name, base_folder):
+        """Return the names and source hashes of the user modules in the import closure of the given module"""
+        closure = {}
+        to_visit = [module_name]
+        while to_visit:
+            name = to_path_name(to_visit.pop())
+            if name in closure or ImportHandler.is_builtin(name):
+                continue
+            tree = ImportHandler.get_module_ast(name, base_folder)
+            closure[name] = tree._source_hash
+            to_visit += get_imported_names(ast.walk(tree))
+        return list(closure.items())
+
+    @staticmethod
+    def prefetch_module_asts(module_name, base_folder):
+        """Parse the user modules in the import closure of the given module ahead of the pre-analysis
+
+        The modules are discovered level by level, and the modules of every level are parsed
+        in a pool of processes. The trees are pickled back to this process, which takes longer than
+        parsing them for small modules, so this is only enabled by the `parallel_parsing` flag.
+        """
+        index = ImportHandler.get_module_index(base_folder)
+        seen = set()
+        to_parse = [module_name]
+        with ProcessPoolExecutor() as executor:
+            while to_parse:
+                modules = []
+                for name in to_parse:
+                    name = to_path_name(name)
+                    if name in seen or ImportHandler.is_builtin(name):
+                        continue
+                    seen.add(name)
+                    module = index.get(name)
+                    if module is None:
+                        # Let the import walk report the missing module
+                        continue
+                    if name in ImportHandler.cached_asts or os.path.abspath(module.path) in ImportHandler.cached_paths:
+                        tree = ImportHandler.get_ast(module.path, name)
+                        modules.append((name, module.path, get_imported_names(ast.walk(tree))))
+                    else:
+                        modules.append((name, module.path, None))
+
+                paths = [path for (_, path, imports) in modules if imports is None]
+                if len(paths) > 1:
+                    parsed = iter(executor.map(parse_file, paths))
+                else:
+                    parsed = iter(map(parse_file, paths))
+
+                to_parse = []
+                for name, path, imports in modules:
+                    if imports is None:
+                        tree, source_hash, imports = next(parsed)
+                        if os.path.abspath(path) in ImportHandler.cached_paths:
+                            # Another name of a module parsed in the same level
+                            ImportHandler.get_ast(path, name)
+                        else:
+                            ImportHandler.add_parsed_module(name, path, tree, source_hash)
+                    to_parse += imports
+
     @staticmethod
     def get_module_ast(module_name, base_folder):
         """Get the AST of a python module
@@ -59,10 +158,20 @@ class ImportHandler:
         :param module_name: the name of the python module
         :param base_folder: the base folder containing the python module
         """
-        module_name = module_name.replace('.', '/')
-        if not base_folder:
-            return ImportHandler.get_ast(module_name + ".py", module_name)
-        return ImportHandler.get_ast("{}/{}.py".format(base_folder, module_name), module_name)
+        module_name = to_path_name(module_name)
+        if module_name in ImportHandler.cached_asts:
+            return ImportHandler.cached_asts[module_name]
+        module = ImportHandler.get_module_index(base_folder).get(module_name)
+        if module is None:
+            raise ImportError("No module named {}.".format(module_name))
+        return ImportHandler.get_ast(module.path, module_name)
+
+    @staticmethod
+    def get_module_index(base_folder):
+        """Return the index of the modules in the given base folder"""
+        if base_folder not in ImportHandler.module_indexes:
+            ImportHandler.module_indexes[base_folder] = ModuleIndex(base_folder)
+        return ImportHandler.module_indexes[base_folder]
 
     @staticmethod
     def get_builtin_ast(module_name):
@@ -82,7 +191,7 @@ class ImportHandler:
                                                                                                solver.config.used_names,
                                                                                                            infer_func)
         else:
-            t = ImportHandler.get_module_ast(module_name, base_folder)
+            t = solver.module_graph.get_module_ast(module_name)
 
             class_names = [c.name for c in t.body if isinstance(c, ast.ClassDef)]
             for cls in class_names:
@@ -101,50 +210,338 @@ class ImportHandler:
         return module_name in libraries
 
     @staticmethod
-    def write_to_files(model, solver):
+    def get_inferred_modules():
+        """Return a generator of the names, the paths, the ASTs and the contexts of the imported user modules"""
         for module in ImportHandler.module_to_path:
             if ImportHandler.is_builtin(module) or module.replace('/', '.') not in ImportHandler.cached_modules:
                 continue
-            module_path = ImportHandler.module_to_path[module]
             module_ast = ImportHandler.cached_asts[module]
             module_context = ImportHandler.cached_modules[module.replace('/', '.')]
+            yield module, ImportHandler.module_to_path[module], module_ast, module_context
+
+    @staticmethod
+    def generate_typed_modules(model, solver):
+        """Annotate the ASTs of the imported user modules with the types of the model
+
+        :return: A generator of the names, the paths, the typed ASTs and the contexts of the modules.
+                 The required imports are not added yet, see `get_typed_source`.
+        """
+        for module, module_path, module_ast, module_context in ImportHandler.get_inferred_modules():
             module_context.generate_typed_ast(model, solver)
+            yield module, module_path, module_ast, module_context
 
-            ImportHandler.add_required_imports(module, module_ast, module_context)
+    @staticmethod
+    def write_to_files(model, solver, output_folder="inference_output", result_writer=None):
+        """Write the typed ASTs of the imported modules, returning the paths of the output files
 
-            write_path = "inference_output/" + module_path
-            if not os.path.exists(os.path.dirname(write_path)):
-                os.makedirs(os.path.dirname(write_path))
-            file = open(write_path, 'w')
-            file.write(astunparse.unparse(module_ast))
-            file.close()
+        The types of every module are also added to the given result writer, if any.
+        """
+        output_files = []
+        for module, module_path, module_ast, module_context in ImportHandler.generate_typed_modules(model, solver):
+            write_path = output_folder + "/" + module_path
+            output_files.append(ImportHandler.write_typed_module(module, write_path, module_ast, module_context))
+            if config['output_type_index']:
+                output_files.append(write_type_index(write_path, module_context.type_index))
+            if result_writer is not None:
+                result_writer.write_module(module.replace('/', '.'), module_context.type_index)
+        return output_files
 
     @staticmethod
-    def add_required_imports(module_name, module_ast, module_context):
+    def write_typed_module(module_name, write_path, module_ast, module_context):
+        """Write the annotated source of a module whose typed AST was generated
+
+        With `output_diffs`, a unified diff against the original source is written instead,
+        to the same path with the extension `.diff`. An existing file with the same content is left untouched.
+        :return: The path of the output file
+        """
+        typed_source = ImportHandler.get_typed_source(module_name, module_ast, module_context)
+        if config['output_diffs']:
+            source_path = ImportHandler.module_to_path[module_name].lstrip('/')
+            original = ImportHandler.get_source(module_name)
+            typed_source = ''.join(difflib.unified_diff(get_diff_lines(original), get_diff_lines(typed_source),
+                                                        'a/' + source_path, 'b/' + source_path))
+            write_path += '.diff'
+        write_if_changed(write_path, typed_source)
+        return write_path
+
+    @staticmethod
+    def get_required_imports(module_name, module_ast, module_context):
+        """Return the import statements of the names used in the type annotations of a module"""
         imports = module_context.get_imports()
 
         if has_type_var(module_ast):
             imports.add('TypeVar')
+        return get_import_nodes(module_name, imports, ImportHandler.class_to_module)
+
+    @staticmethod
+    def add_required_imports(module_name, module_ast, module_context):
+        # Each import used to be inserted at the top, so they end up in reverse order
+        import_nodes = ImportHandler.get_required_imports(module_name, module_ast, module_context)
+        module_ast.body[0:0] = reversed(import_nodes)
+
+    @staticmethod
+    def get_source(module_name):
+        """Return the source of a user module"""
+        if module_name in ImportHandler.module_sources:
+            return ImportHandler.module_sources[module_name]
+        with open(ImportHandler.module_to_path[module_name]) as f:
+            return f.read()
+
+    @staticmethod
+    def get_typed_source(module_name, module_ast, module_context):
+        """Return the annotated source of a module whose typed AST was generated
+
+        With `preserve_formatting`, the annotations are inserted into the original source.
+        Otherwise, the source is regenerated from the typed AST.
+        """
+        if config['preserve_formatting']:
+            import_nodes = ImportHandler.get_required_imports(module_name, module_ast, module_context)
+            return annotation_writer.annotate_source(ImportHandler.get_source(module_name), module_context,
+                                                     import_nodes)
+        ImportHandler.add_required_imports(module_name, module_ast, module_context)
+        return astunparse.unparse(module_ast)
+
+
+IndexedModule = namedtuple('IndexedModule', ['path', 'is_package', 'mtime', 'size'])
 
-        module_to_names = {}
-        for imp in imports:
-            if imp not in ImportHandler.class_to_module:
+
+class ModuleIndex:
+    """Index of the python modules in a project folder
+
+    Every module name (in the form `package/module`) is mapped to the path of its file, whether it is
+    a package (i.e. a folder with an `__init__.py` file), its modification time and its size. A package
+    takes precedence over a module file with the same name.
+
+    The folders are scanned lazily: a folder is listed the first time a module in it is looked up, so
+    only the folders of the imported packages are ever visited. A folder is listed again when a module
+    is missing from it and the folder has been modified since, e.g. a module was added to it.
+    Module names may also be paths outside the base folder, like the path of the input file.
+    """
+    ignored_folders = {'__pycache__', 'inference_output'}
+
+    def __init__(self, base_folder):
+        self.base_folder = base_folder
+        self.modules = {}
+        self.scanned = {}
+
+    def get(self, module_name):
+        """Return the indexed module with the given name, or None if there is no such module"""
+        package = module_name.split('/')[:-1]
+        folder = self.get_folder(package)
+        if folder not in self.scanned:
+            self.scan(folder, package)
+        module = self.modules.get(module_name)
+        if module is None and self.scanned[folder] != self.get_mtime(folder):
+            self.scan(folder, package)
+            module = self.modules.get(module_name)
+        return module
+
+    def get_folder(self, package):
+        """Return the path of the folder of the package given as a list of names"""
+        return os.path.join(self.base_folder or '.', '/'.join(package))
+
+    @staticmethod
+    def get_mtime(folder):
+        try:
+            return os.stat(folder).st_mtime
+        except OSError:
+            return None
+
+    def scan(self, folder, package):
+        """Index the modules and the sub-packages in `folder`, which is the package given as a list of names"""
+        self.scanned[folder] = self.get_mtime(folder)
+        for module_name in [name for name in self.modules if name.split('/')[:-1] == package]:
+            del self.modules[module_name]
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name.startswith('.') or entry.name in ModuleIndex.ignored_folders:
                 continue
-            mod = ImportHandler.class_to_module[imp]
-            if mod in module_to_names:
-                module_to_names[mod].append(imp)
+            if entry.is_dir():
+                # Symbolic links are followed, the sub-package itself is only listed when it is looked up
+                try:
+                    stat = os.stat(os.path.join(entry.path, '__init__.py'))
+                except OSError:
+                    continue
+                module_name = '/'.join(package + [entry.name])
+                is_package = True
+            elif entry.name.endswith('.py') and entry.name != '__init__.py':
+                module_name = '/'.join(package + [entry.name[:-3]])
+                if module_name in self.modules and self.modules[module_name].is_package:
+                    continue
+                stat = entry.stat()
+                is_package = False
             else:
-                module_to_names[mod] = [imp]
+                continue
+            self.modules[module_name] = IndexedModule(self.get_path(module_name, is_package), is_package,
+                                                      stat.st_mtime, stat.st_size)
+
+    def get_path(self, module_name, is_package):
+        """Return the path of the module file, relative to the base folder as given"""
+        path = module_name + ('/__init__.py' if is_package else '.py')
+        if not self.base_folder:
+            return path
+        return os.path.join(self.base_folder, path)
+
+
+class ModuleGraph:
+    """The import graph of the program, built once before the type inference.
+
+    Every module (identified by its AST, which is shared between all the names resolving to the same file)
+    is walked only once no matter how many modules import it, and import cycles are cut at the first
+    revisit of a module.
+    """
+
+    def __init__(self, prog_ast, base_folder):
+        self.base_folder = base_folder
+        self.module_asts = {}
+        self.module_nodes = OrderedDict()
+        self.module_imports = OrderedDict()
+        self.add_module(prog_ast)
+
+    def get_module_ast(self, module_name):
+        """Return the AST of the module imported with the given name"""
+        if module_name not in self.module_asts:
+            if ImportHandler.is_builtin(module_name):
+                tree = ImportHandler.get_builtin_ast(module_name)
+            else:
+                tree = ImportHandler.get_module_ast(module_name, self.base_folder)
+            self.module_asts[module_name] = tree
+        return self.module_asts[module_name]
+
+    def add_module(self, prog_ast):
+        """Add a module, and the modules it imports, to the graph"""
+        if prog_ast in self.module_nodes:
+            return
+        nodes = list(ast.walk(prog_ast))
+        for n in nodes:
+            n._module = prog_ast
+        self.module_nodes[prog_ast] = nodes
+
+        imports = []
+        for module_name in get_imported_names(nodes):
+            tree = self.get_module_ast(module_name)
+            if tree not in imports:
+                imports.append(tree)
+        self.module_imports[prog_ast] = imports
+
+        for tree in imports:
+            self.add_module(tree)
+
+    def all_nodes(self):
+        """Return the AST nodes of all the modules in the program, each module appearing once"""
+        return [node for nodes in self.module_nodes.values() for node in nodes]
 
-        for (mod, level), names in module_to_names.items():
-            if mod == module_name:
+
+def to_path_name(module_name):
+    """Return the name of a module in the form `package/module`
+
+    A name which already is a path, like the path of the input file, is returned unchanged.
+    """
+    if '/' in module_name:
+        return module_name
+    return module_name.replace('.', '/')
+
+
+def get_imported_names(nodes):
+    """Return the names of the modules imported in the given AST nodes"""
+    nodes = list(nodes)
+    imported_names = [name.name for node in nodes if isinstance(node, ast.Import) for name in node.names]
+    for node in nodes:
+        if isinstance(node, ast.ImportFrom):
+            if node.module == "typing":
+                # FIXME ignore typing for now, not to break type vars
                 continue
-            aliases = [ast.alias(name=name, asname=None) for name in names]
-            module_ast.body.insert(0, ast.ImportFrom(
-                module=mod,
-                names=aliases,
-                level=level
-            ))
+            imported_names.append(node.module)
+    return imported_names
+
+
+def parse_source(source, path=None):
+    """Parse a python module, returning its AST, the hash of its source and the modules it imports
+
+    The AST is taken from the module cache if the module is cached.
+    :param path: The path of the module, if it is read from a file
+    """
+    source_hash = hashlib.sha1(source.encode()).hexdigest()
+    cached = module_cache.load_module(source_hash, path)
+    if cached is not None:
+        tree, summary = cached
+        tree._summary = summary
+    else:
+        tree = ast.parse(source)
+    return tree, source_hash, get_imported_names(ast.walk(tree))
+
+
+def parse_file(path):
+    """Parse the python module in the given file. Used by the worker processes of the prefetching"""
+    with open(path) as r:
+        return parse_source(r.read(), path)
+
+
+def write_type_index(module_path, type_index):
+    """Write the type index of a module next to its annotated source, returning the path of the index"""
+    index_path = module_path[:-3] + '_types.json'
+    write_if_changed(index_path, type_index.to_json())
+    return index_path
+
+
+def write_if_changed(path, text):
+    """Write a text file, unless it already has the same content, so that its modification time is kept
+
+    :return: Whether the file was written
+    """
+    data = text.encode()
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as f:
+                if hashlib.sha1(f.read()).digest() == hashlib.sha1(data).digest():
+                    return False
+    except OSError:
+        pass
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return True
+
+
+def get_diff_lines(source):
+    if source and not source.endswith('\n'):
+        source += '\n'
+    return source.splitlines(True)
+
+
+def get_import_nodes(module_name, names, class_to_module):
+    """Return the import statements of the given names used in the annotations of a module
+
+    :param class_to_module: The module (and the relative import level) defining every importable name
+    """
+    module_to_names = {}
+    # Sorted, so that the same types always give the same output
+    for imp in sorted(names):
+        if imp not in class_to_module:
+            continue
+        # A list when read from an exported problem
+        mod = tuple(class_to_module[imp])
+        if mod in module_to_names:
+            module_to_names[mod].append(imp)
+        else:
+            module_to_names[mod] = [imp]
+
+    import_nodes = []
+    for (mod, level), names in sorted(module_to_names.items(), key=lambda item: (str(item[0][0]), item[0][1])):
+        if mod == module_name:
+            continue
+        aliases = [ast.alias(name=name, asname=None) for name in names]
+        import_nodes.append(ast.ImportFrom(
+            module=mod,
+            names=aliases,
+            level=level
+        ))
+    return import_nodes
+
 
 def has_type_var(tree):
     return any(node.value.func.id for node in tree.body if
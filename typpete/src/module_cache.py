@@ -0,0 +1,107 @@
+"""On-disk cache of the parsed modules and their pre-analysis summaries
+
+Every entry holds the AST of a module together with its pre-analysis summary, pickled together
+so that the summary keeps referring to the nodes of the cached AST. The entries are keyed by
+the hash of the module source, so a changed module simply misses the cache.
+
+Long-running sessions can additionally keep the entries in memory, by setting `memory` to a MemoryCache.
+"""
+import os
+import pickle
+import sys
+from collections import OrderedDict
+from typpete.src.config import config
+
+# To be increased whenever the format of the cached entries changes
+CACHE_VERSION = 1
+
+# The maximum number of modules kept in memory by a long-running session
+MEMORY_CACHE_SIZE = 1000
+
+
+class MemoryCache:
+    """In-memory cache of the pickled entries of the modules, keyed by module path
+
+    Only the entry of the last version of a module is kept, so the older versions of an edited module
+    are dropped. Beyond `max_modules` modules, the least recently used module is evicted.
+    """
+
+    def __init__(self, max_modules=MEMORY_CACHE_SIZE):
+        self.max_modules = max_modules
+        # The source hash and the pickled entry of every module, the least recently used module first
+        self.entries = OrderedDict()
+
+    def load(self, path, source_hash):
+        """Return the cached AST and summary of the module at the given path, or None if it is not cached
+        with the given source hash"""
+        path = os.path.abspath(path)
+        entry = self.entries.get(path)
+        if entry is None or entry[0] != source_hash:
+            return None
+        self.entries.move_to_end(path)
+        return pickle.loads(entry[1])
+
+    def store(self, path, source_hash, data):
+        path = os.path.abspath(path)
+        self.entries[path] = (source_hash, data)
+        self.entries.move_to_end(path)
+        while len(self.entries) > self.max_modules:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# The MemoryCache of the session, or None if the entries are not kept in memory
+memory = None
+
+
+def get_cache_path(source_hash):
+    """Return the path of the cache entry of the module with the given source hash"""
+    folder = "modules-{}-py{}{}".format(CACHE_VERSION, *sys.version_info[:2])
+    return os.path.join(config["cache_folder"], folder, source_hash + ".pickle")
+
+
+def load_module(source_hash, path=None):
+    """Return the cached AST and summary of the module with the given source hash, or None if not cached
+
+    :param path: The path of the module, to look it up in the memory cache
+    """
+    if memory is not None and path is not None:
+        cached = memory.load(path, source_hash)
+        if cached is not None:
+            return cached
+    if not config["cache_modules"]:
+        return None
+    try:
+        with open(get_cache_path(source_hash), "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        # Missing, corrupted or outdated entry
+        return None
+
+
+def store_module(source_hash, tree, summary, path=None):
+    """Add the AST and the pre-analysis summary of a module to the cache
+
+    :param path: The path of the module, to keep it in the memory cache
+    """
+    in_memory = memory is not None and path is not None
+    if not in_memory and not config["cache_modules"]:
+        return
+    try:
+        data = pickle.dumps((tree, summary), pickle.HIGHEST_PROTOCOL)
+    except RecursionError:
+        # Too deep to be pickled, the module is parsed every time
+        return
+    if in_memory:
+        memory.store(path, source_hash, data)
+    if not config["cache_modules"]:
+        return
+    cache_path = get_cache_path(source_hash)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # Write to a temporary file first, so that concurrent runs never read a partial entry
+    temp_path = "{}.{}".format(cache_path, os.getpid())
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, cache_path)
@@ -1,10 +1,12 @@
-from collections import OrderedDict
+from collections import Counter, OrderedDict
 
 from copy import copy
 from typpete.src.config import config
 from typpete.src.constants import ALIASES, BUILTINS
-from typpete.src.import_handler import ImportHandler
+from typpete.src.import_handler import ModuleGraph
+from typpete.src import module_cache
 import ast
+import sys
 
 
 def get_module(node):
@@ -16,6 +18,65 @@ def get_module(node):
         return get_module(node._parent)
     return None
 
+class ModuleSummary:
+    """The statistics and definitions of a module which are needed by the pre-analysis.
+
+    All of them are collected in a single pass over the nodes of the module.
+    """
+
+    def __init__(self, nodes, module=None):
+        self.module = module
+        self.max_tuple_length = 0
+        # A minimum value of 1 because a default __init__ with one argument function
+        # is added to classes that doesn't contain one
+        self.max_function_args = 1
+        self.max_default_args = 0
+        self.class_defs = []
+        self.func_defs = []
+        self.type_vars = []
+
+        # The number of occurrences of every (interned) name used in the module
+        self.used_names = Counter()
+        for node in nodes:
+            if isinstance(node, ast.Name):
+                self.used_names[sys.intern(node.id)] += 1
+            elif isinstance(node, ast.Attribute):
+                self.used_names[sys.intern(node.attr)] += 1
+            elif isinstance(node, ast.Tuple):
+                self.max_tuple_length = max(self.max_tuple_length, len(node.elts))
+            elif isinstance(node, ast.FunctionDef):
+                self.func_defs.append(node)
+                self.max_function_args = max(self.max_function_args, len(node.args.args))
+                self.max_default_args = max(self.max_default_args, len(node.args.defaults))
+            elif isinstance(node, ast.Lambda):
+                self.max_function_args = max(self.max_function_args, len(node.args.args))
+            elif isinstance(node, ast.ClassDef):
+                self.class_defs.append(node)
+                self.used_names[sys.intern(node.name)] += 1
+            elif isinstance(node, ast.alias):
+                self.used_names[sys.intern(node.name)] += 1
+            elif (isinstance(node, ast.Assign) and isinstance(node.value, ast.Call)
+                  and isinstance(node.value.func, ast.Name)
+                  and node.value.func.id == 'TypeVar'):
+                self.type_vars.append(node)
+
+    @staticmethod
+    def of_module(module, nodes):
+        """Return the summary of the given module AST, collecting it only once per AST
+
+        The summary is kept on the AST, so it lives as long as the AST itself. The summary of a
+        module loaded from the on-disk cache is loaded with it.
+        """
+        summary = getattr(module, '_summary', None)
+        if summary is None or summary.module is not module:
+            summary = ModuleSummary(nodes, module)
+            module._summary = summary
+            source_hash = getattr(module, '_source_hash', None)
+            if source_hash is not None:
+                module_cache.store_module(source_hash, module, summary, getattr(module, '_source_path', None))
+        return summary
+
+
 class PreAnalyzer:
     """Analyzer for the AST, It provides the following configurations before the type inference:
         - The maximum args length of functions in the whole program
@@ -29,96 +90,45 @@ class PreAnalyzer:
         """
         :param prog_ast: The AST for the python program  
         """
-        # List all the nodes existing in the AST
         self.base_folder = base_folder
-        self.analyzed = set()
-        self.all_nodes = self.walk(prog_ast)
+        self.module_graph = ModuleGraph(prog_ast, base_folder)
+        self.summaries = [ModuleSummary.of_module(module, nodes)
+                          for module, nodes in self.module_graph.module_nodes.items()]
 
         # Pre-analyze only used constructs from the stub files.
-        used_names = self.get_all_used_names()
-        stub_asts = stubs_handler.get_relevant_ast_nodes(used_names)
-        self.stub_nodes = []
+        self.used_names = self.get_all_used_names()
+        stub_asts = stubs_handler.get_relevant_ast_nodes(set(self.used_names))
+        stub_nodes = []
         for stub_ast in stub_asts:
-            self.stub_nodes += list(ast.walk(stub_ast))
-
-
-    def walk(self, prog_ast):
-        result = list(ast.walk(prog_ast))
-        for n in result:
-            n._module = prog_ast
-        import_nodes = [node for node in result if isinstance(node, ast.Import)]
-        import_from_nodes = [node for node in result if isinstance(node, ast.ImportFrom)]
-        for node in import_nodes:
-            for name in node.names:
-                if name in self.analyzed:
-                    continue
-                if ImportHandler.is_builtin(name.name):
-                    new_ast = ImportHandler.get_builtin_ast(name.name)
-                else:
-                    new_ast = ImportHandler.get_module_ast(name.name, self.base_folder)
-                self.analyzed.add(name)
-                result += self.walk(new_ast)
-        for node in import_from_nodes:
-            if node.module == "typing":
-                # FIXME ignore typing for now, not to break type vars
-                continue
-            if ImportHandler.is_builtin(node.module):
-                new_ast = ImportHandler.get_builtin_ast(node.module)
-            else:
-                new_ast = ImportHandler.get_module_ast(node.module, self.base_folder)
-            result += self.walk(new_ast)
-
-        return result
-
-    def add_stub_ast(self, tree):
-        """Add an AST of a stub file to the pre-analyzer"""
-        self.stub_nodes += list(ast.walk(tree))
+            stub_nodes += list(ast.walk(stub_ast))
+        self.stubs_summary = ModuleSummary(stub_nodes)
 
     def maximum_function_args(self):
         """Get the maximum number of function arguments appearing in the AST"""
-        user_func_defs = [node for node in self.all_nodes if isinstance(node, (ast.FunctionDef, ast.Lambda))]
-        stub_func_defs = [node for node in self.stub_nodes if isinstance(node, (ast.FunctionDef, ast.Lambda))]
-
-        # A minimum value of 1 because a default __init__ with one argument function
-        # is added to classes that doesn't contain one
-        user_func_max = max([len(node.args.args) for node in user_func_defs] + [1])
-        stub_func_max = max([len(node.args.args) for node in stub_func_defs] + [1])
-
-        return max(user_func_max, stub_func_max)
+        return max(s.max_function_args for s in self.summaries + [self.stubs_summary])
 
     def max_default_args(self):
         """Get the maximum number of default arguments appearing in all function definitions"""
-        func_defs = [node for node in (self.all_nodes + self.stub_nodes) if isinstance(node, ast.FunctionDef)]
-        return max([len(node.args.defaults) for node in func_defs] + [0])
+        return max(s.max_default_args for s in self.summaries + [self.stubs_summary])
 
     def maximum_tuple_length(self):
         """Get the maximum length of tuples appearing in the AST"""
-        user_tuples = [node for node in self.all_nodes if isinstance(node, ast.Tuple)]
-        stub_tuples = [node for node in self.stub_nodes if isinstance(node, ast.Tuple)]
-
-        user_max = max([len(node.elts) for node in user_tuples] + [0])
-        stub_tuples = max([len(node.elts) for node in stub_tuples] + [0])
-
-        return max(user_max, stub_tuples)
+        return max(s.max_tuple_length for s in self.summaries + [self.stubs_summary])
 
     def get_all_used_names(self):
-        """Get all used variable names and used-defined classes names"""
-        names = [node.id for node in self.all_nodes if isinstance(node, ast.Name)]
-        names += [node.name for node in self.all_nodes if isinstance(node, ast.ClassDef)]
-        names += [node.attr for node in self.all_nodes if isinstance(node, ast.Attribute)]
-        names += [node.name for node in self.all_nodes if isinstance(node, ast.alias)]
-        return names
+        """Get the set of all used variable names and used-defined classes names"""
+        used_names = set()
+        for s in self.summaries:
+            used_names.update(s.used_names)
+        return used_names
 
     def analyze_functions(self, conf):
         """
         Pre-analyze functions
         """
-        type_vars = [node for node in self.all_nodes + self.stub_nodes
-                     if (isinstance(node, ast.Assign) and isinstance(node.value, ast.Call)
-                         and isinstance(node.value.func, ast.Name)
-                         and node.value.func.id == 'TypeVar')]
-        functions = [node for node in self.all_nodes + self.stub_nodes
-                     if isinstance(node, ast.FunctionDef)]
+        all_summaries = self.summaries + [self.stubs_summary]
+        type_vars = [node for s in all_summaries for node in s.type_vars]
+        functions = [node for s in all_summaries for node in s.func_defs]
         existing_type_vars = {str(item) for entry in dict(conf.type_params, **conf.class_type_params) for item in entry}
 
         for tv in type_vars:
@@ -133,26 +143,27 @@ class PreAnalyzer:
                 tv_id = tv_id + str(current)
             conf.type_vars[(tv._module, tv_name)] = tv_id
 
-
+        module_type_vars = {}
+        for (module, name) in conf.type_vars.keys():
+            module_type_vars.setdefault(module, set()).add(name)
 
         for func in functions:
-            local_type_vars = [name for (module, name) in conf.type_vars.keys()
-                               if module is get_module(func)]
+            local_type_vars = module_type_vars.get(get_module(func), set())
+            if not local_type_vars:
+                continue
+            class_tvs = set()
+            if hasattr(func, '_containing_class'):
+                class_tvs = {node.id for base in func._containing_class.bases for node in ast.walk(base)
+                             if isinstance(node, ast.Name) and node.id in local_type_vars}
             all_tv_refs = set()
             for annotation in [ann.annotation for ann in func.args.args if ann.annotation is not None] + ([func.returns] if func.returns else []):
-                tv_refs = [node.id for node in ast.walk(annotation)
-                           if isinstance(node, ast.Name) and node.id in local_type_vars]
-                tv_refs = list(OrderedDict.fromkeys(tv_refs))  # remove duplicates
-                if hasattr(func, '_containing_class'):
-                    class_tvs = {node.id for base in func._containing_class.bases for node in ast.walk(base)
-                                 if isinstance(node, ast.Name) and node.id in local_type_vars}
-                    tv_refs = [tvr for tvr in tv_refs if tvr not in class_tvs]
-                all_tv_refs |= set(tv_refs)
+                all_tv_refs |= {node.id for node in ast.walk(annotation)
+                                if isinstance(node, ast.Name) and node.id in local_type_vars
+                                and node.id not in class_tvs}
             if all_tv_refs:
                 all_tv_refs = [conf.type_vars[(func._module, tv)] for tv in all_tv_refs]
                 conf.type_params[func.name] = all_tv_refs
 
-
     def analyze_classes(self, conf):
         """Pre-analyze and configure classes before the type inference
         
@@ -164,7 +175,7 @@ class PreAnalyzer:
             
 
         """
-        class_defs = [node for node in self.all_nodes + self.stub_nodes if isinstance(node, ast.ClassDef)]
+        class_defs = [node for s in self.summaries + [self.stubs_summary] for node in s.class_defs]
         inherited_funcs_to_super = propagate_attributes_to_subclasses(class_defs)
 
         class_to_instance_attributes = OrderedDict()
@@ -284,7 +295,7 @@ class PreAnalyzer:
         config.inherited_funcs_to_super = class_analysis[4]
         config.abstract_classes = class_analysis[5]
 
-        config.used_names = self.get_all_used_names()
+        config.used_names = set(self.used_names)
         config.max_default_args = self.max_default_args()
 
         self.analyze_functions(config)
@@ -305,7 +316,7 @@ class Configuration:
         self.class_to_base = OrderedDict()
         self.class_to_funcs = OrderedDict()
         self.base_folder = ""
-        self.used_names = []
+        self.used_names = set()
         self.max_default_args = 0
         self.all_classes = {}
         self.type_params = type_params
@@ -425,11 +436,19 @@ def merge(*lists):
     return res
 
 
-def get_linearization(cls, class_to_bases):
-    """Apply C3 linearization algorithm to resolve the MRO."""
-    bases = class_to_bases[cls]
-    bases_linearizations = [get_linearization(x, class_to_bases) for x in bases]
-    return [cls] + merge(*bases_linearizations, copy(bases))  # Copy `bases` so as not to modify the original mapping
+def get_linearization(cls, class_to_bases, linearizations=None):
+    """Apply C3 linearization algorithm to resolve the MRO.
+
+    The linearizations computed so far are memoized in `linearizations`.
+    """
+    if linearizations is None:
+        linearizations = {}
+    if cls not in linearizations:
+        bases = class_to_bases[cls]
+        # Copy the memoized linearizations, because merge removes elements from its arguments
+        bases_linearizations = [list(get_linearization(x, class_to_bases, linearizations)) for x in bases]
+        linearizations[cls] = [cls] + merge(*bases_linearizations, copy(bases))  # Copy `bases` so as not to modify the original mapping
+    return linearizations[cls]
 
 
 def propagate_attributes_to_subclasses(class_defs):
@@ -447,23 +466,20 @@ def propagate_attributes_to_subclasses(class_defs):
     # all classes are processed.
     class_to_inherited_funcs = {}
     class_to_inherited_attrs = {}
+    linearizations = {}
     for class_def in class_defs:
-        class_linearization = get_linearization(class_def.name, class_to_bases)
+        class_linearization = get_linearization(class_def.name, class_to_bases, linearizations)
         class_to_inherited_funcs[class_def.name] = []
         class_to_inherited_attrs[class_def.name] = []
+
+        # Keep track of all added method names, so as not to add a duplicate method.
+        class_funcs = {func.name for func in class_def.body if isinstance(func, ast.FunctionDef)}
+        class_assignments = {stmt.targets[0].id for stmt in class_def.body if isinstance(stmt, ast.Assign)}
+
         # Traverse the parents in the order given by MRO
         for parent in class_linearization:
             if parent == class_def.name:
                 continue
-            # Keep track of all added method names, so as not to add a duplicate method.
-            class_funcs = {func.name for func in
-                           (class_def.body + class_to_inherited_funcs[class_def.name])
-                           if isinstance(func, ast.FunctionDef)}
-
-            class_assignments = {stmt.targets[0].id for stmt in
-                                 (class_def.body + class_to_inherited_attrs[class_def.name])
-                                 if isinstance(stmt, ast.Assign)}
-
             parent_node = class_to_node[parent]
             # Select only functions that are not overridden in the subclasses.
             inherited_funcs = [func for func in parent_node.body
@@ -485,6 +501,8 @@ def propagate_attributes_to_subclasses(class_defs):
 
             class_to_inherited_funcs[class_def.name] += inherited_funcs
             class_to_inherited_attrs[class_def.name] += inherited_attrs
+            class_funcs.update(func.name for func in inherited_funcs)
+            class_assignments.update(attr.targets[0].id for attr in inherited_attrs)
 
     # Add the inherited functions to the AST.
     for class_def in class_defs:
@@ -0,0 +1,139 @@
+"""On-disk cache of whole inference results
+
+A result is keyed by the sources of the user modules in the import closure of the inferred file,
+the sources of Typpete itself (including the stubs), the z3 bindings and the libz3 version, and
+the effective configuration. It holds the files written by the inference (the annotated sources
+and the constraints log) together with the messages reported while inferring, so a cached result
+can be reproduced without solving anything.
+
+The entries only contain content-addressed folders and plain files, so the cache folder can be
+shared between machines. The least recently used results are evicted whenever the cache grows
+beyond `result_cache_size` megabytes.
+"""
+import filecmp
+import hashlib
+import json
+import os
+import shutil
+import z3
+from typpete.src.config import config
+
+# To be increased whenever the format of the cached results changes
+CACHE_VERSION = 1
+
+# Configuration flags which do not affect the inference result
+IGNORED_FLAGS = {"parallel_parsing", "cache_modules", "cache_results", "cache_folder", "result_cache_size"}
+
+_typpete_hash = None
+
+
+def hash_sources(sha, src_folder):
+    """Add the paths and the contents of the python files in the given folder to the hash"""
+    for folder, dirs, files in os.walk(src_folder):
+        dirs.sort()
+        for file_name in sorted(files):
+            if not file_name.endswith(".py"):
+                continue
+            path = os.path.join(folder, file_name)
+            sha.update(os.path.relpath(path, src_folder).encode())
+            with open(path, "rb") as f:
+                sha.update(f.read())
+
+
+def get_typpete_hash():
+    """Return the hash of the Typpete sources and stubs, the z3 bindings and the libz3 version, computed once
+    per process"""
+    global _typpete_hash
+    if _typpete_hash is None:
+        sha = hashlib.sha1()
+        hash_sources(sha, os.path.dirname(__file__))
+        # The solver may find another model with other bindings or another version of libz3
+        hash_sources(sha, os.path.dirname(z3.__file__))
+        sha.update(z3.get_version_string().encode())
+        _typpete_hash = sha.hexdigest()
+    return _typpete_hash
+
+
+def get_result_key(file_name, base_folder, module_hashes, class_type_params, type_params):
+    """Return the key of the inference result of the given file
+
+    :param module_hashes: The names and source hashes of the modules in the import closure of the file
+    """
+    effective_config = {flag: value for flag, value in config.items() if flag not in IGNORED_FLAGS}
+    key = json.dumps([CACHE_VERSION, get_typpete_hash(), file_name, base_folder, sorted(module_hashes),
+                      effective_config, class_type_params, type_params], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def get_results_folder():
+    return os.path.join(config["cache_folder"], "results")
+
+
+def load_result(key):
+    """Write the files of the cached result with the given key, returning its messages
+
+    Returns None if the result is not cached.
+    """
+    if not config["cache_results"]:
+        return None
+    folder = os.path.join(get_results_folder(), key)
+    try:
+        with open(os.path.join(folder, "result.json")) as f:
+            result = json.load(f)
+        for i, path in enumerate(result["files"]):
+            if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            if os.path.exists(path) and filecmp.cmp(os.path.join(folder, str(i)), path, shallow=False):
+                # Keep the modification time of unchanged files
+                continue
+            shutil.copyfile(os.path.join(folder, str(i)), path)
+        # Mark the result as recently used
+        os.utime(folder)
+    except (OSError, ValueError, KeyError):
+        return None
+    return result["messages"]
+
+
+def store_result(key, files, messages):
+    """Add an inference result to the cache
+
+    :param files: The paths of the files written by the inference
+    :param messages: The messages reported by the inference
+    """
+    if not config["cache_results"]:
+        return
+    results_folder = get_results_folder()
+    folder = os.path.join(results_folder, key)
+    # Fill a temporary folder first, so that concurrent runs never read a partial result
+    temp_folder = "{}.{}".format(folder, os.getpid())
+    os.makedirs(temp_folder, exist_ok=True)
+    for i, path in enumerate(files):
+        shutil.copyfile(path, os.path.join(temp_folder, str(i)))
+    with open(os.path.join(temp_folder, "result.json"), "w") as f:
+        json.dump({"files": files, "messages": messages}, f)
+    try:
+        os.rename(temp_folder, folder)
+    except OSError:
+        # The same result was stored by another run in the meantime
+        shutil.rmtree(temp_folder, ignore_errors=True)
+    evict_results(results_folder)
+
+
+def evict_results(results_folder):
+    """Remove the least recently used results until the cache fits in its maximum size"""
+    results = []
+    total_size = 0
+    for entry in os.scandir(results_folder):
+        if not entry.is_dir() or "." in entry.name:
+            # Results still being stored by other runs
+            continue
+        size = sum(f.stat().st_size for f in os.scandir(entry.path))
+        results.append((entry.stat().st_mtime, size, entry.path))
+        total_size += size
+
+    max_size = config["result_cache_size"] * 1024 * 1024
+    for _, size, path in sorted(results):
+        if total_size <= max_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total_size -= size
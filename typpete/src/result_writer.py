@@ -0,0 +1,110 @@
+"""Compact machine-readable output of the inference results
+
+One file is written per run, holding a header, one record per inferred module and the timings.
+A module record holds the function signatures, the variable types and the class attribute types
+of the module, by qualified name, as PEP 484 annotations:
+
+    {"module": "shapes",
+     "functions": {"Square.__init__": {"args": [["self", "'Square'"], ["x", "int"]], "return": "None"}},
+     "variables": {"unit": "Square"},
+     "class_attributes": {"Square": {"x": "int"}}}
+
+The records are written as soon as each module is annotated, so the whole document is never kept
+in memory. In the `json` format the file is a single JSON object, with the module records in its
+`modules` list. In the `binary` format the file starts with the magic bytes `TPRS` and the format
+version (one byte), followed by the records, each one made of its kind (one byte: 0 for the header,
+1 for a module, 2 for the timings), the length of its content (four bytes, big-endian) and its
+content in compact JSON. Readers can thus skip records without decoding them.
+"""
+import json
+import struct
+
+FORMAT_VERSION = 1
+BINARY_MAGIC = b'TPRS'
+
+HEADER_RECORD = 0
+MODULE_RECORD = 1
+TIMINGS_RECORD = 2
+
+FILE_EXTENSIONS = {"json": "json", "binary": "bin"}
+
+
+def get_module_record(module_name, type_index):
+    """Return the record of the types of a module, collected from its type index"""
+    functions = {}
+    variables = {}
+    class_attributes = {}
+    for entry in sorted(type_index.entries, key=lambda e: e.start):
+        if entry.kind == 'return':
+            qualified_name = entry.scope + '.' + entry.name if entry.scope else entry.name
+            functions.setdefault(qualified_name, {"args": []})["return"] = entry.type
+        elif entry.kind == 'argument':
+            functions.setdefault(entry.scope, {"args": []})["args"].append([entry.name, entry.type])
+        elif entry.kind == 'attribute':
+            class_attributes.setdefault(entry.scope, {})[entry.name] = entry.type
+        else:
+            qualified_name = entry.scope + '.' + entry.name if entry.scope else entry.name
+            variables[qualified_name] = entry.type
+    return {"module": module_name, "functions": functions, "variables": variables,
+            "class_attributes": class_attributes}
+
+
+def dump(record):
+    return json.dumps(record, separators=(',', ':'))
+
+
+class ResultWriter:
+    """Streams the results of a run to a file, in the `json` or the `binary` format"""
+
+    def __init__(self, path, result_format, header):
+        """
+        :param header: The information about the run, e.g., the inferred file and the check result
+        """
+        if result_format not in FILE_EXTENSIONS:
+            raise ValueError("Unknown result format {}".format(result_format))
+        self.path = path
+        self.binary = result_format == "binary"
+        self.file = open(path, 'wb')
+        self.modules_count = 0
+        header = dict(header, version=FORMAT_VERSION)
+        if self.binary:
+            self.file.write(BINARY_MAGIC + struct.pack('>B', FORMAT_VERSION))
+            self.write_record(HEADER_RECORD, header)
+        else:
+            self.file.write(dump(header)[:-1].encode() + b',"modules":[')
+
+    def write_record(self, kind, record):
+        content = dump(record).encode()
+        self.file.write(struct.pack('>BI', kind, len(content)) + content)
+
+    def write_module(self, module_name, type_index):
+        record = get_module_record(module_name, type_index)
+        if self.binary:
+            self.write_record(MODULE_RECORD, record)
+        else:
+            self.file.write((',' if self.modules_count else '').encode() + dump(record).encode())
+        self.modules_count += 1
+
+    def close(self, timings):
+        """Write the timings (in seconds) of the run and close the file"""
+        if self.binary:
+            self.write_record(TIMINGS_RECORD, timings)
+        else:
+            self.file.write(b'],"timings":' + dump(timings).encode() + b'}')
+        self.file.close()
+
+
+def read_binary_results(path):
+    """Return a generator of the kinds and the contents of the records in a file in the `binary` format"""
+    with open(path, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError("{} is not a Typpete result file".format(path))
+        version, = struct.unpack('>B', f.read(1))
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported result format version {}".format(version))
+        while True:
+            prefix = f.read(5)
+            if not prefix:
+                return
+            kind, length = struct.unpack('>BI', prefix)
+            yield kind, json.loads(f.read(length).decode())
@@ -0,0 +1,381 @@
+"""Export of the type inference problem of a program to SMT-LIB, and its offline replay
+
+An exported problem is a self-contained SMT-LIB file, in the dialect read by Z3 (datatypes with
+`is-<constructor>` recognizers, `assert-soft`), holding:
+
+- the declarations of the `Type` datatype and of all the constants,
+- the axioms of the type system,
+- the type constraints, each one as an implication from its tracking constant `assertion_bool_N`,
+- the soft constraints with their weights, if soft constraints are enabled,
+- the tracking constants themselves. Without these, and with the tracking constants as soft constraints
+  instead, the problem is the relaxed one solved for the programs which are not well-typed.
+
+The first line of the file is a comment holding a JSON object with the error message of every
+tracking constant, and the sources of the inferred modules with their annotation sites: the
+constants whose values are the inferred types, with the program locations they annotate.
+Replaying the file solves it and inserts the annotations into the sources, as with
+`preserve_formatting`, without parsing the program or collecting its constraints again.
+"""
+import ast
+import json
+import re
+import sys
+from collections import OrderedDict, namedtuple
+from types import SimpleNamespace
+
+from typpete.src import annotation_writer
+from typpete.src.annotation_resolver import AnnotationResolver
+from typpete.src.import_handler import ImportHandler, get_import_nodes, has_type_var
+from typpete.src.type_index import TypeIndex
+from typpete.src.z3_types import set_z3_params
+from z3 import Bool, Const, Function, Optimize, get_param, is_const, set_param, simplify, unsat
+
+FORMAT_VERSION = 1
+METADATA_PREFIX = "; typpete-problem "
+RECOGNIZER = re.compile(r"\(is_([^\s()|]+)(?=[\s)])")
+
+# A class made generic by the inference, located by its definition
+ClassLocation = namedtuple('ClassLocation', ['name', 'lineno', 'col_offset'])
+
+
+def get_position(node):
+    return [node.lineno, node.col_offset] if hasattr(node, 'lineno') else None
+
+
+class SitesCollector:
+    """Collects the annotation sites of the modules of a program
+
+    The sites are the ones annotated by `Context.generate_typed_ast`: the function signatures and
+    the assignment targets whose types are constants or constructors.
+    """
+
+    def __init__(self, solver):
+        self.type_sort = solver.z3_types.type_sort
+        self.constructor_ids = {self.type_sort.constructor(i).get_id()
+                                for i in range(self.type_sort.num_constructors())}
+        self.class_type_params = solver.z3_types.config.class_type_params
+        # The names and definition line numbers of the contexts of the sites, shared by all the modules
+        self.contexts = OrderedDict()
+
+    def get_value(self, z3_type):
+        """Return the constant or the constructor which is the given (simplified) type, or None"""
+        if not is_const(z3_type):
+            return None
+        if z3_type.decl().get_id() in self.constructor_ids:
+            return ["constructor", z3_type.decl().name()]
+        return ["const", z3_type.decl().name()]
+
+    def get_context_id(self, context):
+        key = (context.name, json.dumps(context.definition_linenos, sort_keys=True))
+        if key not in self.contexts:
+            self.contexts[key] = len(self.contexts)
+        return self.contexts[key]
+
+    def get_module_sites(self, module_context):
+        """Return the function sites, the assignment sites and the generic classes of a module"""
+        functions = []
+        assignments = []
+        to_visit = [module_context]
+        while to_visit:
+            context = to_visit.pop()
+            context_id = self.get_context_id(context)
+            removed = {node.name for node in context.context_nodes
+                       if isinstance(node, ast.FunctionDef) and context.should_remove(node)}
+            for func, node in context.func_to_ast.items():
+                if func in removed:
+                    continue
+                last_line = max(getattr(n, 'lineno', 0) for n in ast.walk(node))
+                functions.append({"type": self.get_value(context.types_map[func]), "context": context_id,
+                                  "line": node.lineno, "start": get_position(node), "end_line": last_line,
+                                  "scope": context.qualified_name, "name": func,
+                                  "args": [[arg.arg, get_position(arg)] for arg in node.args.args],
+                                  "module_level": context is module_context})
+
+            for node, z3_t in context.assignments:
+                if context.should_remove(node) or len(node.targets) != 1 or sys.version_info < (3, 6):
+                    continue
+                z3_t = simplify(z3_t)
+                if isinstance(node.targets[0], ast.Tuple):
+                    self.add_unfolded_sites(context, context_id, node.targets[0], node.value, z3_t, assignments)
+                    continue
+                value = self.get_value(z3_t)
+                if value is not None:
+                    assignments.append(self.get_target_site(context, context_id, node.targets[0], value,
+                                                            node.lineno))
+            to_visit.extend(reversed(context.children_contexts))
+
+        classes = [[cls.name, cls.lineno, cls.col_offset, [str(name) for name in self.class_type_params[cls.name]]]
+                   for cls in module_context.node.body
+                   if isinstance(cls, ast.ClassDef) and cls.name in self.class_type_params]
+        return functions, assignments, classes
+
+    def add_unfolded_sites(self, context, context_id, target, value, z3_t, sites):
+        """Add the sites of the unfolded tuple assignment, see `Context.get_unfolded_assignments`
+
+        :return: False if the assignment cannot be unfolded, in which case the following targets are not annotated
+        """
+        if isinstance(target, ast.Tuple):
+            if not isinstance(value, ast.Tuple):
+                return True
+            tuple_len = len(target.elts)
+            for i in range(tuple_len):
+                accessor_name = "tuple_{}_arg_{}".format(tuple_len, i + 1)
+                if i >= len(value.elts) or not hasattr(self.type_sort, accessor_name):
+                    return False
+                arg_z3_t = getattr(self.type_sort, accessor_name)(z3_t)
+                if not self.add_unfolded_sites(context, context_id, target.elts[i], value.elts[i], arg_z3_t, sites):
+                    return False
+            return True
+        if isinstance(target, (ast.Name, ast.Attribute)):
+            type_value = self.get_value(simplify(z3_t))
+            if type_value is None:
+                return False
+            sites.append(self.get_target_site(context, context_id, target, type_value, target.lineno))
+        return True
+
+    @staticmethod
+    def get_target_site(context, context_id, target, value, lineno):
+        site = {"type": value, "context": context_id, "line": lineno, "start": None}
+        entry = context.get_target_entry(target)
+        if entry is not None and hasattr(target, 'lineno'):
+            site["start"] = get_position(target)
+            site["length"], site["kind"], site["scope"], site["name"] = entry
+        return site
+
+
+def get_problem_assertions(solver):
+    """Return an optimization problem with all the constraints of the solver, in the order of the exported file"""
+    problem = Optimize(solver.ctx)
+    problem.add(solver.all_assertions)
+    problem.add(solver.z3_types.subtyping)
+    problem.add(solver.z3_types.subst_axioms)
+    problem.add(list(solver.forced))
+    for constraint, weight in solver.optimize.soft_constraints:
+        problem.add_soft(constraint, weight)
+    problem.add(solver.assertions_vars)
+    return problem
+
+
+def get_constructor_names(solver):
+    """Return the names of the constructors of the type and the method datatypes"""
+    names = set()
+    for sort in (solver.z3_types.type_sort, solver.z3_types.method_sort):
+        names.update(sort.constructor(i).name() for i in range(sort.num_constructors()))
+    return names
+
+
+def get_recognizer_fixer(solver):
+    """Return a function renaming the recognizers in a line printed by z3 to the SMT-LIB `is-<constructor>`
+
+    The printer names the recognizers as in the Python API, `is_<constructor>`.
+    """
+    constructor_names = get_constructor_names(solver)
+
+    def replace_recognizer(match):
+        return "(is-" + match.group(1) if match.group(1) in constructor_names else match.group(0)
+
+    def fix_recognizers(line):
+        return RECOGNIZER.sub(replace_recognizer, line) if "(is_" in line else line
+    return fix_recognizers
+
+
+def write_problem(solver, modules, path):
+    """Write the type inference problem collected by the solver to an SMT-LIB file
+
+    :param modules: The inferred modules, as (module name, source, output path, module context) tuples.
+                    The output path is the one of the annotated module, relative to the output folder.
+    """
+    collector = SitesCollector(solver)
+    metadata = {
+        "version": FORMAT_VERSION,
+        "tracking": [[str(av), solver.assertions_errors[av]] for av in solver.assertions_vars],
+        "generic_classes": [list(cls) for cls in solver.z3_types.config.all_classes if isinstance(cls, tuple)],
+        "class_to_module": ImportHandler.class_to_module,
+        "modules": [],
+    }
+    for module_name, source, output_path, module_context in modules:
+        functions, assignments, classes = collector.get_module_sites(module_context)
+        metadata["modules"].append({"module": module_name, "source": source, "output": output_path,
+                                    "type_var": has_type_var(module_context.node), "functions": functions,
+                                    "assignments": assignments, "classes": classes})
+    metadata["contexts"] = [[name, json.loads(definitions)] for name, definitions in collector.contexts]
+
+    single_line = get_param("pp.single_line")
+    set_param("pp.single_line", True)
+    try:
+        lines = get_problem_assertions(solver).sexpr().splitlines()
+    finally:
+        set_param("pp.single_line", single_line == "true")
+    fix_recognizers = get_recognizer_fixer(solver)
+    with open(path, "w") as problem_file:
+        problem_file.write(METADATA_PREFIX + json.dumps(metadata, separators=(',', ':')) + "\n")
+        for line in lines:
+            problem_file.write(fix_recognizers(line) + "\n")
+    return path
+
+
+def read_metadata(path):
+    with open(path) as problem_file:
+        first_line = problem_file.readline()
+    if not first_line.startswith(METADATA_PREFIX):
+        raise ValueError("{} is not a Typpete problem file".format(path))
+    metadata = json.loads(first_line[len(METADATA_PREFIX):])
+    if metadata["version"] != FORMAT_VERSION:
+        raise ValueError("Unsupported problem format version {}".format(metadata["version"]))
+    return metadata
+
+
+def solve_problem(path, metadata):
+    """Solve an exported problem, relaxing it if it is unsatisfiable (see `inference_runner.solve_relaxed`)
+
+    :return: The check result, the model, and the error messages of the constraints violated by the model
+    """
+    set_z3_params()
+    problem = Optimize()
+    problem.from_file(path)
+    check = problem.check()
+    if check != unsat:
+        return check, problem.model(), []
+
+    tracking = [Bool(name) for name, _ in metadata["tracking"]]
+    tracking_names = {name for name, _ in metadata["tracking"]}
+    relaxed = Optimize()
+    for assertion in problem.assertions():
+        if not (is_const(assertion) and assertion.decl().name() in tracking_names):
+            relaxed.add(assertion)
+    for av in tracking:
+        relaxed.add_soft(av)
+    relaxed.check()
+    model = relaxed.model()
+    return check, model, [message for av, (_, message) in zip(tracking, metadata["tracking"]) if not model[av]]
+
+
+class ProblemTypes:
+    """The constructors and accessors of the type datatype of a solved problem
+
+    Provides the attributes of `Z3Types` used to unparse the types into annotations.
+    """
+
+    def __init__(self, sort, generic_classes):
+        self.sort = sort
+        self.type_sort = SimpleNamespace()
+        for i in range(sort.num_constructors()):
+            constructor = sort.constructor(i)
+            setattr(self.type_sort, constructor.name(), constructor() if constructor.arity() == 0 else constructor)
+            setattr(self.type_sort, "is_" + constructor.name(), sort.recognizer(i))
+            for j in range(constructor.arity()):
+                setattr(self.type_sort, sort.accessor(i, j).name(), sort.accessor(i, j))
+        self.config = SimpleNamespace(all_classes=[tuple(cls) for cls in generic_classes])
+
+        self.object = self.type_sort.object
+        self.int = self.type_sort.int
+        self.bool = self.type_sort.bool
+        self.float = self.type_sort.float
+        self.complex = self.type_sort.complex
+        self.string = self.type_sort.str
+        self.bytes = self.type_sort.bytes
+        self.seq = self.type_sort.sequence
+        self.tuple = self.type_sort.tuple
+        self.list_type = self.type_sort.list_arg_0
+        self.set_type = self.type_sort.set_arg_0
+        self.dict_key_type = self.type_sort.dict_arg_0
+        self.dict_value_type = self.type_sort.dict_arg_1
+        self.upper = Function("upper", sort, sort)
+
+
+class ReplayedModule:
+    """The annotations of a module decoded from the model of a problem, as needed by `annotate_source`"""
+
+    def __init__(self):
+        self.type_index = TypeIndex()
+        self.used_type_vars = OrderedDict()
+        self.generic_bases = []
+        self.imports = set()
+
+
+class ProblemDecoder:
+    """Decodes the types of the annotation sites of a problem from its model, as `Context.generate_typed_ast`"""
+
+    def __init__(self, metadata, model):
+        self.metadata = metadata
+        self.model = model
+        sort = next((decl.range() for decl in model.decls() if decl.arity() == 0 and decl.range().name() == "Type"),
+                    None)
+        if sort is None:
+            raise ValueError("The model of the problem has no types")
+        self.types = ProblemTypes(sort, metadata["generic_classes"])
+        self.resolver = AnnotationResolver(self.types)
+        self.contexts = metadata["contexts"]
+
+    def evaluate(self, value):
+        kind, name = value
+        if kind == "constructor":
+            return getattr(self.types.type_sort, name)
+        return self.model.evaluate(Const(name, self.types.sort))
+
+    def unparse(self, z3_type, context_id, lineno, module):
+        context_name, definition_linenos = self.contexts[context_id]
+        annotation = self.resolver.unparse_annotation(z3_type, context_name, lineno, definition_linenos)
+        module.imports |= {name.id for name in ast.walk(ast.parse(annotation)) if isinstance(name, ast.Name)}
+        return annotation
+
+    def add_type_var(self, tvar_lit, module):
+        if str(tvar_lit) not in module.used_type_vars:
+            upper = self.model.evaluate(self.types.upper(tvar_lit))
+            module.used_type_vars[str(tvar_lit)] = self.resolver.unparse_annotation(upper)
+
+    def decode_module(self, module_metadata):
+        """Return the ReplayedModule of the annotations of a module"""
+        module = ReplayedModule()
+        type_sort = self.types.type_sort
+        for site in module_metadata["functions"]:
+            inferred_type = self.evaluate(site["type"])
+            inferred_type_name = str(inferred_type)
+            func_len = len(site["args"])
+            function_type = inferred_type
+            if inferred_type_name.startswith("generic"):
+                nargs = int(inferred_type_name[7:8])
+                function_type = getattr(type_sort, "generic{}_func".format(nargs))(inferred_type)
+                for arg in range(1, nargs + 1):
+                    tvar_lit = simplify(getattr(type_sort, inferred_type_name[:8] + "_tv" + str(arg))(inferred_type))
+                    if site["module_level"]:
+                        self.add_type_var(tvar_lit, module)
+
+            qualified_name = site["scope"] + "." + site["name"] if site["scope"] else site["name"]
+            for i, (arg_name, start) in enumerate(site["args"]):
+                arg_type = simplify(getattr(type_sort, "func_{}_arg_{}".format(func_len, i + 1))(function_type))
+                annotation = self.unparse(arg_type, site["context"], site["line"], module)
+                if start is not None:
+                    module.type_index.add(tuple(start), (start[0], start[1] + len(arg_name)), 'argument',
+                                          qualified_name, arg_name, annotation)
+
+            return_type = simplify(getattr(type_sort, "func_{}_return".format(func_len))(function_type))
+            annotation = self.unparse(return_type, site["context"], site["line"], module)
+            if site["start"] is not None:
+                module.type_index.add(tuple(site["start"]), (site["end_line"] + 1, 0), 'return', site["scope"],
+                                      site["name"], annotation)
+
+        for name, lineno, col_offset, type_params in module_metadata["classes"]:
+            args = []
+            for real_name in type_params:
+                self.add_type_var(getattr(type_sort, "tv" + real_name), module)
+                args.append("T" + real_name if real_name[0].isdigit() else real_name)
+            module.generic_bases.append((ClassLocation(name, lineno, col_offset),
+                                         "Generic[{}]".format(", ".join(args))))
+
+        for site in module_metadata["assignments"]:
+            annotation = self.unparse(self.evaluate(site["type"]), site["context"], site["line"], module)
+            if site["start"] is not None:
+                start = tuple(site["start"])
+                module.type_index.add(start, (start[0], start[1] + site["length"]), site["kind"], site["scope"],
+                                      site["name"], annotation)
+        return module
+
+    def get_typed_source(self, module_metadata, module):
+        """Return the source of a module annotated with its decoded types"""
+        imports = set(module.imports)
+        if module_metadata["type_var"] or module.used_type_vars:
+            imports.add('TypeVar')
+        import_nodes = get_import_nodes(module_metadata["module"].replace('.', '/'), imports,
+                                        self.metadata["class_to_module"])
+        return annotation_writer.annotate_source(module_metadata["source"], module, import_nodes)
@@ -27,7 +27,7 @@ import typpete.src.z3_types as z3_types
 import sys
 from typpete.src.constants import ALIASES
 from typpete.src.config import config as inference_config
-from typpete.src.context import Context, AnnotatedFunction
+from typpete.src.context import Context, AnnotatedFunction, StubContext
 from typpete.src.import_handler import ImportHandler
 
 from z3 import Or, And
@@ -55,6 +55,9 @@ def _infer_one_target(target, context, solver):
     if isinstance(target, ast.Name):
         if target.id in context.types_map:
             return context.get_type(target.id)
+        elif context.parent_context is None and context.get_stub_type(target.id) is not None:
+            # A name defined in the stubs, re-assigned at the module level
+            return context.get_stub_type(target.id)
         else:
             target_type = solver.new_z3_const("assign")
             context.set_type(target.id, target_type)
@@ -763,6 +766,8 @@ def _infer_import_from(node, context, solver):
 
     if len(node.names) == 1 and node.names[0].name == "*":
         # import all module elements
+        if isinstance(import_context, StubContext):
+            import_context.infer_all_pending()
         for v in import_context.types_map:
             context.set_type(v, import_context.get_type(v))
     else:
@@ -771,9 +776,11 @@ def _infer_import_from(node, context, solver):
             elt_name = name.name
             if name.asname:
                 elt_name = name.asname
-            if name.name not in import_context.types_map:
+            try:
+                elt_type = import_context.get_type(name.name)
+            except NameError:
                 raise ImportError("Cannot import name {}".format(name.name))
-            context.set_type(elt_name, import_context.get_type(name.name))
+            context.set_type(elt_name, elt_type)
 
     return solver.z3_types.none
 
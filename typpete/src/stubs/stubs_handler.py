@@ -1,9 +1,8 @@
 import ast
 import os
 import typpete.src.stubs.stubs_paths as paths
-from typpete.src.context import Context
+from typpete.src.context import StubContext
 
-INFERRED = {}
 STUB_ASTS = {}
 
 class StubsHandler:
@@ -11,6 +10,8 @@ class StubsHandler:
         self.asts = []
         self.lib_asts = {}
         self.methods_asts = []
+        # The contexts of the inferred stub files, which belong to the solver of this handler
+        self.inferred = {}
         cur_directory = os.path.dirname(__file__)
         classes_and_functions_files = paths.classes_and_functions
         for file in classes_and_functions_files:
@@ -42,12 +43,12 @@ class StubsHandler:
         # Infer only structs that are used in the program to be inferred
 
         # Function definitions
-        if tree in INFERRED:
-            return INFERRED[tree]
+        if tree in self.inferred:
+            return self.inferred[tree]
         relevant_nodes = self.get_relevant_nodes(tree, used_names)
 
-        context = Context(tree, tree.body, solver)
-        INFERRED[tree] = context
+        context = StubContext(tree, solver, infer_func, method_type)
+        self.inferred[tree] = context
 
         if method_type:
             # Add the flag in the statements to recognize the method statements during the inference
@@ -55,7 +56,16 @@ class StubsHandler:
                 node.method_type = method_type
 
         for stmt in relevant_nodes:
-            infer_func(stmt, context, solver)
+            if isinstance(stmt, ast.FunctionDef):
+                # Infer the function only when it's first looked up
+                context.add_pending(stmt.name, stmt)
+            elif isinstance(stmt, ast.Assign) and not is_type_var_declaration(stmt):
+                # Similarly, infer variable assignments only when they are first looked up
+                for target in stmt.targets:
+                    if isinstance(target, ast.Name):
+                        context.add_pending(target.id, stmt)
+            else:
+                infer_func(stmt, context, solver)
 
         return context
 
@@ -73,18 +83,14 @@ class StubsHandler:
 
 
         # TypeVar definitions
-        relevant_nodes += [node for node in tree.body
-                           if (isinstance(node, ast.Assign) and
-                               isinstance(node.value, ast.Call) and
-                               isinstance(node.value.func, ast.Name) and
-                               node.value.func.id == "TypeVar")]
+        relevant_nodes += [node for node in tree.body if is_type_var_declaration(node)]
 
         # Function definitions
         relevant_nodes += [node for node in tree.body
                           if (isinstance(node, ast.FunctionDef) and
                               node.name in used_names)]
 
-        name_nodes = [x.id for node in relevant_nodes for x in ast.walk(node) if isinstance(x, ast.Name)]
+        name_nodes = {x.id for node in relevant_nodes for x in ast.walk(node) if isinstance(x, ast.Name)}
         import_nodes = [node for node in tree.body if isinstance(node, ast.ImportFrom)]
         for node in import_nodes:
             appended = False
@@ -96,7 +102,7 @@ class StubsHandler:
                     appended = True
                     relevant_nodes.append(self.lib_asts[node.module])
                     relevant_nodes.append(node)
-                    used_names.append(name.name)
+                    used_names.add(name.name)
 
 
         # Variable assignments
@@ -127,15 +133,15 @@ class StubsHandler:
         return relevant_nodes
 
     def infer_all_files(self, context, solver, used_names, infer_func):
+        # The stub definitions are looked up through the stub contexts, and inferred on first use
         for tree in self.asts:
             ctx = self.infer_file(tree, solver, used_names, infer_func)
-            # Merge the stub types into the context
-            context.types_map.update(ctx.types_map)
+            context.stub_contexts.append(ctx)
 
         for tree in self.methods_asts:
             ctx = self.infer_file(tree, solver, used_names, infer_func,
                                   tree.method_type)
-            context.builtin_methods.update(ctx.builtin_methods)
+            context.stub_contexts.append(ctx)
 
     def infer_builtin_lib(self, module_name, solver, used_names, infer_func):
         """
@@ -153,3 +159,11 @@ class StubsHandler:
         for n in all_nodes:
             n._module = lib_ast
         return self.infer_file(lib_ast, solver, used_names, infer_func)
+
+
+def is_type_var_declaration(node):
+    """Check if the node is a TypeVar declaration, e.g., T = TypeVar("T")"""
+    return (isinstance(node, ast.Assign) and
+            isinstance(node.value, ast.Call) and
+            isinstance(node.value.func, ast.Name) and
+            node.value.func.id == "TypeVar")
@@ -0,0 +1,100 @@
+"""Index of the inferred types by source position
+
+The index maps the source ranges of the annotated program elements (function arguments,
+function definitions with their return types, assigned variables and attributes) to their
+inferred types, given as PEP 484 annotations. Every entry also holds the qualified name of its
+scope: the function of an argument, the class or function defining a function or a variable,
+and the class of an attribute.
+
+Positions are (line, column) pairs as in the AST: lines start at 1 and columns at 0. Ranges are
+half-open. A function definition ranges from its first line to the start of the line following
+its last statement, so its entry encloses the entries of its arguments and its body.
+"""
+import json
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+TypeEntry = namedtuple('TypeEntry', ['start', 'end', 'kind', 'scope', 'name', 'type'])
+
+
+class TypeIndex:
+    """Interval index from source ranges to the inferred types of a module
+
+    The ranges of the entries must be nested or disjoint. The entries are kept sorted by start
+    position, each one pointing to its innermost enclosing entry, so a query takes a binary
+    search followed by a walk up the (shallow) enclosing entries. Overlapping ranges are reported
+    with a ValueError when the entries are sorted, on the first query after they were added.
+    """
+
+    def __init__(self, entries=()):
+        self.entries = list(entries)
+        self._starts = None
+        self._parents = None
+
+    def add(self, start, end, kind, scope, name, type_annotation):
+        if end < start:
+            raise ValueError("The range of {} ends at {} before its start {}".format(name, end, start))
+        self.entries.append(TypeEntry(start, end, kind, scope, name, type_annotation))
+        self._starts = None
+
+    def add_node(self, node, length, kind, scope, name, type_annotation):
+        """Add an entry for an AST node spanning `length` characters on its line"""
+        if not hasattr(node, 'lineno'):
+            # Nodes created by the inference do not appear in the source
+            return
+        start = (node.lineno, node.col_offset)
+        self.add(start, (node.lineno, node.col_offset + length), kind, scope, name, type_annotation)
+
+    def _build(self):
+        self.entries.sort(key=lambda e: (e.start, -e.end[0], -e.end[1]))
+        self._starts = [entry.start for entry in self.entries]
+        self._parents = []
+        enclosing = []
+        for i, entry in enumerate(self.entries):
+            while enclosing and self.entries[enclosing[-1]].end < entry.end:
+                outer = self.entries[enclosing.pop()]
+                if outer.end > entry.start:
+                    # The entry starts inside `outer` and ends after it
+                    self._starts = None
+                    raise ValueError("The ranges of {} and {} overlap".format(outer, entry))
+            self._parents.append(enclosing[-1] if enclosing else -1)
+            enclosing.append(i)
+
+    def _enclosing(self, position):
+        """Return the indexes of the entries containing the given position, innermost first"""
+        if self._starts is None:
+            self._build()
+        result = []
+        i = bisect_right(self._starts, position) - 1
+        while i != -1:
+            if position < self.entries[i].end:
+                result.append(i)
+            i = self._parents[i]
+        return result
+
+    def at(self, line, column):
+        """Return the innermost entry containing the given position, or None"""
+        enclosing = self._enclosing((line, column))
+        return self.entries[enclosing[0]] if enclosing else None
+
+    def in_range(self, start, end):
+        """Return the entries overlapping the range from `start` to `end`, both (line, column) pairs"""
+        if end <= start:
+            return []
+        if self._starts is None:
+            self._build()
+        first = bisect_right(self._starts, start)
+        last = bisect_left(self._starts, end, lo=first)
+        outer = [self.entries[i] for i in reversed(self._enclosing(start))]
+        return outer + self.entries[first:last]
+
+    def to_json(self):
+        return json.dumps([[e.start[0], e.start[1], e.end[0], e.end[1], e.kind, e.scope, e.name, e.type]
+                           for e in self.entries], separators=(',', ':'))
+
+    @staticmethod
+    def from_json(text):
+        return TypeIndex(TypeEntry((e[0], e[1]), (e[2], e[3]), *e[4:]) for e in json.loads(text))
+
+    def __len__(self):
+        return len(self.entries)
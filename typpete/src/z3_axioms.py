@@ -1,5 +1,5 @@
 from typpete.src.constants import ALIASES
-from typpete.src.z3_types import And, Or, Implies, Not
+from z3.z3fast import And, Or, Implies, Not, Eq, app
 
 
 def overloading_axioms(left, right, result, method_name, types):
@@ -20,14 +20,14 @@ def overloading_axioms(left, right, result, method_name, types):
             method_type = types.instance_attributes[t][method_name]
 
             # the left operand is the instance
-            instance = getattr(types.type_sort, "type_arg_0")(types.all_types[t])
+            instance = app(types.type_sort.type_arg_0, types.all_types[t])
 
             # the right operand is a subtype of the `other` arg in the magic method
-            other_type = getattr(types.type_sort, "func_2_arg_2")(method_type)
+            other_type = app(types.type_sort.func_2_arg_2, method_type)
 
             # the result is the return type of the magic method
-            return_type = getattr(types.type_sort, "func_2_return")(method_type)
-            axioms.append(And(left == instance, types.subtype(right, other_type), result == return_type))
+            return_type = app(types.type_sort.func_2_return, method_type)
+            axioms.append(And(Eq(left, instance), types.subtype(right, other_type), Eq(result, return_type)))
     return axioms
 
 
@@ -414,7 +414,7 @@ def one_type_instantiation(class_name, args, result, types, tvs):
     if class_name not in types.config.class_type_params:
 
         # Get the instance accessor from the type_sort data type.
-        instance = getattr(types.type_sort, "type_arg_0")(types.all_types[class_name])
+        instance = app(types.type_sort.type_arg_0, types.all_types[class_name])
 
 
 
@@ -422,7 +422,7 @@ def one_type_instantiation(class_name, args, result, types, tvs):
 
         # Get the default args count
         defaults_accessor = getattr(types.type_sort, "func_{}_defaults_args".format(init_args_count))
-        default_count = defaults_accessor(init_func)
+        default_count = app(defaults_accessor, init_func)
 
         rem_args_count = init_args_count - len(args) - 1
         rem_args = []
@@ -430,13 +430,14 @@ def one_type_instantiation(class_name, args, result, types, tvs):
             arg_idx = len(args) + i + 2
             # Get the default arg type
             arg_accessor = getattr(types.type_sort, "func_{}_arg_{}".format(init_args_count, arg_idx))
-            rem_args.append(arg_accessor(init_func))
+            rem_args.append(app(arg_accessor, init_func))
 
         all_args = (instance,) + args + tuple(rem_args) + (types.none,)  # The return type of __init__ is None
         z3_func_args = (default_count,) + all_args
         return And(
-                  result == instance,
-                  init_func == types.funcs[len(args) + len(rem_args) + 1](z3_func_args), default_count >= rem_args_count)
+                  Eq(result, instance),
+                  Eq(init_func, app(types.funcs[len(args) + len(rem_args) + 1], *z3_func_args)),
+                  default_count >= rem_args_count)
     else:
 
 
@@ -467,7 +468,7 @@ def instance_axioms(called, args, result, types, tvs):
         if t in types.config.class_type_params:
             continue
         axioms.append(And(one_type_instantiation(t, args, result, types, tvs),
-                          called == types.all_types[t]))
+                          Eq(called, types.all_types[t])))
     return axioms
 
 
@@ -485,13 +486,13 @@ def function_call_axioms(called, args, result, types):
         for j in range(rem_args):
             arg_idx = len(args) + j + 1
             arg_accessor = getattr(types.type_sort, "func_{}_arg_{}".format(i, arg_idx))  # Get the default arg type
-            rem_args_types += (arg_accessor(called),)
+            rem_args_types += (app(arg_accessor, called),)
 
         # Get the default args count accessor
         defaults_accessor = getattr(types.type_sort, "func_{}_defaults_args".format(i))
-        defaults_count = defaults_accessor(called)
+        defaults_count = app(defaults_accessor, called)
         # Add the axioms for function call, default args count, and arguments subtyping.
-        axiom = And(called == types.funcs[i]((defaults_accessor(called),) + tuple(args) + rem_args_types + (result,)),
+        axiom = And(Eq(called, app(types.funcs[i], defaults_count, *args, *rem_args_types, result)),
                     defaults_count >= rem_args)
         axioms.append(axiom)
     return axioms
@@ -600,9 +601,9 @@ def class_call_axioms(called, args, result, types):
         # Check that `__call__` is a method in the current class.
         if "__call__" in types.class_to_funcs[t]:
             call_type = types.instance_attributes[t]["__call__"]
-            instance = getattr(types.type_sort, "type_arg_0")(types.all_types[t])
+            instance = app(types.type_sort.type_arg_0, types.all_types[t])
             args_types = (instance,) + args
-            axioms.append(And(called == instance,
+            axioms.append(And(Eq(called, instance),
                               Or(function_call_axioms(call_type, args_types, result, types))))
     return axioms
 
@@ -619,7 +620,7 @@ def staticmethod_call(class_type, args, result, attr, types):
             decorators = types.class_to_funcs[t][attr][1]
             if "staticmethod" in decorators:
                 attr_type = types.instance_attributes[t][attr]
-                axioms.append(And(class_type == types.all_types[t],
+                axioms.append(And(Eq(class_type, types.all_types[t]),
                                   Or(function_call_axioms(attr_type, args, result, types))))
     return axioms
 
@@ -654,14 +655,14 @@ def instancemethod_call(instance, args, result, attr, types, tvs):
                     receiver_subtype = types.subtype(instance, rec_type)
                     axioms.append(And(receiver_subtype, Or(*generic_call_axioms(attr_type, list(args), result, types, tvs))))
                 else:
-                    axioms.append(And(instance == types.type_sort.type_arg_0(types.all_types[t]),
+                    axioms.append(And(Eq(instance, app(types.type_sort.type_arg_0, types.all_types[t])),
                                      Or(function_call_axioms(attr_type, args, result, types))),
                                  )
 
         # Otherwise, check if it is an instance attribute, if so add call axioms with no receiver
         elif attr in types.instance_attributes[t]:
             attr_type = types.instance_attributes[t][attr]
-            axioms.append(And(instance == types.type_sort.type_arg_0(types.all_types[t]),
+            axioms.append(And(Eq(instance, app(types.type_sort.type_arg_0, types.all_types[t])),
                               Or(function_call_axioms(attr_type, args[1:], result, types) + class_call_axioms(attr_type, args[1:], result, types))))
     return axioms
 
@@ -694,7 +695,7 @@ def attribute(instance, attr, result, types):
                     substituted = types.subst(substituted, param, arg)
                 axioms.append(And(instance == type_instance, generic_attr_type, result == substituted))
                 continue
-            type_instance = getattr(types.type_sort, "type_arg_0")(types.all_types[t])
+            type_instance = app(types.type_sort.type_arg_0, types.all_types[t])
 
             # Check if it is a property access
             if attr in types.class_to_funcs[t] and "property" in \
@@ -702,16 +703,16 @@ def attribute(instance, attr, result, types):
                 # Set the attribute type to be the return type of the property method
                 method_type = types.instance_attributes[t][attr]
                 arg_accessor = getattr(types.type_sort, "func_1_arg_1")
-                axioms.append(And(instance == type_instance,
+                axioms.append(And(Eq(instance, type_instance),
                                   method_type == types.funcs[1](0,
                                                                 arg_accessor(method_type),
                                                                 result)))
             else:
                 attr_type = types.instance_attributes[t][attr]
-                axioms.append(And(instance == type_instance, result == attr_type))
+                axioms.append(And(Eq(instance, type_instance), Eq(result, attr_type)))
         if t in types.class_attributes and attr in types.class_attributes[t]:
             # class access. Ex: A.x
             class_type = types.all_types[t]
             attr_type = types.class_attributes[t][attr]
-            axioms.append(And(instance == class_type, result == attr_type))
+            axioms.append(And(Eq(instance, class_type), Eq(result, attr_type)))
     return Or(axioms)
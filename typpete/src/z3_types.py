@@ -13,31 +13,62 @@ from typpete.src.constants import ALIASES
 from typpete.src.pre_analysis import PreAnalyzer
 from typpete.src.stubs.stubs_handler import StubsHandler
 
-from z3 import *
+from z3 import (And, Ast, AstVector, BoolRef, BoolSort, Const, Datatype, DatatypeRef, ForAll, FuncDeclRef, Function,
+                Goal, Implies, IntSort, Optimize, Or, Solver, Z3_mk_and, Z3_optimize_assert, Z3_solver_assert, sat,
+                set_param, unknown, unsat)
+import z3.z3 as z3_api
+from z3.z3 import _get_args
+from z3.z3fast import app
 
 class Dummy():
     pass
 
-set_param("auto-config", False)
-set_param("smt.mbqi", False)
-set_param("model.v2", True)
-set_param("smt.phase_selection", 0)
-set_param("smt.restart_strategy", 0)
-set_param("smt.restart_factor", 1.5)
-set_param("smt.arith.random_initial_value", True)
-set_param("smt.case_split", 3)
-set_param("smt.delay_units", True)
-set_param("smt.delay_units_threshold", 16)
-set_param("nnf.sk_hack", True)
-set_param("smt.qi.eager_threshold", 100)
-set_param("smt.qi.cost",  "(+ weight generation)")
-set_param("type_check", True)
-set_param("smt.bv.reflect", True)
+# The global Z3 parameters of the inference, set by `set_z3_params`
+Z3_PARAMS = [
+    ("auto-config", False),
+    ("smt.mbqi", False),
+    ("model.v2", True),
+    ("smt.phase_selection", 0),
+    ("smt.restart_strategy", 0),
+    ("smt.restart_factor", 1.5),
+    ("smt.arith.random_initial_value", True),
+    ("smt.case_split", 3),
+    ("smt.delay_units", True),
+    ("smt.delay_units_threshold", 16),
+    ("nnf.sk_hack", True),
+    ("smt.qi.eager_threshold", 100),
+    ("smt.qi.cost", "(+ weight generation)"),
+    ("type_check", True),
+    ("smt.bv.reflect", True),
+]
 # set_option(":smt.qi.profile", True)
 # set_param(verbose=10)
 
 
+def set_z3_params():
+    """Set the global Z3 parameters of the inference
+
+    Z3 reads them when the context and the solvers are created, so this is called when an inference
+    session starts, before any Z3 object is created.
+    """
+    for name, value in Z3_PARAMS:
+        set_param(name, value)
+
+
+def reset_main_context():
+    """Replace the main Z3 context, which the solvers are built on, with a new one
+
+    Long-running sessions call this before every inference, so that the declarations and the constraints
+    of a program are released with it, instead of piling up in a context shared by all the inferences.
+    The new context is created with the parameters set by the next solver.
+    """
+    z3_api._main_ctx = None
+
+
 class DummyOptimize:
+    def __init__(self):
+        self.soft_constraints = []
+
     def add_soft(self, *args, **kwargs):
         pass
 
@@ -45,11 +76,86 @@ class DummyOptimize:
         pass
 
 
+def assert_conjunction(ctx, assert_function, handle, constraints):
+    """Assert the given constraints as a single conjunction, with two calls to Z3 instead of a few per constraint
+
+    Z3 splits the conjunctions asserted at the top level, so this is the same as asserting them one by one.
+
+    :param assert_function: The Z3 API function asserting a formula with the solver handle, e.g., `Z3_solver_assert`
+    """
+    args = (Ast * len(constraints))()
+    for i, constraint in enumerate(constraints):
+        args[i] = constraint.as_ast()
+    # Keep a reference to the conjunction until it is asserted
+    conjunction = BoolRef(Z3_mk_and(ctx.ref(), len(constraints), args), ctx)
+    assert_function(ctx.ref(), handle, conjunction.as_ast())
+
+
+class TypesOptimize(Optimize):
+    """Optimize solver keeping its soft constraints with their weights, to export them
+
+    The hard constraints are asserted in bulk before the constraints are checked, or a scope is pushed.
+    The ones added since the last push are dropped if the scope is popped first.
+    """
+
+    def __init__(self, ctx=None):
+        super().__init__(ctx)
+        self.soft_constraints = []
+        self.pending_constraints = []
+
+    def add(self, *args):
+        """Add hard constraints, taking the same arguments as `Optimize.add`"""
+        bool_sort = BoolSort(self.ctx)
+        for arg in _get_args(args):
+            if isinstance(arg, (Goal, AstVector)):
+                self.pending_constraints.extend(arg)
+            elif isinstance(arg, BoolRef):
+                self.pending_constraints.append(arg)
+            else:
+                # E.g., a Python bool
+                self.pending_constraints.append(bool_sort.cast(arg))
+
+    def add_soft(self, arg, weight="1", id=None):
+        self.soft_constraints.append((arg, weight))
+        return super().add_soft(arg, weight, id)
+
+    def assert_pending(self):
+        if self.pending_constraints:
+            assert_conjunction(self.ctx, Z3_optimize_assert, self.optimize, self.pending_constraints)
+            self.pending_constraints = []
+
+    def push(self):
+        self.assert_pending()
+        super().push()
+
+    def pop(self):
+        self.pending_constraints = []
+        super().pop()
+
+    def check(self):
+        self.assert_pending()
+        return super().check()
+
+    def assertions(self):
+        self.assert_pending()
+        return super().assertions()
+
+    def sexpr(self):
+        self.assert_pending()
+        return super().sexpr()
+
+
 class TypesSolver(Solver):
-    """Z3 solver that has all the type system axioms initialized."""
+    """Z3 solver that has all the type system axioms initialized.
+
+    The constraints are collected in `all_assertions`, and asserted in bulk at the next push or check.
+    The ones added since the last push are not asserted if the scope is popped first, but they stay in
+    `all_assertions`, like the constraints asserted in a popped scope.
+    """
 
     def __init__(self, tree, solver=None, ctx=None, base_folder='',
                  type_params:dict=None, class_type_params: dict=None):
+        set_z3_params()
         super().__init__(solver, ctx)
         self.set(auto_config=False, mbqi=False, unsat_core=True)
         self.element_id = 0     # unique id given to newly created Z3 consts
@@ -57,6 +163,7 @@ class TypesSolver(Solver):
         self.assertions_errors = {}
         self.stubs_handler = StubsHandler()
         analyzer = PreAnalyzer(tree, base_folder, self.stubs_handler)
+        self.module_graph = analyzer.module_graph
         if type_params is None:
             type_params = {}
         if class_type_params is None:
@@ -67,17 +174,19 @@ class TypesSolver(Solver):
         self.z3_types.abstract_types = self.config.abstract_classes
         for cls in self.z3_types.classes:
             cls_func = self.z3_types.classes[cls]
-            if not isinstance(cls_func, z3.FuncDeclRef):
+            if not isinstance(cls_func, FuncDeclRef):
                 self.z3_types.all_types[cls] = self.z3_types.type(cls_func)
             else:
                 self.z3_types.all_types[cls] = Dummy()
         self.annotation_resolver = AnnotationResolver(self.z3_types)
         if config['enable_soft_constraints']:
-            self.optimize = Optimize(ctx)
+            self.optimize = TypesOptimize(ctx)
         else:
             self.optimize = DummyOptimize()
         # self.optimize.set("timeout", 30000)
         self.all_assertions = []
+        # The number of constraints of `all_assertions` which are asserted in the solver
+        self.asserted_count = 0
         self.forced = set()
         self.init_axioms()
 
@@ -87,9 +196,34 @@ class TypesSolver(Solver):
         self.assertions_errors[assertion] = fail_message
         self.optimize.add(*args)
         to_add = Implies(assertion, And(*args))
-        super().add(to_add)
         self.all_assertions.append(to_add)
 
+    def assert_pending(self):
+        """Assert the constraints added since the last push or check"""
+        if self.asserted_count < len(self.all_assertions):
+            assert_conjunction(self.ctx, Z3_solver_assert, self.solver, self.all_assertions[self.asserted_count:])
+            self.asserted_count = len(self.all_assertions)
+
+    def push(self):
+        self.assert_pending()
+        super().push()
+
+    def pop(self, num=1):
+        self.asserted_count = len(self.all_assertions)
+        super().pop(num)
+
+    def check(self, *assumptions):
+        self.assert_pending()
+        return super().check(*assumptions)
+
+    def assertions(self):
+        self.assert_pending()
+        return super().assertions()
+
+    def sexpr(self):
+        self.assert_pending()
+        return super().sexpr()
+
     def init_axioms(self):
         for st in self.z3_types.subtyping:
             self.add(st, fail_message="Subtyping error")
@@ -177,12 +311,16 @@ class Z3Types:
 
         method_sort = Datatype("Method")
         method_sort.declare('m__none')
+        # Methods with the same name in several classes share their constructor
+        method_names = {'m__none'}
 
         self.tvs = set()
         self.method_ids = {}
         self.tv_to_method = {}
         for m, vrs in config.type_params.items():
-            method_sort.declare('m__' + m)
+            if 'm__' + m not in method_names:
+                method_names.add('m__' + m)
+                method_sort.declare('m__' + m)
             for v in vrs:
                 tv = getattr(type_sort, 'tv' + str(v))
                 self.tvs.add(tv)
@@ -212,7 +350,9 @@ class Z3Types:
                 setattr(self, 'tv' + str(v), tv)
             for func in config.class_to_funcs[c]:
                 name = 'm__' + func
-                method_sort.declare(name)
+                if name not in method_names:
+                    method_names.add(name)
+                    method_sort.declare(name)
 
 
         method_sort = method_sort.create()
@@ -260,7 +400,7 @@ class Z3Types:
 
 
     def subtype(self, t0, t1):
-        res = self._subtype(self.current_method, t0, t1)
+        res = app(self._subtype, self.current_method, t0, t1)
         return res
 
 
@@ -272,28 +412,29 @@ class Z3Types:
         where child nodes are subclasses. The root will be object.
         """
         graph = ClassNode('object', [], type_sort)
-        to_cover = list(all_classes.keys())
-        covered = {'object'}
-        i = 0
-        while i < len(to_cover):
-            current = to_cover[i]
-            i += 1
-            bases = all_classes[current]
-            cont = False
-            for base in bases:
-                if base not in covered:
-                    cont = True
-                    break
-            if cont:
-                to_cover.append(current)
-                continue
-
+        nodes = {'object': graph}
+        in_progress = set()
+
+        def create_node(current):
+            # Create the nodes of the bases first, so that every class is handled exactly once
+            if current in nodes:
+                return nodes[current]
+            if current not in all_classes:
+                raise TypeError("Class {} is not defined".format(current))
+            if current in in_progress:
+                raise TypeError("Cyclic inheritance involving class {}".format(current))
+            in_progress.add(current)
             current_node = ClassNode(current, [], type_sort)
-            for base in bases:
-                base_node = graph.find(base)
+            for base in all_classes[current]:
+                base_node = create_node(base)
                 current_node.parents.append(base_node)
                 base_node.children.append(current_node)
-            covered.add(current)
+            in_progress.remove(current)
+            nodes[current] = current_node
+            return current_node
+
+        for cls in all_classes:
+            create_node(cls)
         return graph
 
     def create_subst_axioms(self, tree):
@@ -481,7 +622,8 @@ def declare_type_sort(max_tuple_length, max_function_args, classes_to_base, type
     type_sort.declare("int")
     type_sort.declare("bool")
 
-    for tp in type_vars.values():
+    # Type variables with the same name in several modules share their constructor
+    for tp in OrderedDict.fromkeys(type_vars.values()):
         type_sort.declare("tv" + tp)
 
     # for cls, vrs in type_params.items():
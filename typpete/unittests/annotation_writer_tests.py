@@ -0,0 +1,171 @@
+import ast
+import unittest
+from collections import namedtuple
+
+from typpete import api
+from typpete.src.annotation_writer import annotate_source
+from typpete.src.type_index import TypeIndex
+
+# The parts of a module context read by `annotate_source`
+ModuleContext = namedtuple('ModuleContext', ['type_index', 'generic_bases', 'used_type_vars'])
+
+
+def module_context(entries, generic_bases=(), used_type_vars=None):
+    index = TypeIndex()
+    for start, end, kind, scope, name, type_annotation in entries:
+        index.add(start, end, kind, scope, name, type_annotation)
+    return ModuleContext(index, list(generic_bases), used_type_vars or {})
+
+
+def import_from(module, *names):
+    return ast.ImportFrom(module=module, names=[ast.alias(name=name, asname=None) for name in names], level=0)
+
+
+class TestAnnotateSource(unittest.TestCase):
+    """Tests of the insertion of given annotations into a source"""
+
+    def test_already_annotated(self):
+        source = "def f(a: int, b):\n    return a\n\n\nx: int = f(1, 2)\n"
+        context = module_context([
+            ((1, 0), (3, 0), 'return', '', 'f', 'int'),
+            ((1, 6), (1, 7), 'argument', 'f', 'a', 'str'),
+            ((1, 14), (1, 15), 'argument', 'f', 'b', 'int'),
+            ((5, 0), (5, 1), 'variable', '', 'x', 'str'),
+        ])
+        self.assertEqual(annotate_source(source, context, []),
+                         "def f(a: int, b: int) -> int:\n    return a\n\n\nx: int = f(1, 2)\n")
+
+    def test_header_after_docstring(self):
+        source = '"""Module\n\ndocstring"""\nimport os\nx = [os.sep]\n'
+        context = module_context([((5, 0), (5, 1), 'variable', '', 'x', 'List[str]')])
+        self.assertEqual(annotate_source(source, context, [import_from('typing', 'List')]),
+                         '"""Module\n\ndocstring"""\nfrom typing import List\nimport os\n'
+                         'x: List[str] = [os.sep]\n')
+
+    def test_header_in_empty_module(self):
+        context = module_context([], used_type_vars={'tv0': 'object'})
+        self.assertEqual(annotate_source('"""Docstring"""', context, [import_from('typing', 'TypeVar')]),
+                         '"""Docstring"""\nfrom typing import TypeVar\nT0 = TypeVar(\'T0\', bound=object)\n')
+
+    def test_generic_bases(self):
+        source = "class A:\n    pass\n\n\nclass B(A):\n    pass\n\n\nclass C():\n    pass\n"
+        classes = [node for node in ast.parse(source).body]
+        context = module_context([], [(cls, "Generic[T{}]".format(i)) for i, cls in enumerate(classes)])
+        self.assertEqual(annotate_source(source, context, []),
+                         "class A(Generic[T0]):\n    pass\n\n\nclass B(A, Generic[T1]):\n    pass\n\n\n"
+                         "class C(Generic[T2]):\n    pass\n")
+
+    def test_decorated_function(self):
+        source = "class A:\n    @staticmethod\n    def f(a):\n        return a\n"
+        context = module_context([
+            ((3, 4), (5, 0), 'return', 'A', 'f', 'int'),
+            ((3, 10), (3, 11), 'argument', 'A.f', 'a', 'int'),
+        ])
+        self.assertEqual(annotate_source(source, context, []),
+                         "class A:\n    @staticmethod\n    def f(a: int) -> int:\n        return a\n")
+
+    def test_non_ascii_positions(self):
+        # The AST column offsets count UTF-8 bytes
+        source = "é = 'à'; ü = 1\n"
+        context = module_context([
+            ((1, 0), (1, 2), 'variable', '', 'é', 'str'),
+            ((1, 11), (1, 13), 'variable', '', 'ü', 'int'),
+        ])
+        self.assertEqual(annotate_source(source, context, []), "ü: int\né: str = 'à'; ü = 1\n")
+
+
+class TestPreserveFormatting(unittest.TestCase):
+    """Tests of the annotated sources of inferred programs with `preserve_formatting`"""
+
+    def assert_annotated(self, source, expected):
+        result = api.infer_source({"program": source}, "program", preserve_formatting=True)
+        self.assertEqual(result.typed_sources["program"], expected)
+
+    def test_chained_assignment(self):
+        # Like in the regenerated sources, the targets of chained assignments are not annotated
+        self.assert_annotated("a = b = 1\nc = a\n", "a = b = 1\nc: int = a\n")
+
+    def test_semicolons(self):
+        self.assert_annotated("x = 1; y = 'a'\nz = [x]; w = y\n",
+                              "from typing import List\ny: str\nx: int = 1; y = 'a'\n"
+                              "w: str\nz: List[int] = [x]; w = y\n")
+
+    def test_tuple_assignments(self):
+        self.assert_annotated("p, q = 1, 'a'\n(r, s) = (2.0, p)\n[t, u] = [q, q]\n",
+                              "p: int\nq: str\np, q = 1, 'a'\nr: float\ns: int\n(r, s) = (2.0, p)\n"
+                              "[t, u] = [q, q]\n")
+
+    def test_multi_line_def_with_comments(self):
+        self.assert_annotated("def f(a,  # the first\n"
+                              "      b=1,\n"
+                              "      # a comment line\n"
+                              "      c='x'):  # end\n"
+                              "    # the body\n"
+                              "    return a + b\n"
+                              "\n"
+                              "\n"
+                              "f(1, 2, 'y')\n",
+                              "def f(a: int,  # the first\n"
+                              "      b: int=1,\n"
+                              "      # a comment line\n"
+                              "      c: str='x') -> int:  # end\n"
+                              "    # the body\n"
+                              "    return a + b\n"
+                              "\n"
+                              "\n"
+                              "f(1, 2, 'y')\n")
+
+    def test_continuation_lines(self):
+        self.assert_annotated("def g(x, \\\n"
+                              "      y):\n"
+                              "    return x + \\\n"
+                              "        y\n"
+                              "\n"
+                              "\n"
+                              "v = g(1,\n"
+                              "      2)\n"
+                              "w = \\\n"
+                              "    v\n",
+                              "def g(x: int, \\\n"
+                              "      y: int) -> int:\n"
+                              "    return x + \\\n"
+                              "        y\n"
+                              "\n"
+                              "\n"
+                              "v: int = g(1,\n"
+                              "      2)\n"
+                              "w: int = \\\n"
+                              "    v\n")
+
+    def test_non_ascii(self):
+        self.assert_annotated('"""Ünïcödé"""\n'
+                              "def héllo(näme):\n"
+                              "    return 'grüß ' + näme\n"
+                              "\n"
+                              "\n"
+                              "msg = héllo('wörld'); n = len(msg)\n",
+                              '"""Ünïcödé"""\n'
+                              "def héllo(näme: str) -> str:\n"
+                              "    return 'grüß ' + näme\n"
+                              "\n"
+                              "\n"
+                              "n: int\n"
+                              "msg: str = héllo('wörld'); n = len(msg)\n")
+
+    def test_attributes(self):
+        self.assert_annotated("class A:\n"
+                              "    def __init__(self, v):\n"
+                              "        self.v = v\n"
+                              "\n"
+                              "\n"
+                              "a = A(1)\n",
+                              "class A:\n"
+                              "    def __init__(self: 'A', v: int) -> None:\n"
+                              "        self.v: int = v\n"
+                              "\n"
+                              "\n"
+                              "a: A = A(1)\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import threading
+import unittest
+
+from typpete import api
+from typpete.src.config import config
+from typpete.src.import_handler import ImportHandler
+
+
+SOURCES = {"shapes": "class Square:\n    def __init__(self, side):\n        self.side = side\n",
+           "main": "from shapes import Square\n\n\ndef area(s):\n    return s.side * s.side\n\n\na = area(Square(2))\n"}
+
+
+class TestInferSource(unittest.TestCase):
+    def test_releases_modules(self):
+        result = api.infer_source(SOURCES, "main")
+        self.assertTrue(result.sat)
+        self.assertEqual(result.type_at("main", 8, 0), "int")
+        self.assertEqual(ImportHandler.cached_modules, {})
+        self.assertEqual(ImportHandler.cached_asts, {})
+
+    def test_restores_config(self):
+        previous_config = dict(config)
+        api.infer_source(SOURCES, "main", enable_soft_constraints=not config["enable_soft_constraints"])
+        self.assertEqual(config, previous_config)
+
+    def test_concurrent_calls(self):
+        sources = dict(SOURCES, main=SOURCES["main"].replace("Square(2)", "Square('a')"))
+        results = {}
+
+        def infer(name, program):
+            results[name] = api.infer_source(program, "main")
+
+        threads = [threading.Thread(target=infer, args=(name, program))
+                   for name, program in [("int", SOURCES), ("str", sources)]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(results["int"].sat)
+        self.assertIn("def area(s: Square) -> int:", results["int"].typed_sources["main"])
+        # 'a' * 'a' is not well-typed
+        self.assertFalse(results["str"].sat)
+
+
+if __name__ == '__main__':
+    unittest.main()
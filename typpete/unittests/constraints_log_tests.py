@@ -0,0 +1,68 @@
+import ast
+import os
+import shutil
+import tempfile
+import unittest
+
+from z3 import Optimize, get_param, set_param, z3printer
+
+from typpete.inference_runner import collect_constraints
+from typpete.src import constraints_log
+from typpete.src.import_handler import ImportHandler
+
+PROGRAM = "def f(x):\n    return [x, x, x, x, x, x, x, x, x, x, x, x, x, x, x, x, x, x, x, x]\n\n\ny = f(1)\n"
+
+
+class TestConstraintsLog(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.solver, _ = collect_constraints(ast.parse(PROGRAM))
+        ImportHandler.reset()
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_log(self, log_format, compress=False):
+        return constraints_log.write_constraints_log(self.solver, os.path.join(self.folder, 'log'), log_format,
+                                                     compress)
+
+    def test_text(self):
+        options = (z3printer._PP.max_lines, z3printer._PP.max_width, z3printer._Formatter.max_depth,
+                   z3printer._Formatter.max_args, z3printer._Formatter.max_visited)
+        with open(self.write_log("text")) as f:
+            log = f.read()
+        # The global options of the pretty printer are left unchanged
+        self.assertEqual((z3printer._PP.max_lines, z3printer._PP.max_width, z3printer._Formatter.max_depth,
+                          z3printer._Formatter.max_args, z3printer._Formatter.max_visited), options)
+        self.assertEqual(log.count("\n; "), len(self.solver.all_assertions) - 1)
+        self.assertNotIn("...", log)
+
+    def test_smt2(self):
+        set_param("pp.single_line", False)
+        path = self.write_log("smt2")
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(get_param("pp.single_line"), "false")
+        start = next(i for i, line in enumerate(lines) if line.startswith("; "))
+        self.assertEqual(len(lines) - start, 2 * len(self.solver.all_assertions))
+        self.assertTrue(all(line.startswith("(assert ") for line in lines[start + 1::2]))
+        # The log declares everything used by the constraints
+        self.assertTrue(all(line.startswith("(declare-") for line in lines[:start]))
+        problem = Optimize()
+        problem.from_file(path)
+        self.assertEqual(len(problem.assertions()), len(self.solver.all_assertions))
+
+    def test_compressed(self):
+        path = self.write_log("smt2", compress=True)
+        self.assertTrue(path.endswith(".smt2.gz"))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            self.write_log("json")
+
+
+if __name__ == '__main__':
+    unittest.main()
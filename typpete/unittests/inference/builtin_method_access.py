@@ -0,0 +1,9 @@
+x = [1, 2]
+add = x.append
+s = "abc"
+upper = s.upper
+
+# x := List[int]
+# s := str
+# add := None
+# upper := None
@@ -0,0 +1,7 @@
+def square(x):
+    return x * x
+
+
+pow = square
+
+# unsat
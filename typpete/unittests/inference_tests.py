@@ -146,6 +146,18 @@ def suite():
         if os.path.basename(path) != "__init__.py":
             name = path.split("/")[-1]
             s.addTest(TestInference(path, name))
+    # The unit tests of the other components
+    s.addTests(unittest.defaultTestLoader.loadTestsFromNames([
+        'typpete.unittests.api_tests',
+        'typpete.unittests.annotation_writer_tests',
+        'typpete.unittests.constraints_log_tests',
+        'typpete.unittests.lsp_server_tests',
+        'typpete.unittests.module_cache_tests',
+        'typpete.unittests.result_writer_tests',
+        'typpete.unittests.smt2_problem_tests',
+        'typpete.unittests.type_index_tests',
+        'typpete.unittests.z3_types_tests',
+    ]))
     runner = unittest.TextTestRunner(verbosity=0)
     runner.run(s)
 
@@ -0,0 +1,185 @@
+import io
+import json
+import unittest
+
+from typpete.lsp_server import LanguageServer
+from typpete.src.config import config
+from typpete.src.import_handler import ImportHandler
+
+URI = 'file:///tmp/typpete_lsp_tests/program.py'
+
+PROGRAM = """def f(x):
+    return x + 1
+
+
+class A:
+    def g(self, s):
+        return s.upper()
+
+
+y = f(2)
+z = A().g('a')
+"""
+
+
+def frame(message):
+    """Return the message with its header, as sent by the editor"""
+    body = json.dumps(message).encode('utf-8')
+    return 'Content-Length: {}\r\n\r\n'.format(len(body)).encode('ascii') + body
+
+
+def read_frames(data):
+    """Return the messages in the output stream of the server"""
+    messages = []
+    while data:
+        header, data = data.split(b'\r\n\r\n', 1)
+        length = int(header.decode('ascii').split(':')[1])
+        messages.append(json.loads(data[:length].decode('utf-8')))
+        data = data[length:]
+    return messages
+
+
+def did_open(text):
+    return {"jsonrpc": "2.0", "method": "textDocument/didOpen",
+            "params": {"textDocument": {"uri": URI, "text": text}}}
+
+
+def did_change(text):
+    return {"jsonrpc": "2.0", "method": "textDocument/didChange",
+            "params": {"textDocument": {"uri": URI}, "contentChanges": [{"text": text}]}}
+
+
+def hover(request_id, line, character=4):
+    return {"jsonrpc": "2.0", "id": request_id, "method": "textDocument/hover",
+            "params": {"textDocument": {"uri": URI}, "position": {"line": line, "character": character}}}
+
+
+def signature(source):
+    return {"contents": {"kind": "markdown", "value": "```python\n{}\n```".format(source)}}
+
+
+def inferred_type(source):
+    return signature(source)
+
+
+class TestLanguageServer(unittest.TestCase):
+    def setUp(self):
+        self.budget = config["lsp_latency_budget"]
+
+    def tearDown(self):
+        config["lsp_latency_budget"] = self.budget
+        ImportHandler.reset()
+
+    @staticmethod
+    def run_server(messages):
+        """Send the messages to the server, and return its responses by id and its log messages
+
+        The scheduled inferences run right after every message, instead of in the background thread,
+        so that every hover is answered with the result of the messages before it.
+        """
+        output = io.BytesIO()
+        server = LanguageServer(io.BytesIO(b''.join(frame(message) for message in messages)), output)
+        while True:
+            message = server.read_message()
+            if message is None:
+                break
+            server.handle(message)
+            while server.pending:
+                uri, kind = server.pending.popitem(last=False)
+                server.infer_document(server.documents[uri], kind)
+        responses = {}
+        logs = []
+        for message in read_frames(output.getvalue()):
+            if "id" in message:
+                responses[message["id"]] = message
+            else:
+                logs.append(message["params"]["message"])
+        return responses, logs
+
+    def test_initialize(self):
+        responses, _ = self.run_server([{"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {}}])
+        self.assertTrue(responses[1]["result"]["capabilities"]["hoverProvider"])
+
+    def test_unsupported_method(self):
+        responses, _ = self.run_server([{"jsonrpc": "2.0", "id": 1, "method": "textDocument/completion",
+                                         "params": {}}])
+        self.assertEqual(responses[1]["error"]["code"], -32601)
+
+    def test_hover_after_open(self):
+        responses, _ = self.run_server([did_open(PROGRAM), hover(1, 1), hover(2, 6), hover(3, 9)])
+        self.assertEqual(responses[1]["result"], signature("def f(x: int) -> int:"))
+        self.assertEqual(responses[2]["result"], signature("def g(self: 'A', s: str) -> str:"))
+        # Outside of any function
+        self.assertIsNone(responses[3]["result"])
+
+    def test_hover_types(self):
+        responses, _ = self.run_server([did_open(PROGRAM), hover(1, 1, 11), hover(2, 5, 16), hover(3, 6, 15),
+                                        hover(4, 9, 0), hover(5, 10, 0), hover(6, 1, 13)])
+        # A name read in an expression, and an argument at its definition
+        self.assertEqual(responses[1]["result"], inferred_type("x: int"))
+        self.assertEqual(responses[2]["result"], inferred_type("s: str"))
+        self.assertEqual(responses[3]["result"], inferred_type("s: str"))
+        self.assertEqual(responses[4]["result"], inferred_type("y: int"))
+        self.assertEqual(responses[5]["result"], inferred_type("z: str"))
+        # Not a variable
+        self.assertEqual(responses[6]["result"], signature("def f(x: int) -> int:"))
+
+    def test_hover_attribute(self):
+        program = ("class B:\n    def __init__(self, v):\n        self.v = v\n\n"
+                   "    def get(self):\n        return self.v\n\n\nb = B(1).get()\n")
+        responses, _ = self.run_server([did_open(program), hover(1, 2, 13), hover(2, 5, 20), hover(3, 5, 16)])
+        self.assertEqual(responses[1]["result"], inferred_type("v: int"))
+        self.assertEqual(responses[2]["result"], inferred_type("v: int"))
+        self.assertEqual(responses[3]["result"], inferred_type("self: 'B'"))
+
+    def test_hover_types_after_change(self):
+        config["lsp_latency_budget"] = 60000
+        changed = PROGRAM.replace("    return x + 1", "    w = [x]\n    return w")
+        responses, logs = self.run_server([did_open(PROGRAM), did_change(changed), hover(1, 1, 4),
+                                           hover(2, 7, 15), hover(3, 10, 0), hover(4, 6, 16)])
+        self.assertEqual(logs, [])
+        self.assertEqual(responses[1]["result"], inferred_type("w: List[int]"))
+        # The types of the unchanged method, moved one line down
+        self.assertEqual(responses[2]["result"], inferred_type("s: str"))
+        self.assertEqual(responses[4]["result"], inferred_type("s: str"))
+        self.assertEqual(responses[3]["result"], inferred_type("y: List[int]"))
+
+    def test_hover_types_of_unchanged_lines(self):
+        # Only a comment is added, so the file is not inferred again
+        responses, _ = self.run_server([did_open(PROGRAM), did_change("# A comment\n" + PROGRAM), hover(1, 10, 0),
+                                        hover(2, 0, 0)])
+        self.assertEqual(responses[1]["result"], inferred_type("y: int"))
+        self.assertIsNone(responses[2]["result"])
+
+    def test_hover_unknown_document(self):
+        responses, _ = self.run_server([hover(1, 1)])
+        self.assertIsNone(responses[1]["result"])
+
+    def test_hover_after_change(self):
+        config["lsp_latency_budget"] = 60000
+        changed = PROGRAM.replace("return x + 1", "return [x]")
+        responses, logs = self.run_server([did_open(PROGRAM), did_change(changed), hover(1, 1), hover(2, 6)])
+        self.assertEqual(responses[1]["result"], signature("def f(x: int) -> List[int]:"))
+        self.assertEqual(responses[2]["result"], signature("def g(self: 'A', s: str) -> str:"))
+        self.assertEqual(logs, [])
+
+    def test_hover_after_change_over_budget(self):
+        config["lsp_latency_budget"] = 0
+        program = "def f(x):\n    return x + 1\n\n\ndef g(s):\n    return s\n\n\ny = f(2)\nz = g('a')\n"
+        changed = program.replace("return x + 1", "return g(x)")
+        responses, logs = self.run_server([did_open(program), hover(1, 5), did_change(changed), hover(2, 1),
+                                           hover(3, 5)])
+        self.assertEqual(responses[1]["result"], signature("def g(s: str) -> str:"))
+        self.assertEqual(len(logs), 1)
+        self.assertIn("exceeded the latency budget", logs[0])
+        # The whole file is inferred again, without the last signature of `g`
+        self.assertEqual(responses[2]["result"], signature("def f(x: object) -> object:"))
+        self.assertEqual(responses[3]["result"], signature("def g(s: object) -> object:"))
+
+    def test_hover_after_syntax_error(self):
+        responses, _ = self.run_server([did_open(PROGRAM), did_change("def f(x:\n"), hover(1, 0)])
+        self.assertIsNone(responses[1]["result"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import ast
+import unittest
+
+from typpete.src import module_cache
+from typpete.src.import_handler import parse_source
+from typpete.src.pre_analysis import ModuleSummary
+
+
+def store(path, source):
+    tree, source_hash, _ = parse_source(source, path)
+    module_cache.store_module(source_hash, tree, ModuleSummary(list(ast.walk(tree)), tree), path)
+    return source_hash
+
+
+class TestMemoryCache(unittest.TestCase):
+    def setUp(self):
+        module_cache.memory = module_cache.MemoryCache(max_modules=2)
+
+    def tearDown(self):
+        module_cache.memory = None
+
+    def test_load(self):
+        source_hash = store("a.py", "x = 1\n")
+        tree, summary = module_cache.load_module(source_hash, "a.py")
+        self.assertIs(summary.module, tree)
+        self.assertIsInstance(tree.body[0], ast.Assign)
+        # Not looked up by hash alone
+        self.assertIsNone(module_cache.load_module(source_hash))
+
+    def test_edited_module(self):
+        old_hash = store("a.py", "x = 1\n")
+        new_hash = store("a.py", "x = 'a'\n")
+        self.assertEqual(len(module_cache.memory), 1)
+        self.assertIsNone(module_cache.load_module(old_hash, "a.py"))
+        self.assertIsNotNone(module_cache.load_module(new_hash, "a.py"))
+
+    def test_least_recently_used(self):
+        a_hash = store("a.py", "x = 1\n")
+        b_hash = store("b.py", "y = 1\n")
+        module_cache.load_module(a_hash, "a.py")
+        store("c.py", "z = 1\n")
+        self.assertEqual(len(module_cache.memory), 2)
+        self.assertIsNotNone(module_cache.load_module(a_hash, "a.py"))
+        self.assertIsNone(module_cache.load_module(b_hash, "b.py"))
+
+    def test_parsed_from_memory(self):
+        source_hash = store("a.py", "x = 1\n")
+        tree, parsed_hash, imports = parse_source("x = 1\n", "a.py")
+        self.assertEqual(parsed_hash, source_hash)
+        self.assertIsNotNone(getattr(tree, '_summary', None))
+
+
+if __name__ == '__main__':
+    unittest.main()
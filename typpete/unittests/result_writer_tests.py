@@ -0,0 +1,91 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from typpete.src import result_writer
+from typpete.src.type_index import TypeIndex
+
+HEADER = {"file": "shapes", "check": "sat"}
+TIMINGS = {"collection": 0.5, "solving": 1.25}
+
+SHAPES_RECORD = {
+    "module": "shapes",
+    "functions": {"Square.__init__": {"args": [["self", "'Square'"], ["x", "int"]], "return": "None"},
+                  "area": {"args": [["s", "Square"]], "return": "int"}},
+    "variables": {"unit": "Square", "area.result": "int"},
+    "class_attributes": {"Square": {"x": "int"}},
+}
+
+EMPTY_RECORD = {"module": "pkg.empty", "functions": {}, "variables": {}, "class_attributes": {}}
+
+
+def shapes_index():
+    """Return the type index of the module described by SHAPES_RECORD, with the entries out of order"""
+    index = TypeIndex()
+    index.add((7, 0), (10, 0), 'return', '', 'area', 'int')
+    index.add((7, 9), (7, 10), 'argument', 'area', 's', 'Square')
+    index.add((8, 4), (8, 10), 'assignment', 'area', 'result', 'int')
+    index.add((2, 4), (5, 0), 'return', 'Square', '__init__', 'None')
+    index.add((2, 17), (2, 21), 'argument', 'Square.__init__', 'self', "'Square'")
+    index.add((2, 23), (2, 24), 'argument', 'Square.__init__', 'x', 'int')
+    index.add((3, 8), (3, 14), 'attribute', 'Square', 'x', 'int')
+    index.add((12, 0), (12, 4), 'assignment', '', 'unit', 'Square')
+    return index
+
+
+class TestResultWriter(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_results(self, result_format, modules):
+        path = os.path.join(self.folder, 'results.' + result_writer.FILE_EXTENSIONS[result_format])
+        writer = result_writer.ResultWriter(path, result_format, HEADER)
+        for module_name, type_index in modules:
+            writer.write_module(module_name, type_index)
+        writer.close(TIMINGS)
+        return path
+
+    def test_module_record(self):
+        self.assertEqual(result_writer.get_module_record("shapes", shapes_index()), SHAPES_RECORD)
+
+    def test_json(self):
+        path = self.write_results("json", [("shapes", shapes_index()), ("pkg.empty", TypeIndex())])
+        with open(path) as f:
+            results = json.load(f)
+        self.assertEqual(results, dict(HEADER, version=result_writer.FORMAT_VERSION,
+                                       modules=[SHAPES_RECORD, EMPTY_RECORD], timings=TIMINGS))
+
+    def test_json_without_modules(self):
+        path = self.write_results("json", [])
+        with open(path) as f:
+            results = json.load(f)
+        self.assertEqual(results["modules"], [])
+        self.assertEqual(results["timings"], TIMINGS)
+
+    def test_binary(self):
+        path = self.write_results("binary", [("shapes", shapes_index()), ("pkg.empty", TypeIndex())])
+        records = list(result_writer.read_binary_results(path))
+        self.assertEqual(records, [
+            (result_writer.HEADER_RECORD, dict(HEADER, version=result_writer.FORMAT_VERSION)),
+            (result_writer.MODULE_RECORD, SHAPES_RECORD),
+            (result_writer.MODULE_RECORD, EMPTY_RECORD),
+            (result_writer.TIMINGS_RECORD, TIMINGS),
+        ])
+
+    def test_binary_wrong_file(self):
+        path = self.write_results("json", [])
+        with self.assertRaises(ValueError):
+            list(result_writer.read_binary_results(path))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            result_writer.ResultWriter(os.path.join(self.folder, 'results.txt'), "text", HEADER)
+
+
+if __name__ == '__main__':
+    unittest.main()
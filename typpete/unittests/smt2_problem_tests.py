@@ -0,0 +1,137 @@
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from typpete import inference_runner
+from typpete.src import smt2_problem
+from typpete.src.config import config
+from typpete.src.import_handler import ImportHandler
+
+SHAPES = {
+    "main": "from shapes import Square, area\n"
+            "\n"
+            "\n"
+            "def scale(s, k):\n"
+            "    return Square(s.x * k)\n"
+            "\n"
+            "\n"
+            "sq = scale(Square(2), 3); total = area(sq)\n"
+            "pair, count = (sq, [total]), 1\n",
+    "shapes": "class Square:\n"
+              "    def __init__(self, x):\n"
+              "        self.x = x\n"
+              "\n"
+              "\n"
+              "def area(s):\n"
+              "    return s.x * s.x\n",
+}
+
+UNSAT = {
+    "main": "def f(x):\n"
+            "    return x + 1\n"
+            "\n"
+            "\n"
+            "a = f(1)\n"
+            "b = f('s')\n",
+}
+
+
+class TestProblemReplay(unittest.TestCase):
+    """Tests replaying exported problems, compared with the direct inference of the same programs"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.chdir(self.folder)
+        self.config = dict(config)
+        self.argv = sys.argv
+        # The flags are set in the configuration, not on the command line
+        sys.argv = ["typpete"]
+
+    def tearDown(self):
+        sys.argv = self.argv
+        config.clear()
+        config.update(self.config)
+        ImportHandler.reset()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def infer(self, sources):
+        """Infer the types of the `main` module directly, exporting its problem
+
+        :return: The check result, and the messages of the violated constraints
+        """
+        for module, source in sources.items():
+            with open(module + '.py', 'w') as f:
+                f.write(source)
+        config.update(emit_smt2=True, preserve_formatting=True, result_format="json")
+        ImportHandler.reset()
+        output = io.StringIO()
+        with redirect_stdout(output):
+            inference_runner.run_inference("main", "")
+        with open("inference_output/main_result.json") as f:
+            check = json.load(f)["check"]
+        lines = output.getvalue().splitlines()
+        errors = [lines[i + 1] for i, line in enumerate(lines) if line == "Unsat:"]
+        return check, errors
+
+    @staticmethod
+    def replay():
+        """Solve the exported problem and decode its modules
+
+        :return: The check result, the messages of the violated constraints and the annotated sources by path
+        """
+        path = "inference_output/main_problem.smt2"
+        metadata = smt2_problem.read_metadata(path)
+        check, model, errors = smt2_problem.solve_problem(path, metadata)
+        decoder = smt2_problem.ProblemDecoder(metadata, model)
+        sources = {}
+        for module_metadata in metadata["modules"]:
+            module = decoder.decode_module(module_metadata)
+            sources[module_metadata["output"]] = decoder.get_typed_source(module_metadata, module)
+        return str(check), errors, sources
+
+    @staticmethod
+    def read_output(path):
+        with open(os.path.join("inference_output", path)) as f:
+            return f.read()
+
+    def test_replay(self):
+        check, errors = self.infer(SHAPES)
+        replay_check, replay_errors, sources = self.replay()
+        self.assertEqual(replay_check, check)
+        self.assertEqual(errors, [])
+        self.assertEqual(replay_errors, [])
+        self.assertEqual(sorted(sources), ["main.py", "shapes.py"])
+        for path, source in sources.items():
+            self.assertEqual(source, self.read_output(path))
+        self.assertIn("def scale(s: Square, k: int) -> Square:", sources["main.py"])
+        self.assertIn("def area(s: Square) -> int:", sources["shapes.py"])
+
+    def test_replay_unsat(self):
+        check, errors = self.infer(UNSAT)
+        replay_check, replay_errors, sources = self.replay()
+        self.assertEqual(check, "unsat")
+        self.assertEqual(replay_check, "unsat")
+        # The relaxed problem may have several optimal models, violating as many constraints
+        self.assertEqual(len(replay_errors), len(errors))
+        self.assertGreater(len(replay_errors), 0)
+        metadata = smt2_problem.read_metadata("inference_output/main_problem.smt2")
+        messages = {message for _, message in metadata["tracking"]}
+        self.assertTrue(set(replay_errors) <= messages)
+        self.assertIn("def f(x: ", sources["main.py"])
+
+    def test_not_a_problem(self):
+        with open("main.py", "w") as f:
+            f.write("x = 1\n")
+        with self.assertRaises(ValueError):
+            smt2_problem.read_metadata("main.py")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+
+from typpete.src.type_index import TypeIndex
+
+
+def make_index(*ranges):
+    """Return an index with an entry named after its position in `ranges` for each range,
+    given as (start line, start column, end line, end column)"""
+    index = TypeIndex()
+    for i, (start_line, start_column, end_line, end_column) in enumerate(ranges):
+        index.add((start_line, start_column), (end_line, end_column), 'assignment', '', str(i), 'int')
+    return index
+
+
+def names(entries):
+    return [entry.name for entry in entries]
+
+
+class TestTypeIndex(unittest.TestCase):
+    def test_nested(self):
+        # A function with two arguments and a nested function containing an assignment
+        index = make_index((1, 0, 10, 0), (1, 6, 1, 7), (1, 9, 1, 10), (2, 4, 5, 0), (3, 8, 3, 9))
+        self.assertEqual(index.at(1, 0).name, '0')
+        self.assertEqual(index.at(1, 6).name, '1')
+        self.assertEqual(index.at(1, 8).name, '0')
+        self.assertEqual(index.at(3, 8).name, '4')
+        self.assertEqual(index.at(3, 9).name, '3')
+        self.assertEqual(index.at(7, 0).name, '0')
+        self.assertEqual(names(index.in_range((3, 0), (4, 0))), ['0', '3', '4'])
+
+    def test_nested_same_start(self):
+        index = make_index((1, 0, 1, 3), (1, 0, 1, 10))
+        self.assertEqual(index.at(1, 0).name, '0')
+        self.assertEqual(index.at(1, 5).name, '1')
+
+    def test_adjacent(self):
+        index = make_index((1, 0, 1, 5), (1, 5, 1, 8), (2, 0, 4, 0), (4, 0, 5, 0))
+        self.assertEqual(index.at(1, 4).name, '0')
+        self.assertEqual(index.at(1, 5).name, '1')
+        self.assertEqual(index.at(3, 20).name, '2')
+        self.assertEqual(index.at(4, 0).name, '3')
+        self.assertEqual(names(index.in_range((1, 5), (4, 0))), ['1', '2'])
+
+    def test_misses(self):
+        index = make_index((2, 0, 4, 0), (2, 4, 2, 5), (6, 4, 6, 5))
+        self.assertIsNone(index.at(1, 0))
+        self.assertIsNone(index.at(4, 0))
+        self.assertIsNone(index.at(6, 3))
+        self.assertIsNone(index.at(6, 5))
+        self.assertIsNone(index.at(100, 0))
+        self.assertEqual(names(index.in_range((4, 0), (6, 4))), [])
+        self.assertEqual(names(index.in_range((6, 4), (6, 4))), [])
+        self.assertIsNone(TypeIndex().at(1, 0))
+
+    def test_overlapping(self):
+        index = make_index((1, 0, 3, 0), (2, 0, 4, 0))
+        with self.assertRaises(ValueError):
+            index.at(2, 0)
+        # Until the entries are fixed, every query reports the overlap
+        with self.assertRaises(ValueError):
+            index.in_range((1, 0), (2, 0))
+
+    def test_overlapping_behind_nested(self):
+        index = make_index((1, 0, 5, 0), (1, 4, 1, 8), (3, 0, 7, 0))
+        with self.assertRaises(ValueError):
+            index.at(1, 4)
+
+    def test_reversed_range(self):
+        with self.assertRaises(ValueError):
+            make_index((2, 0, 1, 0))
+
+    def test_added_after_query(self):
+        index = make_index((1, 0, 1, 5))
+        self.assertIsNone(index.at(2, 0))
+        index.add((2, 0), (2, 5), 'assignment', '', 'later', 'str')
+        self.assertEqual(index.at(2, 0).name, 'later')
+
+    def test_json(self):
+        index = make_index((1, 0, 10, 0), (1, 6, 1, 7), (3, 8, 3, 9))
+        loaded = TypeIndex.from_json(index.to_json())
+        self.assertEqual(loaded.entries, index.entries)
+        self.assertEqual(loaded.at(1, 6).name, '1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from z3 import AstVector, Bool, Int, sat, unsat
+
+from typpete.src.z3_types import TypesOptimize
+
+
+class TestTypesOptimize(unittest.TestCase):
+    def test_coerced_constraints(self):
+        x = Int('x')
+        vector = AstVector()
+        vector.push(x > 0)
+        vector.push(x < 10)
+        optimize = TypesOptimize()
+        optimize.add(True, vector)
+        optimize.add([x != 1, Bool('b')])
+        self.assertEqual(optimize.check(), sat)
+        model = optimize.model()
+        self.assertTrue(0 < model[x].as_long() < 10)
+        self.assertNotEqual(model[x].as_long(), 1)
+        optimize.add(False)
+        self.assertEqual(optimize.check(), unsat)
+
+    def test_popped_constraints(self):
+        x = Int('x')
+        optimize = TypesOptimize()
+        optimize.add(x > 0)
+        optimize.push()
+        optimize.add(x < 0)
+        optimize.pop()
+        self.assertEqual(optimize.check(), sat)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,9 @@
 from .z3 import *
 
-from . import z3num
-from . import z3poly
+# z3num, z3poly, z3rcf and z3util are not imported with the package, since most clients
+# never use them: import them explicitly, e.g., `from z3 import z3util`.
 from . import z3printer
-from . import z3rcf
 from . import z3types
-from . import z3util
 
 # generated files
 from . import z3core
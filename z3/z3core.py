@@ -1,7 +1,6 @@
 # Automatically generated file
 import sys, os
 import ctypes
-import pkg_resources
 from .z3types import *
 from .z3consts import *
 
@@ -11,7 +10,7 @@ _lib = None
 def lib():
   global _lib
   if _lib is None:
-    _dirs = ['.', pkg_resources.resource_filename('z3', 'lib'), os.path.join(sys.prefix, 'lib'), None]
+    _dirs = ['.', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'), os.path.join(sys.prefix, 'lib'), None]
     for _dir in _dirs:
       try:
         init(_dir)
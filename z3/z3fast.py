@@ -0,0 +1,112 @@
+############################################
+# Z3 Python interface, unchecked expression constructors
+############################################
+"""
+Fast-path versions of the most frequently used expression constructors.
+
+The constructors of the `z3` module accept Python values, coerce the
+sorts of their arguments and check that they belong to the same context,
+on every call. The ones in this module skip all of that: their arguments
+must already be Z3 expressions of the expected sorts, of a single context.
+The errors reported by Z3 itself are still raised as Z3Exception.
+
+The checked API stays the default, this module is meant for generators
+of large numbers of formulas whose arguments are known to be well-sorted.
+
+>>> from z3.z3fast import And, Eq, app
+>>> f = Function('f', IntSort(), BoolSort())
+>>> x, y = Ints('x y')
+>>> And(app(f, x), Eq(x, y))
+And(f(x), x == y)
+"""
+from .z3 import *
+from .z3 import _get_args
+
+# The expression classes of the applications of uninterpreted functions and datatype
+# constructors/accessors, by sort kind
+_APP_REFS = {
+    Z3_BOOL_SORT: BoolRef,
+    Z3_INT_SORT: ArithRef,
+    Z3_REAL_SORT: ArithRef,
+    Z3_BV_SORT: BitVecRef,
+    Z3_ARRAY_SORT: ArrayRef,
+    Z3_DATATYPE_SORT: DatatypeRef,
+}
+
+def _ast_array(args):
+    sz = len(args)
+    _args = (Ast * sz)()
+    for i in range(sz):
+        _args[i] = args[i].ast
+    return _args, sz
+
+def _to_app_ref(a, ctx):
+    """Wrap the AST of an application which is neither a numeral nor a quantifier."""
+    ctx_ref = ctx.ref()
+    return _APP_REFS.get(Z3_get_sort_kind(ctx_ref, Z3_get_sort(ctx_ref, a)), ExprRef)(a, ctx)
+
+def app(f, *args):
+    """Create the application of the function declaration `f` to the given expressions.
+
+    Unlike `f(*args)`, the arguments are not cast to the domain of `f`.
+
+    >>> f = Function('f', IntSort(), IntSort(), IntSort())
+    >>> x = Int('x')
+    >>> app(f, x, app(f, x, x))
+    f(x, f(x, x))
+    """
+    _args, sz = _ast_array(args)
+    return _to_app_ref(Z3_mk_app(f.ctx.ref(), f.ast, sz, _args), f.ctx)
+
+def Eq(a, b):
+    """Create the Z3 expression `a == b`, for expressions `a` and `b` of the same sort.
+
+    >>> x, y = Ints('x y')
+    >>> Eq(x, y)
+    x == y
+    """
+    return BoolRef(Z3_mk_eq(a.ctx.ref(), a.ast, b.ast), a.ctx)
+
+def Implies(a, b, ctx=None):
+    """Create a Z3 implies expression.
+
+    >>> p, q = Bools('p q')
+    >>> Implies(p, q)
+    Implies(p, q)
+    """
+    return BoolRef(Z3_mk_implies(a.ctx.ref(), a.ast, b.ast), a.ctx)
+
+def Not(a, ctx=None):
+    """Create a Z3 not expression.
+
+    >>> p = Bool('p')
+    >>> Not(p)
+    Not(p)
+    """
+    return BoolRef(Z3_mk_not(a.ctx.ref(), a.ast), a.ctx)
+
+def And(*args):
+    """Create a Z3 and-expression of Boolean expressions, given as arguments or as a single list.
+
+    >>> p, q, r = Bools('p q r')
+    >>> And(p, q, r)
+    And(p, q, r)
+    >>> And([p, q])
+    And(p, q)
+    """
+    args = _get_args(args)
+    ctx = args[0].ctx if len(args) > 0 else main_ctx()
+    _args, sz = _ast_array(args)
+    return BoolRef(Z3_mk_and(ctx.ref(), sz, _args), ctx)
+
+def Or(*args):
+    """Create a Z3 or-expression of Boolean expressions, given as arguments or as a single list.
+
+    >>> p, q, r = Bools('p q r')
+    >>> Or(p, q, r)
+    Or(p, q, r)
+    """
+    args = _get_args(args)
+    ctx = args[0].ctx if len(args) > 0 else main_ctx()
+    _args, sz = _ast_array(args)
+    return BoolRef(Z3_mk_or(ctx.ref(), sz, _args), ctx)